@@ -0,0 +1,60 @@
+# -*- coding: UTF_8 -*-
+# Compare la lecture trame par trame (3 recvAll par trame) et ApFrameReader
+# sur une rafale de petites réponses ANS_TCP_* arrivant à la suite
+# usage : python3 ./bench_frame_reader.py
+
+# Add project path for accessing to the lib
+import sys, os
+project_name="/ub_tcpip_py_api"
+webui_path = os.path.abspath(__file__).split(project_name)[0]+project_name
+sys.path.insert(0, webui_path)
+#-------------------------------------
+
+import socket
+from threading import Thread
+from struct import pack, unpack, calcsize
+from time import perf_counter
+
+from ub_lib_v1.ap_socket import recvAll
+from ub_lib_v1.ap_frame_reader import ApFrameReader
+
+N_FRAMES = 100000
+PAYLOAD = b'\x00'*16 # ex. ANS_TCP_MEAS_TEMP
+
+
+def sender(_socket):
+	frame = pack('i', 1) + pack('i', 20208) + pack('i', len(PAYLOAD)) + PAYLOAD
+	_socket.sendall(frame*N_FRAMES)
+
+
+def recv_legacy(_socket):
+	for _ in range(N_FRAMES):
+		flag = unpack('i', recvAll(_socket, calcsize('i')))[0]
+		while flag < 2 and flag != 0:
+			flag = unpack('i', recvAll(_socket, calcsize('i')))[0]
+		tab_size = unpack('i', recvAll(_socket, calcsize('i')))[0]
+		recvAll(_socket, tab_size)
+
+
+def recv_reader(_socket):
+	reader = ApFrameReader(_socket)
+	for _ in range(N_FRAMES):
+		reader.read_frame()
+
+
+def run(_name, _recv_function):
+	sock_a, sock_b = socket.socketpair()
+	th = Thread(target=sender, args=(sock_a,))
+	th.start()
+	t0 = perf_counter()
+	_recv_function(sock_b)
+	delta = perf_counter() - t0
+	th.join()
+	sock_a.close()
+	sock_b.close()
+	print("%-14s : %9.0f frames/s (%.2f us/frame)"%(_name, N_FRAMES/delta, delta/N_FRAMES*1e6))
+
+
+if __name__ == '__main__':
+	run("recvAll x3", recv_legacy)
+	run("ApFrameReader", recv_reader)
@@ -0,0 +1,53 @@
+# -*- coding: UTF_8 -*-
+# Latence de push + extraction par flag en fonction du nombre de trames en
+# attente dans le buffer de réception (mode non sélectif, consommateur lent) :
+# liste parcourue linéairement (ancien recv_buffer) vs ApFrameStore
+# usage : python3 ./bench_frame_store.py
+
+# Add project path for accessing to the lib
+import sys, os
+project_name="/ub_tcpip_py_api"
+webui_path = os.path.abspath(__file__).split(project_name)[0]+project_name
+sys.path.insert(0, webui_path)
+#-------------------------------------
+
+from time import perf_counter
+
+from ub_lib_v1.ap_frame_store import ApFrameStore
+
+BACKLOGS = [10, 100, 1000, 10000, 50000]
+N_OPS = 2000
+BACKLOG_FLAG = 20300 # ex. ANS_TCP_PROFILE_INST jamais lu
+FLAG = 20208 # ex. ANS_TCP_MEAS_TEMP attendu
+
+
+def pop_list(_buffer, _flag):
+	for i in range(len(_buffer)):
+		if _buffer[i][0] == _flag:
+			return _buffer.pop(i)
+
+
+def run_list(_backlog):
+	buffer = [(BACKLOG_FLAG, 0, b'')]*_backlog
+	t0 = perf_counter()
+	for _ in range(N_OPS):
+		buffer.append((FLAG, 0, b''))
+		pop_list(buffer, FLAG)
+	return (perf_counter() - t0)/N_OPS
+
+
+def run_store(_backlog):
+	store = ApFrameStore()
+	for _ in range(_backlog):
+		store.push((BACKLOG_FLAG, 0, b''))
+	t0 = perf_counter()
+	for _ in range(N_OPS):
+		store.push((FLAG, 0, b''))
+		store.pop(FLAG)
+	return (perf_counter() - t0)/N_OPS
+
+
+if __name__ == '__main__':
+	print("%8s   %16s   %16s"%("backlog", "list (us/frame)", "store (us/frame)"))
+	for backlog in BACKLOGS:
+		print("%8d   %16.2f   %16.2f"%(backlog, run_list(backlog)*1e6, run_store(backlog)*1e6))
@@ -0,0 +1,98 @@
+# -*- coding: UTF_8 -*-
+# Débit de trames reçues (frames/s) en fonction du nombre de connexions :
+# un thread ApSocketRecvTh par socket vs un seul InstrumentHub
+# usage : python3 ./bench_hub.py
+
+# Add project path for accessing to the lib
+import sys, os
+project_name="/ub_tcpip_py_api"
+webui_path = os.path.abspath(__file__).split(project_name)[0]+project_name
+sys.path.insert(0, webui_path)
+#-------------------------------------
+
+import selectors
+import socket
+from multiprocessing import Process, Queue
+from struct import pack
+from time import sleep, perf_counter
+
+from ub_lib_v1.ap_data_socket import ApDataSocket
+from ub_lib_v1.ap_instrument_hub import InstrumentHub
+from ub_lib_v1.ub_class_template import UbClassTemplate
+
+DURATION = 2.
+N_CONNECTIONS = [1, 5, 10, 20, 40]
+BURST = pack('i', 20300) + pack('i', 32) + bytes(32)
+BURST = BURST*64
+
+
+def streaming_driver(_queue):
+	""" driver simulé (dans un autre process) inondant chaque client de trames """
+	server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+	server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+	server.bind(('127.0.0.1', 0))
+	server.listen(128)
+	_queue.put(server.getsockname()[1])
+	selector = selectors.DefaultSelector()
+	selector.register(server, selectors.EVENT_READ)
+	while True:
+		for key, mask in selector.select():
+			if key.fileobj is server:
+				connection, _ = server.accept()
+				connection.setblocking(False)
+				selector.register(connection, selectors.EVENT_READ | selectors.EVENT_WRITE)
+				continue
+			try:
+				if mask & selectors.EVENT_READ and not key.fileobj.recv(65536):
+					raise OSError
+				if mask & selectors.EVENT_WRITE:
+					key.fileobj.send(BURST)
+			except BlockingIOError:
+				pass
+			except OSError:
+				selector.unregister(key.fileobj)
+				key.fileobj.close()
+
+
+class counting_data_socket(ApDataSocket):
+	def __init__(self, *args, **kwargs):
+		ApDataSocket.__init__(self, *args, **kwargs)
+		self.n_frames = 0
+
+	def push_recv_buffer(self, flag, tab_size, data, **kwargs):
+		self.n_frames += 1
+		return ApDataSocket.push_recv_buffer(self, flag, tab_size, data, **kwargs)
+
+
+def run(_port, _n_connections, _hub):
+	sockets = [counting_data_socket('127.0.0.1', _port, _hub=_hub) for _ in range(_n_connections)]
+	for data_socket in sockets:
+		data_socket.wait_connexion()
+	sleep(0.2)
+	n0 = sum(data_socket.n_frames for data_socket in sockets)
+	t0 = perf_counter()
+	sleep(DURATION)
+	n = sum(data_socket.n_frames for data_socket in sockets) - n0
+	delta = perf_counter() - t0
+	for data_socket in sockets:
+		data_socket.close()
+	sleep(0.2)
+	return n/delta
+
+
+if __name__ == '__main__':
+	UbClassTemplate.global_debug_active = False
+	queue = Queue()
+	driver = Process(target=streaming_driver, args=(queue,), daemon=True)
+	driver.start()
+	port = queue.get()
+
+	print("%12s %18s %18s"%("connections", "threads frames/s", "hub frames/s"))
+	for n_connections in N_CONNECTIONS:
+		rate_threads = run(port, n_connections, None)
+		hub = InstrumentHub()
+		hub.start()
+		rate_hub = run(port, n_connections, hub)
+		hub.stop()
+		print("%12d %18.0f %18.0f"%(n_connections, rate_threads, rate_hub))
+	driver.terminate()
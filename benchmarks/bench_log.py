@@ -0,0 +1,85 @@
+# -*- coding: UTF_8 -*-
+# Coût des messages de UbClassTemplate (appels/s), écriture dans /dev/null :
+# - debug désactivé
+# - info avec l'ancienne implémentation (inspect.stack, print et flush à chaque message)
+# - info avec UbStreamLogBackend (écriture synchrone)
+# - info avec UbQueueLogBackend (buffer circulaire vidé par un thread), avec et
+#   sans l'appelant (log_caller)
+# usage : python3 ./bench_log.py
+
+# Add project path for accessing to the lib
+import sys, os
+project_name="/ub_tcpip_py_api"
+webui_path = os.path.abspath(__file__).split(project_name)[0]+project_name
+sys.path.insert(0, webui_path)
+#-------------------------------------
+
+import inspect
+import re
+from datetime import datetime
+from time import perf_counter, strftime
+
+from ub_lib_v1.ub_class_template import UbClassTemplate, UbStreamLogBackend, UbQueueLogBackend, set_log_backend, txt_regular_blue
+
+N_CALLS = 20000
+
+
+class bench_object(UbClassTemplate):
+	def __init__(self):
+		UbClassTemplate.__init__(self)
+		self.flag_debug_mess=False
+		self.debug_marker_start=txt_regular_blue
+
+	## \brief __print_log avant l'ajout des backends
+	def old_info(self, pattern_string, *string_args):
+		self.__old_print_log(pattern_string, string_args)
+
+	def __old_print_log(self, pattern_string, string_args):
+		d = datetime.now()
+		tic = strftime("%y/%m/%d %H:%M:%S.", d.timetuple()) + ("%06d" % d.microsecond)
+		classname = self.__class__.__name__
+		stack = inspect.stack()
+		method = stack[2][3]
+		parent = ""
+		if len(stack)>3:
+			parent = re.sub(r'.py', r'', re.sub(r'.*/', r'', stack[3][1])) + "/" + stack[3][3]
+		output_message = pattern_string % string_args
+		print ("[%s] %s%s::%s:%s %s\n<< %s"% (tic, self.debug_marker_start, classname, method, self.debug_marker_end, output_message, parent) )
+		sys.stdout.flush()
+
+
+def calls_per_s(_function):
+	start = perf_counter()
+	for i in range(N_CALLS):
+		_function("frame %d received (size = %d)", i, 1024)
+	return N_CALLS/(perf_counter() - start)
+
+
+if __name__ == '__main__':
+	obj = bench_object()
+	devnull = open(os.devnull, 'w')
+	stdout = sys.stdout
+	results = []
+
+	results.append(("debug (disabled)", calls_per_s(obj.debug)))
+
+	sys.stdout = devnull
+	try:
+		results.append(("info (inspect.stack+print)", calls_per_s(obj.old_info)))
+	finally:
+		sys.stdout = stdout
+
+	set_log_backend(UbStreamLogBackend(devnull))
+	results.append(("info (stream backend)", calls_per_s(obj.info)))
+
+	queue_backend = UbQueueLogBackend(devnull, _capacity=N_CALLS)
+	set_log_backend(queue_backend)
+	results.append(("info (queue backend)", calls_per_s(obj.info)))
+	UbClassTemplate.log_caller = True
+	results.append(("info (queue, log_caller)", calls_per_s(obj.info)))
+	UbClassTemplate.log_caller = False
+	queue_backend.flush()
+
+	print("%-28s %12s"%("call", "calls/s"))
+	for name, rate in results:
+		print("%-28s %12.0f"%(name, rate))
@@ -0,0 +1,82 @@
+# -*- coding: UTF_8 -*-
+# Décodage des chunks de profil (data_profile_t.interpret_chunk, profils/s) en
+# fonction du nombre de cellules, pour chaque décodeur disponible, et avec
+# ProfileBatch (chunks décodés par lots de BATCH_SIZE), puis LazyProfile
+# lorsque seule l'amplitude est lue
+# usage : python3 ./bench_profile.py
+
+# Add project path for accessing to the lib
+import sys, os
+project_name="/ub_tcpip_py_api"
+webui_path = os.path.abspath(__file__).split(project_name)[0]+project_name
+sys.path.insert(0, webui_path)
+#-------------------------------------
+
+import array
+import random
+from struct import pack
+from time import perf_counter
+
+from ub_lib_v1.ub_profile import data_profile_t, LazyProfile, ProfileBatch, np, PROFILE_DECODER_PYTHON, PROFILE_DECODER_STDLIB, PROFILE_DECODER_NUMPY
+
+N_CELLS = [50, 200, 1000]
+DURATION = 1. # durée de chaque mesure (s)
+BATCH_SIZE = 1000
+
+
+def build_chunk(_n_cells):
+	rand = random.Random(_n_cells)
+	arrays = array.array('f', [rand.uniform(-2., 2.) for i in range(_n_cells)]).tobytes() \
+		+ array.array('f', [rand.uniform(-0.5, 4.) for i in range(_n_cells)]).tobytes() \
+		+ array.array('i', [rand.randint(-2**31, 2**31-1) for i in range(_n_cells)]).tobytes()
+	return pack('iIIii', (25<<8)|1, len(arrays), 0, 1500000000, 0) + arrays
+
+
+def decode_eager(_config, _chunk, _decoder):
+	data_profile_t(_config, _decoder=_decoder).interpret_chunk(_chunk)
+
+def decode_lazy_amplitude(_config, _chunk, _decoder):
+	LazyProfile(_config, _chunk, _decoder).amplitude
+
+
+def profiles_per_s(_decoder, _n_cells, _decode=decode_eager):
+	config = {'n_vol': _n_cells, 'n_subvol': 1, 'n_ech': 0}
+	chunk = build_chunk(_n_cells)
+	count = 0
+	start = perf_counter()
+	while perf_counter() - start < DURATION:
+		for i in range(100):
+			_decode(config, chunk, _decoder)
+		count += 100
+	return count/(perf_counter() - start)
+
+
+def batch_profiles_per_s(_n_cells):
+	config = {'n_vol': _n_cells, 'n_subvol': 1, 'n_ech': 0}
+	chunks = [build_chunk(_n_cells)]*BATCH_SIZE
+	count = 0
+	start = perf_counter()
+	while perf_counter() - start < DURATION:
+		ProfileBatch(config, chunks)
+		count += BATCH_SIZE
+	return count/(perf_counter() - start)
+
+
+if __name__ == '__main__':
+	decoders = [PROFILE_DECODER_PYTHON, PROFILE_DECODER_STDLIB]
+	if np is not None:
+		decoders.append(PROFILE_DECODER_NUMPY)
+	else:
+		print("NumPy is not installed: %s decoder skipped"%PROFILE_DECODER_NUMPY)
+
+	print("%-8s" % "cells" + "".join("%14s"%("%s/s"%decoder) for decoder in decoders) + ("%14s"%"batch/s" if np is not None else ""))
+	for n_cells in N_CELLS:
+		line = "%-8d" % n_cells + "".join("%14.0f"%profiles_per_s(decoder, n_cells) for decoder in decoders)
+		if np is not None:
+			line += "%14.0f"%batch_profiles_per_s(n_cells)
+		print(line)
+
+	print("\nLazyProfile, amplitude only")
+	print("%-8s" % "cells" + "".join("%14s"%("%s/s"%decoder) for decoder in decoders))
+	for n_cells in N_CELLS:
+		print("%-8d" % n_cells + "".join("%14.0f"%profiles_per_s(decoder, n_cells, decode_lazy_amplitude) for decoder in decoders))
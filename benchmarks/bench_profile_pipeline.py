@@ -0,0 +1,67 @@
+# -*- coding: UTF_8 -*-
+# Débit (profils/s) de ProfilePipeline en fonction du nombre de processus, pour
+# des profils avec données Doppler brutes (N_VOL volumes, N_ECH échantillons) :
+# décodage puis puissance moyenne de chaque volume calculée à partir des IQ.
+# 0 processus : traitement dans le thread appelant (référence)
+# usage : python3 ./bench_profile_pipeline.py
+
+# Add project path for accessing to the lib
+import sys, os
+project_name="/ub_tcpip_py_api"
+webui_path = os.path.abspath(__file__).split(project_name)[0]+project_name
+sys.path.insert(0, webui_path)
+#-------------------------------------
+
+import array
+import multiprocessing
+import random
+from struct import pack
+from time import perf_counter
+
+from ub_lib_v1.ub_profile import np
+from ub_lib_v1.ub_profile_pipeline import ProfilePipeline
+
+N_VOL = 64
+N_ECH = 512
+N_PROFILES = 400
+
+
+## \brief puissance moyenne de chaque volume
+def iq_power(_profile):
+	if _profile.iq is not None:
+		iq = _profile.iq.astype(np.float32)
+		return (iq*iq).sum(axis=(0, 2))/_profile.n_ech
+	return [(sum(i*i for i in I) + sum(q*q for q in Q))/_profile.n_ech for I, Q in zip(_profile.I, _profile.Q)]
+
+
+def build_chunk():
+	rand = random.Random(1)
+	arrays = array.array('f', [rand.uniform(-2., 2.) for i in range(2*N_VOL)]).tobytes() \
+		+ array.array('i', [rand.randint(0, 2**31-1) for i in range(N_VOL)]).tobytes()
+	iq = array.array('h', [rand.randint(-2**15, 2**15-1) for i in range(2*N_VOL*N_ECH)]).tobytes()
+	return pack('iIIii', (25<<8)|1, len(arrays), len(iq), 1500000000, 0) + arrays + iq
+
+
+def profiles_per_s(_workers, _chunk):
+	config = {'n_vol': N_VOL, 'n_subvol': 1, 'n_ech': N_ECH}
+	pipeline = ProfilePipeline(config, iq_power, _workers=_workers)
+	try:
+		start = perf_counter()
+		for i in range(N_PROFILES):
+			pipeline.submit(_chunk)
+			for result in pipeline.ready():
+				pass
+		while len(pipeline):
+			pipeline.get()
+		return N_PROFILES/(perf_counter() - start)
+	finally:
+		pipeline.stop()
+
+
+if __name__ == '__main__':
+	chunk = build_chunk()
+	cpu_count = multiprocessing.cpu_count()
+	print("%d bytes per profile, %d cpu, decoder %s"%(len(chunk), cpu_count, "numpy" if np is not None else "stdlib"))
+	print("%-8s %12s"%("workers", "profiles/s"))
+	for workers in sorted(set([0, 1, 2, 4, cpu_count])):
+		print("%-8d %12.0f"%(workers, profiles_per_s(workers, chunk)))
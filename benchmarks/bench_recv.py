@@ -0,0 +1,57 @@
+# -*- coding: UTF_8 -*-
+# Compare recvAll (concaténation) et recvBuffer (recv_into dans un buffer pré-alloué)
+# usage : python3 ./bench_recv.py
+
+# Add project path for accessing to the lib
+import sys, os
+project_name="/ub_tcpip_py_api"
+webui_path = os.path.abspath(__file__).split(project_name)[0]+project_name
+sys.path.insert(0, webui_path)
+#-------------------------------------
+
+import socket
+import tracemalloc
+from threading import Thread
+from time import perf_counter
+
+from ub_lib_v1 import ap_socket
+from ub_lib_v1.ap_socket import recvAll, recvBuffer
+
+# trame IQ : n_ech=128 x 200 cellules x (I,Q) int16
+FRAME_SIZE = 128*200*2*2
+N_FRAMES = 50
+PIECE_SIZE = 4096
+
+
+def sender(_socket, _n_frames):
+	data = bytes(FRAME_SIZE)
+	for _ in range(_n_frames):
+		for i in range(0, FRAME_SIZE, PIECE_SIZE):
+			_socket.sendall(data[i:i+PIECE_SIZE])
+
+
+def run(_name, _recv_function):
+	sock_a, sock_b = socket.socketpair()
+	sock_b.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, PIECE_SIZE)
+	th = Thread(target=sender, args=(sock_a, N_FRAMES))
+	th.start()
+
+	tracemalloc.start()
+	t0 = perf_counter()
+	for _ in range(N_FRAMES):
+		_recv_function(sock_b, FRAME_SIZE)
+	delta = perf_counter() - t0
+	_, peak = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+	th.join()
+	sock_a.close()
+	sock_b.close()
+
+	print("%-10s : %8.1f MB/s, peak memory %6.0f kB (frame %d kB)"%(_name, N_FRAMES*FRAME_SIZE/delta/1e6, peak/1e3, FRAME_SIZE/1e3))
+
+
+if __name__ == '__main__':
+	# recvAll abandonne au delà de limitation_reception_parts morceaux
+	ap_socket.limitation_reception_parts = FRAME_SIZE
+	run("recvAll", recvAll)
+	run("recvBuffer", recvBuffer)
@@ -0,0 +1,60 @@
+# -*- coding: UTF_8 -*-
+# Compare l'envoi d'une trame par concaténation (en-tête + message) et par sendFrame (sendmsg)
+# usage : python3 ./bench_send.py
+
+# Add project path for accessing to the lib
+import sys, os
+project_name="/ub_tcpip_py_api"
+webui_path = os.path.abspath(__file__).split(project_name)[0]+project_name
+sys.path.insert(0, webui_path)
+#-------------------------------------
+
+import socket
+import tracemalloc
+from threading import Thread
+from struct import pack
+from time import perf_counter
+
+from ub_lib_v1.ap_socket import sendAll, sendFrame
+
+N_COMMANDS = 200
+MESSAGE_SIZE = 512*1024 # ex. gros CMD_TCP_CONFIG
+
+
+def drain(_socket, _size):
+	buffer = bytearray(65536)
+	while _size > 0:
+		_size -= _socket.recv_into(buffer)
+
+
+def send_concat(_socket, _message):
+	sendAll(_socket, pack('i', 10000)+pack('i', len(_message))+_message)
+
+
+def send_vectored(_socket, _message):
+	sendFrame(_socket, 10000, _message)
+
+
+def run(_name, _send_function):
+	sock_a, sock_b = socket.socketpair()
+	message = bytearray(MESSAGE_SIZE)
+	th = Thread(target=drain, args=(sock_b, N_COMMANDS*(MESSAGE_SIZE+8)))
+	th.start()
+
+	tracemalloc.start()
+	t0 = perf_counter()
+	for _ in range(N_COMMANDS):
+		_send_function(sock_a, message)
+	delta = perf_counter() - t0
+	_, peak = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+	th.join()
+	sock_a.close()
+	sock_b.close()
+	# chaque copie complète du message apparait dans le pic mémoire
+	print("%-10s : %8.1f MB/s, peak memory %7.0f kB, ~%.0f copies of the message per command"%(_name, N_COMMANDS*MESSAGE_SIZE/delta/1e6, peak/1e3, peak/MESSAGE_SIZE))
+
+
+if __name__ == '__main__':
+	run("concat", send_concat)
+	run("sendFrame", send_vectored)
@@ -0,0 +1,68 @@
+# -*- coding: UTF_8 -*-
+# Latence de remise d'une trame au consommateur, du push_recv_buffer du
+# thread de réception jusqu'au code utilisateur :
+# set_event / wait / read_frame (un réveil de thread par trame) vs callback
+# abonné par subscribe (appel direct dans le thread de réception)
+# usage : python3 ./bench_subscribe.py
+
+# Add project path for accessing to the lib
+import sys, os
+project_name="/ub_tcpip_py_api"
+webui_path = os.path.abspath(__file__).split(project_name)[0]+project_name
+sys.path.insert(0, webui_path)
+#-------------------------------------
+
+from threading import Thread, Semaphore
+from time import perf_counter
+
+from ub_lib_v1.ap_data_socket import ApDataSocket
+
+N_FRAMES = 20000
+FLAG = 20300 # ANS_TCP_PROFILE_INST
+DATA = b'x'*1024
+
+
+def make_socket():
+	# socket non connectée : seule la remise des trames est mesurée
+	socket = ApDataSocket('127.0.0.1', 0)
+	socket.event_is_connected.set()
+	return socket
+
+
+def run_event():
+	socket = make_socket()
+	latencies = []
+	def consumer():
+		for _ in range(N_FRAMES):
+			event = socket.set_event(FLAG)
+			ready.release()
+			event.sock_event.wait()
+			flag, size, data = socket.read_frame(FLAG)
+			latencies.append(perf_counter() - sent[-1])
+	ready = Semaphore(0)
+	sent = []
+	th = Thread(target=consumer)
+	th.start()
+	for i in range(N_FRAMES):
+		ready.acquire() # le consommateur attend la trame
+		sent.append(perf_counter())
+		socket.push_recv_buffer(FLAG, len(DATA), DATA)
+	th.join()
+	return sum(latencies)/len(latencies)
+
+
+def run_subscribe():
+	socket = make_socket()
+	latencies = []
+	sent = []
+	socket.subscribe(FLAG, lambda _flag, _size, _data: latencies.append(perf_counter() - sent[-1]))
+	for i in range(N_FRAMES):
+		sent.append(perf_counter())
+		socket.push_recv_buffer(FLAG, len(DATA), DATA)
+	return sum(latencies)/len(latencies)
+
+
+if __name__ == '__main__':
+	print("%-24s %12s"%("delivery", "us/frame"))
+	print("%-24s %12.2f"%("set_event/read_frame", run_event()*1e6))
+	print("%-24s %12.2f"%("subscribe (inline)", run_subscribe()*1e6))
@@ -0,0 +1,118 @@
+# -*- coding: UTF_8 -*-
+# Driver simulé pour tester la data_socket sans instrument.
+# Chaque commande (flag, taille, données) reçoit une réponse flag+10000 avec les
+# mêmes données, le keepalive (flag 1) est renvoyé, le flag 0 ferme la connexion.
+
+import socket
+import socketserver
+from struct import pack, unpack
+from threading import Thread, Lock, Event
+
+
+def recv_exactly(_socket, _size, _reading):
+	data = b''
+	while len(data) < _size:
+		_reading.wait()
+		chunk = _socket.recv(_size - len(data))
+		if not chunk:
+			raise EOFError
+		data += chunk
+	return data
+
+
+class fake_driver_handler(socketserver.BaseRequestHandler):
+	def handle(self):
+		driver = self.server.driver
+		with driver.lock:
+			driver.connections.append(self.request)
+			driver.n_connections += 1
+		try:
+			while True:
+				flag = unpack('i', recv_exactly(self.request, 4, driver.reading))[0]
+				if flag == 0:
+					break
+				if flag == 1:
+					with driver.lock:
+						driver.n_keepalive += 1
+						self.request.sendall(pack('i', 1))
+					continue
+				size = unpack('i', recv_exactly(self.request, 4, driver.reading))[0]
+				data = recv_exactly(self.request, size, driver.reading)
+				with driver.lock:
+					driver.commands.append((flag, data))
+				if flag in driver.mute_flags:
+					continue
+				with driver.lock:
+					self.request.sendall(pack('i', flag+10000) + pack('i', len(data)) + data)
+		except (EOFError, OSError):
+			pass
+		finally:
+			with driver.lock:
+				if self.request in driver.connections:
+					driver.connections.remove(self.request)
+
+
+class fake_driver_server(socketserver.ThreadingTCPServer):
+	allow_reuse_address = True
+	request_queue_size = 64
+	daemon_threads = True
+
+	def shutdown_request(self, _request):
+		if _request in self.driver.aborted: # reset : fermeture sans FIN
+			self.driver.aborted.discard(_request)
+			_request.close()
+		else:
+			socketserver.ThreadingTCPServer.shutdown_request(self, _request)
+
+
+class fake_driver:
+	def __init__(self):
+		self.lock = Lock()
+		self.connections = []
+		self.commands = []
+		self.mute_flags = set() # commandes sans réponse
+		self.aborted = set() # connexions coupées par reset_connections
+		self.reading = Event() # effacé : le driver ne lit plus (buffer d'émission du client plein)
+		self.reading.set()
+		self.n_connections = 0
+		self.n_keepalive = 0
+		self.server = fake_driver_server(('127.0.0.1', 0), fake_driver_handler)
+		self.server.driver = self
+		self.host, self.port = self.server.server_address
+		self.thread = Thread(target=self.server.serve_forever, daemon=True)
+		self.thread.start()
+
+	## \brief envoie une trame non sollicitée à tous les clients connectés
+	def push(self, _flag, _data=b''):
+		with self.lock:
+			for connection in self.connections:
+				connection.sendall(pack('i', _flag) + pack('i', len(_data)) + _data)
+
+	## \brief coupe brutalement toutes les connexions
+	def drop_connections(self):
+		with self.lock:
+			for connection in self.connections:
+				try:
+					connection.shutdown(socket.SHUT_RDWR)
+				except OSError:
+					pass
+			self.connections = []
+
+	## \brief coupe toutes les connexions par un reset TCP (ECONNRESET chez le client,
+	# comme une coupure réseau, et non une fermeture par le driver)
+	def reset_connections(self):
+		with self.lock:
+			for connection in self.connections:
+				try:
+					connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, pack('ii', 1, 0))
+					self.aborted.add(connection)
+					connection.shutdown(socket.SHUT_RD) # réveille le handler, fermeture par shutdown_request
+				except OSError:
+					pass
+			self.connections = []
+
+	def stop(self):
+		self.reading.set()
+		self.drop_connections()
+		self.server.shutdown()
+		self.server.server_close()
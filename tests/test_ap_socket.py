@@ -0,0 +1,176 @@
+# -*- coding: UTF_8 -*-
+import unittest
+
+# Add project path for accessing to the lib
+import sys, os
+project_name="/ub_tcpip_py_api"
+webui_path = os.path.abspath(__file__).split(project_name)[0]+project_name
+sys.path.insert(0, webui_path)
+#-------------------------------------
+
+import socket
+from threading import Thread
+from struct import pack
+
+# import modules
+from ub_lib_v1.ap_socket import recvInto, recvBuffer, sendAll, sendFrame, sendFrames, applyTransportProfile, checkTransportProfile, reconnectDelay, RECONNECT_FIRST_DELAY, RECONNECT_MAX_DELAY
+from ub_lib_v1.ap_frame_reader import ApFrameReader
+from ub_lib_v1.ap_exception import ap_socket_error, ap_socket_exception
+
+
+class partial_socket:
+	""" socket n'envoyant que quelques octets par appel """
+	def __init__(self, _piece_size):
+		self.piece_size = _piece_size
+		self.sent = b''
+
+	def send(self, _data):
+		self.sent += bytes(_data[:self.piece_size])
+		return min(len(_data), self.piece_size)
+
+	def sendmsg(self, _buffers):
+		return self.send(b''.join(_buffers))
+
+
+def send_in_pieces(_socket, _data, _piece_size):
+	for i in range(0, len(_data), _piece_size):
+		_socket.sendall(_data[i:i+_piece_size])
+
+
+# The main test class (no device needed, uses a local socket pair)
+class TestApSocket(unittest.TestCase):
+
+	def setUp(self):
+		self.sock_a, self.sock_b = socket.socketpair()
+
+	def tearDown(self):
+		self.sock_a.close()
+		self.sock_b.close()
+
+	def test_01_recv_buffer(self):
+		data = bytes(range(256))*64
+		th = Thread(target=send_in_pieces, args=(self.sock_a, data, 1000))
+		th.start()
+		received = recvBuffer(self.sock_b, len(data))
+		th.join()
+		self.assertIsInstance(received, bytearray)
+		self.assertEqual(received, data)
+
+	def test_02_recv_many_pieces(self):
+		# recvAll abandonne au dela de 100 morceaux, recvBuffer n'a pas de limite
+		data = bytes(range(200))*2
+		th = Thread(target=send_in_pieces, args=(self.sock_a, data, 1))
+		th.start()
+		received = recvBuffer(self.sock_b, len(data))
+		th.join()
+		self.assertEqual(received, data)
+
+	def test_03_recv_into_view(self):
+		buffer = bytearray(16)
+		self.sock_a.sendall(b'abcdefgh')
+		self.assertEqual(recvInto(self.sock_b, memoryview(buffer)[4:12]), 8)
+		self.assertEqual(buffer, b'\x00'*4+b'abcdefgh'+b'\x00'*4)
+
+	def test_04_connexion_broken(self):
+		self.sock_a.sendall(b'abc')
+		self.sock_a.close()
+		with self.assertRaises(ap_socket_error) as cm:
+			recvBuffer(self.sock_b, 8)
+		self.assertEqual(cm.exception.code, 21)
+
+	def test_05_frame_reader_batch(self):
+		# plusieurs trames et keepalives arrivant dans le même bloc
+		frames = [(20000+i, b'x'*i) for i in range(10)]
+		stream = b''
+		for flag, data in frames:
+			stream += pack('i', 1) + pack('i', flag) + pack('i', len(data)) + data
+		self.sock_a.sendall(stream)
+		reader = ApFrameReader(self.sock_b)
+		self.assertIsNone(reader.next_frame())
+		reader.fill()
+		for flag, data in frames:
+			self.assertEqual(reader.next_frame(), (flag, len(data), data))
+		self.assertIsNone(reader.next_frame())
+
+	def test_06_frame_reader_split(self):
+		# en-tête et données coupés, trame plus grande que le buffer interne
+		data = bytes(range(256))*40
+		stream = pack('i', 20300) + pack('i', len(data)) + data + pack('i', 20301) + pack('i', 3) + b'abc'
+		th = Thread(target=send_in_pieces, args=(self.sock_a, stream, 7))
+		th.start()
+		reader = ApFrameReader(self.sock_b, 1024)
+		self.assertEqual(reader.read_frame(), (20300, len(data), data))
+		self.assertEqual(reader.read_frame(), (20301, 3, b'abc'))
+		th.join()
+
+	def test_07_frame_reader_driver_error(self):
+		self.sock_a.sendall(pack('i', 0))
+		reader = ApFrameReader(self.sock_b)
+		with self.assertRaises(ap_socket_error) as cm:
+			reader.read_frame()
+		self.assertEqual(cm.exception.code, 30)
+
+	def test_07b_frame_reader_high_fd(self):
+		# select() refuse les descripteurs >= 1024 (process gérant de nombreux instruments)
+		try:
+			high_socket = socket.socket(fileno=os.dup2(self.sock_b.fileno(), 1500))
+		except OSError:
+			self.skipTest("fd limit too low")
+		try:
+			reader = ApFrameReader(high_socket)
+			self.assertFalse(reader.wait(0.01))
+			self.sock_a.sendall(pack('i', 20300) + pack('i', 1) + b'x')
+			self.assertTrue(reader.wait(1.))
+			self.assertEqual(reader.read_frame(), (20300, 1, b'x'))
+		finally:
+			high_socket.close()
+
+	def test_08_send_frame(self):
+		payload = bytearray(b'<settings/>')
+		sendFrame(self.sock_a, 10000, memoryview(payload))
+		sendFrame(self.sock_a, 10300, None)
+		reader = ApFrameReader(self.sock_b)
+		self.assertEqual(reader.read_frame(), (10000, len(payload), payload))
+		self.assertEqual(reader.read_frame(), (10300, 0, b''))
+
+		# plusieurs trames en un seul appel
+		self.assertEqual(sendFrames(self.sock_a, [(10301, b'a'), (10302, None), (10303, 'bc')]), 3*8+3)
+		self.assertEqual([reader.read_frame() for _ in range(3)], [(10301, 1, b'a'), (10302, 0, b''), (10303, 2, b'bc')])
+
+	def test_09_partial_send(self):
+		payload = bytes(range(100))
+		fake_socket = partial_socket(3)
+		self.assertEqual(sendFrame(fake_socket, 10000, payload), 8+len(payload))
+		self.assertEqual(fake_socket.sent, pack('i', 10000)+pack('i', len(payload))+payload)
+
+		fake_socket = partial_socket(7)
+		self.assertEqual(sendAll(fake_socket, payload), len(payload))
+		self.assertEqual(fake_socket.sent, payload)
+
+	def test_10_transport_profile(self):
+		tcp_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		try:
+			info = applyTransportProfile(tcp_socket, {"nodelay": True, "rcvbuf": 256*1024})
+			self.assertTrue(info["nodelay"])
+			self.assertGreaterEqual(info["rcvbuf"], 256*1024) # Linux double la valeur demandée
+			self.assertFalse(applyTransportProfile(tcp_socket, "bulk")["nodelay"])
+		finally:
+			tcp_socket.close()
+
+		checkTransportProfile("low_latency")
+		for profile in ("fast", {"nodelay": True, "window": 1}):
+			with self.assertRaises(ap_socket_exception) as cm:
+				checkTransportProfile(profile)
+			self.assertEqual(cm.exception.code, 323)
+
+	def test_11_reconnect_delay(self):
+		self.assertEqual(reconnectDelay(0), 0.) # première tentative immédiate
+		for attempt in range(1, 20):
+			delay = min(RECONNECT_FIRST_DELAY*2**(attempt-1), RECONNECT_MAX_DELAY)
+			for _ in range(20):
+				self.assertTrue(delay/2 <= reconnectDelay(attempt) <= delay)
+
+
+# We need this to be able to run the tests outside a test framework.
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,117 @@
+# -*- coding: UTF_8 -*-
+import unittest
+
+# Add project path for accessing to the lib
+import sys, os
+project_name="/ub_tcpip_py_api"
+webui_path = os.path.abspath(__file__).split(project_name)[0]+project_name
+sys.path.insert(0, webui_path)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+#-------------------------------------
+
+import asyncio
+
+# import modules
+from ub_lib_v1.ap_async_data_socket import AsyncApDataSocket
+from ub_lib_v1.ap_data_socket import AP_DATA_SOCKET_NON_SELECTIVE
+from ub_lib_v1.ap_frame_store import FRAME_STORE_BLOCK
+from ub_lib_v1.apf02_frame_flags import *
+from ub_lib_v1.ap_exception import ap_socket_exception, ap_socket_timeout
+from fake_driver import fake_driver
+
+
+# The main test class (no device needed, uses a simulated driver)
+class TestAsyncDataSocket(unittest.IsolatedAsyncioTestCase):
+
+	def setUp(self):
+		self.driver = fake_driver()
+
+	def tearDown(self):
+		self.driver.stop()
+
+	async def test_01_send_recv(self):
+		socket = AsyncApDataSocket(self.driver.host, self.driver.port)
+		await socket.wait_connexion(5.)
+
+		flag, size, data = await socket.send_recv_frame(CMD_TCP_DRIVER_VERSION, b'v1', ANS_TCP_DRIVER_VERSION, 5.)
+		self.assertEqual((flag, size, data), (ANS_TCP_DRIVER_VERSION, 2, b'v1'))
+
+		# plusieurs requêtes concurrentes sur la même boucle
+		answers = await asyncio.gather(*[socket.send_recv_frame(10000+i, b'x'*i, 20000+i, 5.) for i in range(1, 20)])
+		self.assertEqual([answer[0] for answer in answers], [20000+i for i in range(1, 20)])
+
+		await socket.close()
+
+	async def test_02_timeout_and_wait_flag(self):
+		socket = AsyncApDataSocket(self.driver.host, self.driver.port)
+		await socket.wait_connexion(5.)
+
+		self.driver.mute_flags.add(CMD_TCP_MEAS_TEMP)
+		with self.assertRaises(ap_socket_timeout):
+			await socket.send_recv_frame(CMD_TCP_MEAS_TEMP, b'', ANS_TCP_MEAS_TEMP, 0.1)
+
+		waiter = asyncio.ensure_future(socket.wait_flag(ANS_TCP_BLOC, 5.))
+		await asyncio.sleep(0.05)
+		with self.assertRaises(ap_socket_exception):
+			socket.set_event(ANS_TCP_BLOC) # flag déjà attendu
+		self.driver.push(ANS_TCP_BLOC, b'end')
+		self.assertEqual(await waiter, (ANS_TCP_BLOC, 3, b'end'))
+
+		await socket.close()
+
+	async def test_03_non_selective(self):
+		socket = AsyncApDataSocket(self.driver.host, self.driver.port)
+		socket.mode = AP_DATA_SOCKET_NON_SELECTIVE
+		await socket.wait_connexion(5.)
+
+		await socket.send_frame(CMD_TCP_PROFILE_INST, b'p')
+		self.assertEqual(await socket.recv_frame(ANS_TCP_PROFILE_INST, 5.), (ANS_TCP_PROFILE_INST, 1, b'p'))
+		await socket.close()
+
+	async def test_04_block_policy(self):
+		# recv_buffer plein : la tâche de réception attend, aucune trame n'est perdue
+		socket = AsyncApDataSocket(self.driver.host, self.driver.port)
+		socket.mode = AP_DATA_SOCKET_NON_SELECTIVE
+		socket.set_buffer_limits(_max_frames=4, _policy=FRAME_STORE_BLOCK)
+		await socket.wait_connexion(5.)
+		await socket.send_frame(CMD_TCP_PROFILE_INST, b'p')
+		await socket.recv_frame(ANS_TCP_PROFILE_INST, 5.)
+		for i in range(50):
+			self.driver.push(ANS_TCP_BLOC, b'%d'%i)
+		await asyncio.sleep(0.2)
+		self.assertEqual(len(socket.recv_buffer), 4)
+		received = [(await socket.recv_frame(ANS_TCP_BLOC, 2.))[2] for _ in range(50)]
+		self.assertEqual(received, [b'%d'%i for i in range(50)])
+		self.assertEqual(socket.get_drop_counters()["frames"], 0)
+		await socket.close()
+
+	async def test_05_pipelined(self):
+		socket = AsyncApDataSocket(self.driver.host, self.driver.port, _pipelined=True)
+		await socket.wait_connexion(5.)
+		answers = await asyncio.gather(*[socket.send_recv_frame(CMD_TCP_PROFILE_INST, b'%d'%i, ANS_TCP_PROFILE_INST, 5.) for i in range(50)])
+		self.assertEqual([answer[2] for answer in answers], [b'%d'%i for i in range(50)])
+
+		self.driver.mute_flags.add(CMD_TCP_MEAS_TEMP)
+		with self.assertRaises(ap_socket_timeout):
+			await socket.send_recv_frame(CMD_TCP_MEAS_TEMP, b'lost', ANS_TCP_MEAS_TEMP, 0.1)
+		self.driver.mute_flags.clear()
+		self.driver.push(ANS_TCP_MEAS_TEMP, b'late')
+		self.assertEqual((await socket.send_recv_frame(CMD_TCP_MEAS_TEMP, b'new', ANS_TCP_MEAS_TEMP, 2.))[2], b'new')
+		await socket.close()
+
+	async def test_06_send_recv_many(self):
+		socket = AsyncApDataSocket(self.driver.host, self.driver.port)
+		await socket.wait_connexion(5.)
+		requests = [(10000+i, b'x'*i, 20000+i) for i in range(300, 306)]
+		self.assertEqual(await socket.send_recv_many(requests, 5.), [(20000+i, i, b'x'*i) for i in range(300, 306)])
+
+		self.driver.mute_flags.add(10305)
+		with self.assertRaises(ap_socket_timeout):
+			await socket.send_recv_many(requests, 0.2)
+		self.assertEqual(len(socket.wait_buffer), 0)
+		await socket.close()
+
+
+# We need this to be able to run the tests outside a test framework.
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,71 @@
+# -*- coding: UTF_8 -*-
+import unittest
+
+# Add project path for accessing to the lib
+import sys, os
+project_name="/ub_tcpip_py_api"
+webui_path = os.path.abspath(__file__).split(project_name)[0]+project_name
+sys.path.insert(0, webui_path)
+#-------------------------------------
+
+from io import StringIO
+
+# import modules
+from ub_lib_v1.ub_class_template import UbClassTemplate, UbStreamLogBackend, UbQueueLogBackend, set_log_backend, LOG_INFO, LOG_DEBUG
+
+
+class log_object(UbClassTemplate):
+	def __init__(self):
+		UbClassTemplate.__init__(self)
+		self.flag_debug_mess=False
+
+	def work(self):
+		self.debug("debug %d", 1)
+		self.info("info %d", 2)
+
+
+class TestClassTemplate(unittest.TestCase):
+
+	def tearDown(self):
+		set_log_backend(None)
+		UbClassTemplate.log_level = LOG_DEBUG
+		UbClassTemplate.log_caller = False
+
+	def test_01_levels(self):
+		stream = StringIO()
+		set_log_backend(UbStreamLogBackend(stream))
+		obj = log_object()
+		obj.work()
+		self.assertNotIn("debug 1", stream.getvalue())
+		self.assertIn("log_object::work:", stream.getvalue())
+		self.assertIn("info 2", stream.getvalue())
+		self.assertNotIn("<<", stream.getvalue()) # appelant non demandé
+
+		obj.flag_debug_mess = True
+		UbClassTemplate.log_caller = True
+		obj.work()
+		self.assertIn("debug 1", stream.getvalue())
+		self.assertIn("<< test_class_template/test_01_levels", stream.getvalue())
+
+		UbClassTemplate.log_level = LOG_INFO + 1
+		size = len(stream.getvalue())
+		obj.work()
+		self.assertEqual(len(stream.getvalue()), size)
+
+	def test_02_queue_backend(self):
+		stream = StringIO()
+		backend = UbQueueLogBackend(stream, _capacity=4, _period=60.)
+		set_log_backend(backend)
+		obj = log_object()
+		for i in range(6):
+			obj.info("message %d", i)
+		self.assertEqual(stream.getvalue(), "") # écriture différée
+		backend.flush()
+		lines = stream.getvalue().splitlines()
+		self.assertEqual([line.split(" ")[-1] for line in lines], ["2", "3", "4", "5"])
+		self.assertEqual(backend.dropped, 2)
+
+
+# We need this to be able to run the tests outside a test framework.
+if __name__ == '__main__':
+	unittest.main()
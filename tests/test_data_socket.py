@@ -0,0 +1,519 @@
+# -*- coding: UTF_8 -*-
+import unittest
+
+# Add project path for accessing to the lib
+import sys, os
+project_name="/ub_tcpip_py_api"
+webui_path = os.path.abspath(__file__).split(project_name)[0]+project_name
+sys.path.insert(0, webui_path)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+#-------------------------------------
+
+import json
+import tempfile
+from threading import Thread, Event
+from concurrent.futures import Future, ThreadPoolExecutor
+from time import sleep, monotonic
+from struct import pack
+
+# import modules
+from ub_lib_v1.ap_data_socket import ApDataSocket, AP_DATA_SOCKET_NON_SELECTIVE
+from ub_lib_v1.ap_socket_event import ap_socket_event
+from ub_lib_v1.ap_frame_store import FRAME_STORE_BLOCK, FRAME_STORE_DROP_NEWEST
+from ub_lib_v1.ap_instrument_hub import InstrumentHub
+from ub_lib_v1.ap_stats_exporter import ApStatsExporter, EXPORT_JSON, stats_throughput
+from ub_lib_v1.ap_trace import TRACE_SEQ, TRACE_FLAG_RECV, TRACE_SEND, TRACE_WAKE
+from ub_lib_v1.apf02_frame_flags import *
+from ub_lib_v1.ap_exception import ap_socket_timeout, ap_socket_exception, ap_socket_error
+from fake_driver import fake_driver
+
+
+# The main test class (no device needed, uses a simulated driver)
+class TestDataSocket(unittest.TestCase):
+
+	def setUp(self):
+		self.driver = fake_driver()
+
+	def tearDown(self):
+		self.driver.stop()
+
+	def test_01_send_recv(self):
+		socket = ApDataSocket(self.driver.host, self.driver.port)
+		socket.wait_connexion()
+
+		flag, size, data = socket.send_recv_frame(CMD_TCP_DRIVER_VERSION, b'v1', ANS_TCP_DRIVER_VERSION, 5.)
+		self.assertEqual((flag, size, data), (ANS_TCP_DRIVER_VERSION, 2, b'v1'))
+		socket.close()
+
+	def test_02_hub(self):
+		hub = InstrumentHub()
+		hub.start()
+		sockets = [hub.add(self.driver.host, self.driver.port) for _ in range(8)]
+		for socket in sockets:
+			socket.wait_connexion()
+
+		def send_recv(_socket, _i):
+			for j in range(20):
+				flag, size, data = _socket.send_recv_frame(10300, b'%d/%d'%(_i, j), 20300, 5.)
+				self.assertEqual(data, b'%d/%d'%(_i, j))
+
+		threads = [Thread(target=send_recv, args=(socket, i)) for i, socket in enumerate(sockets)]
+		for th in threads:
+			th.start()
+		for th in threads:
+			th.join()
+
+		# coupure de toutes les connexions par le driver : les sockets sont
+		# cloturées, wait_connexion les ré-ouvre
+		self.driver.drop_connections()
+		for socket in sockets:
+			while socket.event_is_connected.is_set():
+				sleep(0.01)
+			socket.wait_connexion()
+			self.assertEqual(socket.send_recv_frame(10300, b'x', 20300, 5.)[2], b'x')
+
+		hub.stop()
+		self.assertFalse(any(socket.is_open for socket in sockets))
+
+	def test_03_keepalive(self):
+		socket = ApDataSocket(self.driver.host, self.driver.port)
+		socket.timeout = 0.4 # keepalive si rien n'est émis pendant 0.2 s
+		socket.wait_connexion()
+
+		# pas de keepalive tant que des commandes sont émises
+		t0 = monotonic()
+		while monotonic() - t0 < 0.6:
+			socket.send_recv_frame(CMD_TCP_MEAS_TEMP, b'', ANS_TCP_MEAS_TEMP, 5.)
+		self.assertEqual(self.driver.n_keepalive, 0)
+
+		# keepalive pendant l'attente d'une réponse
+		self.driver.mute_flags.add(CMD_TCP_BLOC)
+		with self.assertRaises(ap_socket_timeout):
+			socket.send_recv_frame(CMD_TCP_BLOC, pack('i', 1), ANS_TCP_BLOC, 1.)
+		self.assertGreaterEqual(self.driver.n_keepalive, 2)
+		socket.close()
+
+	def test_03b_keepalive_streaming(self):
+		# mode non sélectif, trames poussées par le driver sans requête en
+		# attente : le keepalive continue tant que des trames arrivent
+		self.driver.n_keepalive = 0
+		socket = ApDataSocket(self.driver.host, self.driver.port)
+		socket.mode = AP_DATA_SOCKET_NON_SELECTIVE
+		socket.timeout = 0.4
+		socket.wait_connexion()
+
+		t0 = monotonic()
+		while monotonic() - t0 < 2.:
+			self.driver.push(ANS_TCP_BLOC, b'profile')
+			sleep(0.01)
+		self.assertGreaterEqual(self.driver.n_keepalive, 5)
+		socket.close()
+
+	def test_04_transport_profile(self):
+		with self.assertRaises(ap_socket_exception):
+			ApDataSocket(self.driver.host, self.driver.port, _transport_profile="fast")
+
+		socket = ApDataSocket(self.driver.host, self.driver.port, _transport_profile="low_latency")
+		socket.wait_connexion()
+		self.assertTrue(socket.transport_info["nodelay"])
+		self.assertTrue(socket.transport_info["keepalive"])
+		self.assertEqual(socket.send_recv_frame(10300, b'x', 20300, 5.)[2], b'x')
+		socket.close()
+
+	def test_04b_waiters(self):
+		socket = ApDataSocket(self.driver.host, self.driver.port)
+		socket.wait_connexion()
+		first = socket.set_event(ANS_TCP_BLOC)
+		with self.assertRaises(ap_socket_exception) as cm:
+			socket.set_event(ANS_TCP_BLOC)
+		self.assertEqual(cm.exception.code, 320)
+		with self.assertRaises(ap_socket_timeout):
+			first.wait(0.05)
+		self.assertEqual(len(socket.wait_buffer), 0)
+		socket.close()
+
+		# plusieurs évenements sur le même flag, réveillés dans l'ordre d'enregistrement
+		socket = ApDataSocket(self.driver.host, self.driver.port, _unique_waiter=False)
+		socket.wait_connexion()
+		socket.send_recv_frame(10300, b'x', 20300, 5.) # le driver a pris en charge la connexion
+		events = [socket.set_event(ANS_TCP_BLOC) for _ in range(3)]
+		self.driver.push(ANS_TCP_BLOC, b'a')
+		self.driver.push(ANS_TCP_BLOC, b'b')
+		events[0].wait(2.)
+		events[1].wait(2.)
+		self.assertEqual([socket.read_frame(ANS_TCP_BLOC)[2] for _ in range(2)], [b'a', b'b'])
+		self.assertEqual(socket.wait_buffer.count_flag(ANS_TCP_BLOC), 1)
+		socket.close()
+		self.assertEqual(len(socket.wait_buffer), 0)
+
+	def test_05_hub_blocked_sender(self):
+		# un émetteur bloqué (le driver ne lit plus) ne doit pas bloquer la
+		# réception des autres instruments du hub
+		stalled_driver = fake_driver()
+		hub = InstrumentHub()
+		hub.start()
+		try:
+			stalled = hub.add(stalled_driver.host, stalled_driver.port)
+			other = hub.add(self.driver.host, self.driver.port)
+			stalled.mode = AP_DATA_SOCKET_NON_SELECTIVE
+			stalled.wait_connexion()
+			other.wait_connexion()
+
+			stalled_driver.reading.clear()
+			sender = Thread(target=stalled.send_frame, args=(CMD_TCP_CONFIG, b'x'*(64*1024*1024)), daemon=True)
+			sender.start()
+			sleep(0.2)
+			self.assertTrue(sender.is_alive()) # émission bloquée
+			stalled_driver.push(ANS_TCP_BLOC, b'profile') # trame reçue pendant l'émission bloquée
+			sleep(0.1)
+			for i in range(10):
+				self.assertEqual(other.send_recv_frame(10300, b'%d'%i, 20300, 2.)[2], b'%d'%i)
+			self.assertEqual(stalled.recv_frame(ANS_TCP_BLOC, 2.)[2], b'profile')
+		finally:
+			stalled_driver.stop()
+			hub.stop()
+
+	def test_06_buffer_limits(self):
+		socket = ApDataSocket(self.driver.host, self.driver.port)
+		with self.assertRaises(ap_socket_exception) as cm:
+			socket.set_buffer_limits(_max_frames=2, _policy="drop")
+		self.assertEqual(cm.exception.code, 324)
+		socket.mode = AP_DATA_SOCKET_NON_SELECTIVE
+		socket.set_buffer_limits(_max_frames_per_flag=2)
+		socket.wait_connexion()
+		socket.send_recv_frame(10300, b'x', 20300, 5.)
+		for i in range(5):
+			self.driver.push(ANS_TCP_BLOC, b'%d'%i)
+		self.driver.push(ANS_TCP_DRIVER_VERSION, b'v')
+		self.assertEqual(socket.recv_frame(ANS_TCP_DRIVER_VERSION, 2.)[2], b'v')
+		self.assertEqual(socket.get_drop_counters(), {"frames": 3, "bytes": 3, "by_flag": {ANS_TCP_BLOC: 3}})
+		self.assertEqual([socket.read_frame(ANS_TCP_BLOC)[2] for _ in range(2)], [b'3', b'4'])
+		socket.close()
+
+	def __check_block_policy(self, _socket):
+		# recv_buffer plein : la réception est suspendue, aucune trame n'est perdue
+		_socket.mode = AP_DATA_SOCKET_NON_SELECTIVE
+		_socket.set_buffer_limits(_max_frames=4, _policy=FRAME_STORE_BLOCK)
+		_socket.wait_connexion()
+		self.assertEqual(_socket.send_recv_frame(10300, b'x', 20300, 5.)[2], b'x') # le driver a pris en charge la connexion
+		for i in range(50):
+			self.driver.push(ANS_TCP_BLOC, b'%d'%i)
+		sleep(0.2)
+		self.assertEqual(len(_socket.recv_buffer), 4)
+		received = [_socket.recv_frame(ANS_TCP_BLOC, 2.)[2] for _ in range(50)]
+		self.assertEqual(received, [b'%d'%i for i in range(50)])
+		self.assertEqual(_socket.get_drop_counters()["frames"], 0)
+
+	def test_06b_block_policy(self):
+		socket = ApDataSocket(self.driver.host, self.driver.port)
+		try:
+			self.__check_block_policy(socket)
+		finally:
+			socket.close()
+
+		hub = InstrumentHub()
+		hub.start()
+		try:
+			self.__check_block_policy(hub.add(self.driver.host, self.driver.port))
+		finally:
+			hub.stop()
+
+	def test_06c_awaited_frame(self):
+		# recv_buffer plein : une trame attendue n'est pas soumise aux limites
+		socket = ApDataSocket(self.driver.host, self.driver.port)
+		socket.mode = AP_DATA_SOCKET_NON_SELECTIVE
+		socket.wait_connexion()
+		socket.send_recv_frame(10300, b'x', 20300, 5.)
+		socket.clear_buffer()
+		socket.set_buffer_limits(_max_frames=2, _policy=FRAME_STORE_DROP_NEWEST)
+		for i in range(3):
+			self.driver.push(ANS_TCP_BLOC, b'%d'%i)
+		sleep(0.2)
+		self.assertEqual(socket.send_recv_frame(10300, b'y', 20300, 2.)[2], b'y')
+		self.assertEqual(socket.get_drop_counters()["frames"], 1)
+		socket.close()
+
+	def test_07_subscribe(self):
+		socket = ApDataSocket(self.driver.host, self.driver.port) # mode sélectif
+		socket.wait_connexion()
+		socket.send_recv_frame(10300, b'x', 20300, 5.)
+
+		received = []
+		done = Event()
+		def on_profile(_flag, _size, _data):
+			received.append(_data)
+			if len(received) in (20, 21):
+				done.set()
+		def failing(_flag, _size, _data):
+			raise ValueError("user error")
+		socket.subscribe(ANS_TCP_PROFILE_INST, failing)
+		socket.subscribe(ANS_TCP_PROFILE_INST, on_profile)
+		for i in range(20):
+			self.driver.push(ANS_TCP_PROFILE_INST, b'%d'%i)
+		self.assertTrue(done.wait(2.))
+		self.assertEqual(received, [b'%d'%i for i in range(20)])
+		self.assertEqual(len(socket.recv_buffer), 0)
+		# un évenement en attente reçoit aussi la trame
+		done.clear()
+		self.assertEqual(socket.send_recv_frame(CMD_TCP_PROFILE_INST, b'req', ANS_TCP_PROFILE_INST, 2.)[2], b'req')
+		self.assertTrue(done.wait(2.)) # le callback est appelé après le réveil de l'évenement
+		self.assertEqual(received[-1], b'req')
+
+		# via un pool de threads
+		self.assertEqual(socket.unsubscribe(ANS_TCP_PROFILE_INST), 2)
+		done.clear()
+		executor_thread = []
+		def on_profile_pool(_flag, _size, _data):
+			executor_thread.append(_data)
+			done.set()
+		with ThreadPoolExecutor(max_workers=1) as executor:
+			socket.subscribe(ANS_TCP_PROFILE_INST, on_profile_pool, executor)
+			self.driver.push(ANS_TCP_PROFILE_INST, b'pool')
+			self.assertTrue(done.wait(2.))
+		self.assertEqual(executor_thread, [b'pool'])
+		self.assertEqual(socket.unsubscribe(ANS_TCP_PROFILE_INST, on_profile_pool), 1)
+		self.assertEqual(socket.subscribers, {})
+		socket.close()
+
+	def test_07b_subscribe_bounded(self):
+		# callback lent : les trames en attente dans l'executor sont bornées
+		socket = ApDataSocket(self.driver.host, self.driver.port)
+		socket.wait_connexion()
+		socket.send_recv_frame(10300, b'x', 20300, 5.)
+		with self.assertRaises(ap_socket_exception) as cm:
+			socket.subscribe(ANS_TCP_PROFILE_INST, print, None, 0)
+		self.assertEqual(cm.exception.code, 326)
+
+		gate = Event()
+		received = []
+		def slow(_flag, _size, _data):
+			gate.wait()
+			received.append(_data)
+		with ThreadPoolExecutor(max_workers=1) as executor:
+			socket.subscribe(ANS_TCP_PROFILE_INST, slow, executor, 2)
+			try:
+				for i in range(5):
+					self.driver.push(ANS_TCP_PROFILE_INST, b'%d'%i)
+				self.assertEqual(socket.send_recv_frame(CMD_TCP_MEAS_TEMP, b'y', ANS_TCP_MEAS_TEMP, 2.)[2], b'y') # trames reçues
+			finally:
+				gate.set()
+		self.assertEqual(received, [b'0', b'1'])
+		self.assertEqual(socket.get_subscription_drop_counters(), {ANS_TCP_PROFILE_INST: {"frames": 3, "bytes": 3}})
+		socket.unsubscribe(ANS_TCP_PROFILE_INST)
+
+		# FRAME_STORE_BLOCK : la réception attend, aucune trame n'est perdue
+		gate.clear()
+		received.clear()
+		with ThreadPoolExecutor(max_workers=1) as executor:
+			socket.subscribe(ANS_TCP_PROFILE_INST, slow, executor, 1, FRAME_STORE_BLOCK)
+			for i in range(5):
+				self.driver.push(ANS_TCP_PROFILE_INST, b'%d'%i)
+			sleep(0.2)
+			gate.set()
+			self.assertEqual(socket.send_recv_frame(CMD_TCP_MEAS_TEMP, b'z', ANS_TCP_MEAS_TEMP, 2.)[2], b'z')
+		self.assertEqual(received, [b'%d'%i for i in range(5)])
+		self.assertEqual(socket.get_subscription_drop_counters()[ANS_TCP_PROFILE_INST]["frames"], 0)
+		socket.close()
+
+	def test_08_pipelined(self):
+		socket = ApDataSocket(self.driver.host, self.driver.port, _pipelined=True)
+		socket.wait_connexion()
+
+		# plusieurs requêtes en cours sur le même flag, chacune reçoit sa réponse
+		answers = {}
+		def send_recv(_i):
+			answers[_i] = [socket.send_recv_frame(CMD_TCP_PROFILE_INST, b'%d/%d'%(_i, j), ANS_TCP_PROFILE_INST, 5.)[2] for j in range(50)]
+		threads = [Thread(target=send_recv, args=(i,)) for i in range(8)]
+		for th in threads:
+			th.start()
+		for th in threads:
+			th.join()
+		for i in range(8):
+			self.assertEqual(answers[i], [b'%d/%d'%(i, j) for j in range(50)])
+		self.assertEqual(len(socket.recv_buffer), 0)
+
+		# une réponse tardive est absorbée par la requête abandonnée
+		self.driver.mute_flags.add(CMD_TCP_MEAS_TEMP)
+		with self.assertRaises(ap_socket_timeout):
+			socket.send_recv_frame(CMD_TCP_MEAS_TEMP, b'lost', ANS_TCP_MEAS_TEMP, 0.1)
+		self.driver.mute_flags.clear()
+		self.driver.push(ANS_TCP_MEAS_TEMP, b'late')
+		self.assertEqual(socket.send_recv_frame(CMD_TCP_MEAS_TEMP, b'new', ANS_TCP_MEAS_TEMP, 2.)[2], b'new')
+		self.assertEqual(len(socket.wait_buffer), 0)
+		socket.close()
+
+	def test_09_submit(self):
+		socket = ApDataSocket(self.driver.host, self.driver.port)
+		socket.wait_connexion()
+
+		future = socket.submit(CMD_TCP_DRIVER_VERSION, b'v1', ANS_TCP_DRIVER_VERSION, 5.)
+		self.assertEqual(future.result(5.), (ANS_TCP_DRIVER_VERSION, 2, b'v1'))
+		self.assertEqual(len(socket.recv_buffer), 0)
+
+		# séquence de démarrage : un seul appel d'émission, réponses dans l'ordre des requêtes
+		requests = [(10000+i, b'x'*i, 20000+i) for i in range(300, 306)]
+		answers = socket.send_recv_many(requests, 5.)
+		self.assertEqual(answers, [(20000+i, i, b'x'*i) for i in range(300, 306)])
+		self.assertEqual([command[0] for command in self.driver.commands[-6:]], [10000+i for i in range(300, 306)])
+
+		# timeout
+		self.driver.mute_flags.add(CMD_TCP_MEAS_TEMP)
+		future = socket.submit(CMD_TCP_MEAS_TEMP, b'', ANS_TCP_MEAS_TEMP, 0.1)
+		with self.assertRaises(ap_socket_timeout):
+			future.result(2.)
+		self.assertEqual(len(socket.wait_buffer), 0)
+
+		# déconnexion
+		future = socket.submit(CMD_TCP_MEAS_TEMP, b'', ANS_TCP_MEAS_TEMP, 5.)
+		self.driver.drop_connections()
+		with self.assertRaises(ap_socket_error):
+			future.result(2.)
+		socket.close()
+
+		# mode pipeline : plusieurs requêtes sur le même flag dans un lot
+		socket = ApDataSocket(self.driver.host, self.driver.port, _pipelined=True)
+		socket.wait_connexion()
+		answers = socket.send_recv_many([(CMD_TCP_PROFILE_INST, b'%d'%i, ANS_TCP_PROFILE_INST) for i in range(20)], 5.)
+		self.assertEqual([answer[2] for answer in answers], [b'%d'%i for i in range(20)])
+		# lot vide : rien n'est émis, aucun ticket n'est consommé
+		self.assertEqual(socket.send_recv_many([], 5.), [])
+		self.assertEqual(socket.send_recv_frame(CMD_TCP_PROFILE_INST, b'next', ANS_TCP_PROFILE_INST, 2.)[2], b'next')
+		socket.close()
+
+		# Future terminé sans échéance programmée
+		sock_event = ap_socket_event(socket, ANS_TCP_PROFILE_INST)
+		sock_event.future = Future()
+		sock_event.batch = [sock_event]
+		sock_event.complete()
+		self.assertTrue(sock_event.future.done())
+
+	def test_10_session_replay(self):
+		socket = ApDataSocket(self.driver.host, self.driver.port)
+		try:
+			self.__check_session_replay(socket)
+		finally:
+			socket.close()
+
+		hub = InstrumentHub()
+		hub.start()
+		try:
+			self.__check_session_replay(hub.add(self.driver.host, self.driver.port))
+		finally:
+			hub.stop()
+
+	def __check_session_replay(self, socket):
+		self.driver.mute_flags.clear()
+		with self.driver.lock:
+			self.driver.commands = []
+		socket.mode = AP_DATA_SOCKET_NON_SELECTIVE
+		socket.set_session_replay(_idempotent_flags=(CMD_TCP_PROFILE_INST,))
+		socket.wait_connexion()
+		socket.send_recv_frame(CMD_TCP_CONFIG, b'<settings/>', ANS_TCP_CONFIG, 5.)
+
+		# requêtes en cours lors de la coupure
+		self.driver.mute_flags.update((CMD_TCP_PROFILE_INST, CMD_TCP_MEAS_TEMP))
+		not_idempotent = socket.submit(CMD_TCP_MEAS_TEMP, b'', ANS_TCP_MEAS_TEMP, 5.)
+		answers = []
+		th = Thread(target=lambda: answers.append(socket.send_recv_frame(CMD_TCP_PROFILE_INST, b'p1', ANS_TCP_PROFILE_INST, 5.)))
+		th.start()
+		while (CMD_TCP_PROFILE_INST, b'p1') not in self.driver.commands:
+			sleep(0.01)
+		n_commands = len(self.driver.commands)
+		self.driver.mute_flags.discard(CMD_TCP_PROFILE_INST)
+		self.driver.reset_connections()
+
+		th.join(5.)
+		self.assertEqual(answers, [(ANS_TCP_PROFILE_INST, 2, b'p1')])
+		with self.assertRaises(ap_socket_error):
+			not_idempotent.result(2.)
+		# timeout, settings puis requête en attente renvoyés à la reconnexion
+		self.assertEqual([flag for flag, data in self.driver.commands[n_commands:]], [10007, CMD_TCP_CONFIG, CMD_TCP_PROFILE_INST])
+		self.assertEqual(self.driver.commands[n_commands+1][1], b'<settings/>')
+		self.assertNotIn(ANS_TCP_CONFIG, socket.recv_buffer) # réponse au renvoi absorbée
+
+		stats = socket.get_recovery_stats()
+		self.assertEqual((stats["reconnect_count"], stats["count"]), (1, 1))
+		self.assertLess(stats["last"], 1.)
+		socket.send_recv_frame(CMD_TCP_CONFIG, b'<settings/>', ANS_TCP_CONFIG, 5.)
+
+	def test_11_stats(self):
+		socket = ApDataSocket(self.driver.host, self.driver.port)
+		socket.wait_connexion()
+		for i in range(3):
+			socket.send_recv_frame(CMD_TCP_PROFILE_INST, b'x'*10, ANS_TCP_PROFILE_INST, 5.)
+		self.driver.push(ANS_TCP_BLOC, b'lost') # non attendue : perdue en mode sélectif
+		socket.send_recv_frame(CMD_TCP_PING, b'', ANS_TCP_PONG, 5.)
+
+		stats = socket.stats()
+		self.assertEqual(stats["send"]["by_flag"][CMD_TCP_PROFILE_INST], {"frames": 3, "bytes": 30})
+		self.assertEqual(stats["recv"]["by_flag"][ANS_TCP_PROFILE_INST], {"frames": 3, "bytes": 30})
+		self.assertEqual(stats["lost"]["by_flag"], {ANS_TCP_BLOC: {"frames": 1, "bytes": 4}})
+		self.assertEqual((stats["recv_buffer"]["frames"], stats["wait_buffer"]), (0, 0))
+		# débits calculés par le lecteur, depuis son propre relevé précédent
+		self.assertIsNone(stats_throughput(None, stats))
+		socket.send_recv_frame(CMD_TCP_PING, b'', ANS_TCP_PONG, 5.)
+		throughput = stats_throughput(stats, socket.stats())
+		self.assertGreater(throughput["send_frames_per_s"], 0)
+		self.assertGreater(throughput["interval_s"], 0)
+
+		path = os.path.join(tempfile.mkdtemp(), "ub_data_socket.prom")
+		exporter = ApStatsExporter([socket], path)
+		exporter.export()
+		with open(path) as prom_file:
+			text = prom_file.read()
+		self.assertIn('ub_data_socket_send_frames_total{socket="%s:%d",flag="%d"} 3'%(self.driver.host, self.driver.port, CMD_TCP_PROFILE_INST), text)
+		self.assertIn('ub_data_socket_lost_frames_total{socket="%s:%d",flag="%d"} 1'%(self.driver.host, self.driver.port, ANS_TCP_BLOC), text)
+		exporter = ApStatsExporter([socket], path, _period=0.01, _format=EXPORT_JSON)
+		exporter.start()
+		sleep(0.1)
+		exporter.stop()
+		with open(path) as json_file:
+			exported = json.load(json_file)[0]
+		self.assertEqual(exported["send"]["by_flag"][str(CMD_TCP_PROFILE_INST)]["frames"], 3)
+		self.assertEqual(exported["throughput"]["send_frames_per_s"], 0) # rien d'émis entre les deux derniers exports
+		socket.close()
+
+	def test_12_trace(self):
+		socket = ApDataSocket(self.driver.host, self.driver.port)
+		try:
+			self.__check_trace(socket)
+		finally:
+			socket.close()
+
+		hub = InstrumentHub()
+		hub.start()
+		try:
+			self.__check_trace(hub.add(self.driver.host, self.driver.port))
+		finally:
+			hub.stop()
+
+	def __check_trace(self, socket):
+		socket.wait_connexion()
+		socket.send_recv_frame(10300, b'x', 20300, 5.) # le driver a pris en charge la connexion
+		trace = socket.enable_trace(_capacity=4)
+		for i in range(6):
+			socket.send_recv_frame(CMD_TCP_PROFILE_AAVG, b'%d'%i, ANS_TCP_PROFILE_AAVG, 5.)
+		Thread(target=lambda: (sleep(0.05), self.driver.push(ANS_TCP_BLOC, b'bloc'))).start()
+		socket.recv_frame(ANS_TCP_BLOC, 5.)
+		socket.disable_trace()
+
+		records = trace.records()
+		self.assertEqual([record[TRACE_SEQ] for record in records], [4, 5, 6, 7]) # buffer circulaire
+		self.assertEqual(records[-1][TRACE_FLAG_RECV], ANS_TCP_BLOC)
+		for record in records:
+			dates = record[TRACE_SEND:TRACE_WAKE+1]
+			self.assertTrue(all(dates), record)
+			self.assertEqual(dates, sorted(dates))
+
+		path = os.path.join(tempfile.mkdtemp(), "trace.json")
+		trace.export_chrome_trace(path)
+		with open(path) as trace_file:
+			events = json.load(trace_file)["traceEvents"]
+		self.assertEqual(len(events), 4*5)
+		self.assertEqual(set(event["name"] for event in events if event["cat"] == "phase"),
+		                 {"driver+network", "answer transfer", "receive thread", "consumer wake-up"})
+
+
+# We need this to be able to run the tests outside a test framework.
+if __name__ == '__main__':
+	unittest.main()
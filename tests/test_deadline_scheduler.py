@@ -0,0 +1,62 @@
+# -*- coding: UTF_8 -*-
+import unittest
+
+# Add project path for accessing to the lib
+import sys, os
+project_name="/ub_tcpip_py_api"
+webui_path = os.path.abspath(__file__).split(project_name)[0]+project_name
+sys.path.insert(0, webui_path)
+#-------------------------------------
+
+from threading import Event
+from time import monotonic_ns
+
+# import modules
+from ub_lib_v1.ap_deadline_scheduler import ApDeadlineScheduler, get_deadline_scheduler, NS_PER_S
+
+
+class TestDeadlineScheduler(unittest.TestCase):
+
+	def test_01_order(self):
+		scheduler = ApDeadlineScheduler()
+		scheduler.start()
+		fired = []
+		done = Event()
+		for delay in (0.06, 0.02, 0.04):
+			scheduler.schedule(delay, fired.append, delay)
+		scheduler.schedule(0.08, done.set)
+		self.assertTrue(done.wait(2.))
+		self.assertEqual(fired, [0.02, 0.04, 0.06])
+
+	def test_02_cancel(self):
+		scheduler = ApDeadlineScheduler()
+		scheduler.start()
+		fired = []
+		done = Event()
+		entries = [scheduler.schedule(0.02, fired.append, i) for i in range(200)]
+		for entry in entries[1:]:
+			scheduler.cancel(entry)
+		self.assertEqual(len(scheduler), 1)
+		self.assertLess(len(scheduler.heap), 200) # tas reconstruit
+		scheduler.schedule(0.05, done.set)
+		self.assertTrue(done.wait(2.))
+		self.assertEqual(fired, [0])
+		scheduler.cancel(entries[0]) # déjà passée : sans effet
+		self.assertEqual(len(scheduler), 0)
+
+	def test_03_accuracy(self):
+		# pas de réveil tardif d'une seconde (ancienne résolution de mktime(localtime()))
+		scheduler = get_deadline_scheduler()
+		self.assertIs(scheduler, get_deadline_scheduler())
+		fired = []
+		done = Event()
+		t0 = monotonic_ns()
+		scheduler.schedule(0.005, lambda: (fired.append(monotonic_ns() - t0), done.set()))
+		self.assertTrue(done.wait(2.))
+		self.assertGreaterEqual(fired[0], 0.005*NS_PER_S)
+		self.assertLess(fired[0], 0.1*NS_PER_S)
+
+
+# We need this to be able to run the tests outside a test framework.
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,97 @@
+# -*- coding: UTF_8 -*-
+import unittest
+
+# Add project path for accessing to the lib
+import sys, os
+project_name="/ub_tcpip_py_api"
+webui_path = os.path.abspath(__file__).split(project_name)[0]+project_name
+sys.path.insert(0, webui_path)
+#-------------------------------------
+
+# import modules
+from ub_lib_v1.ap_frame_store import ApFrameStore, FRAME_STORE_DROP_NEWEST, FRAME_STORE_BLOCK
+
+
+class TestFrameStore(unittest.TestCase):
+
+	def test_01_order(self):
+		store = ApFrameStore()
+		frames = [(20000+i%3, 1, b'%d'%i) for i in range(9)]
+		for frame in frames:
+			store.push(frame)
+		self.assertEqual(len(store), 9)
+		self.assertEqual(list(store), frames)
+
+		# par flag : plus ancienne trame du flag
+		self.assertEqual(store.pop(20001), frames[1])
+		self.assertEqual(store.pop(20001), frames[4])
+		self.assertIsNone(store.pop(20005))
+		# sans flag : ordre d'arrivée, les trames déjà extraites sont ignorées
+		self.assertEqual(store.pop(), frames[0])
+		self.assertEqual(store.pop(), frames[2])
+		self.assertEqual(store.pop(), frames[3])
+		self.assertEqual(len(store), 4)
+
+	def test_02_clear(self):
+		store = ApFrameStore()
+		for i in range(10):
+			store.push((20000+i%2, 0, b''))
+		self.assertEqual(store.clear(20000), 5)
+		self.assertNotIn(20000, store)
+		self.assertEqual(store.count_flag(20001), 5)
+		self.assertEqual([frame[0] for frame in store], [20001]*5)
+		self.assertEqual(store.clear(), 5)
+		self.assertIsNone(store.pop())
+
+	def test_03_compact(self):
+		# extraction par flag uniquement : la file d'ordre ne grossit pas indéfiniment
+		store = ApFrameStore()
+		store.push((20300, 0, b'old'))
+		for i in range(10000):
+			store.push((20208, 0, b''))
+			store.pop(20208)
+		self.assertLess(len(store.order), 200)
+		self.assertEqual(store.pop(), (20300, 0, b'old'))
+
+	def test_04_limits(self):
+		# politique par défaut : les plus anciennes trames sont supprimées
+		store = ApFrameStore()
+		store.set_limits(_max_frames=4, _max_frames_per_flag=2)
+		for i in range(6):
+			self.assertTrue(store.push((20000+i%2, 10, b'%d'%i)))
+		self.assertEqual([frame[2] for frame in store], [b'2', b'3', b'4', b'5'])
+		store.push((20002, 10, b'6'))
+		self.assertEqual([frame[2] for frame in store], [b'3', b'4', b'5', b'6'])
+		self.assertEqual(store.dropped_frames, 3)
+		self.assertEqual(store.dropped_bytes, 30)
+		self.assertEqual(store.dropped_by_flag, {20000: 2, 20001: 1})
+		self.assertEqual(store.bytes, 40)
+
+		# la nouvelle trame est rejetée
+		store = ApFrameStore()
+		store.set_limits(_max_bytes=25, _policy=FRAME_STORE_DROP_NEWEST)
+		self.assertTrue(store.push((20000, 10, b'a')))
+		self.assertTrue(store.push((20000, 10, b'b')))
+		self.assertFalse(store.push((20000, 10, b'c')))
+		self.assertEqual(store.dropped_frames, 1)
+		# une trame trop grande est acceptée dans un buffer vide
+		store.clear()
+		self.assertTrue(store.push((20000, 100, b'big')))
+
+		# la nouvelle trame est refusée sans être comptée
+		store = ApFrameStore()
+		store.set_limits(_max_frames=1, _policy=FRAME_STORE_BLOCK)
+		self.assertTrue(store.push((20000, 0, b'a')))
+		self.assertFalse(store.push((20001, 0, b'b')))
+		self.assertEqual(store.dropped_frames, 0)
+		self.assertTrue(store.push((20001, 0, b'b'), _force=True))
+		store.pop()
+		self.assertEqual(store.bytes_by_flag, {20001: 0})
+
+		with self.assertRaises(ValueError):
+			store.set_limits(_policy="drop")
+
+
+# We need this to be able to run the tests outside a test framework.
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,304 @@
+# -*- coding: UTF_8 -*-
+import unittest
+
+# Add project path for accessing to the lib
+import sys, os
+project_name="/ub_tcpip_py_api"
+webui_path = os.path.abspath(__file__).split(project_name)[0]+project_name
+sys.path.insert(0, webui_path)
+#-------------------------------------
+
+import array
+import random
+from struct import pack
+
+# import modules
+from ub_lib_v1 import ub_profile
+from ub_lib_v1.ub_profile_pipeline import ProfilePipeline
+from ub_lib_v1.ap_exception import ap_protocol_error
+from ub_lib_v1.ub_settings import read_settings
+from ub_lib_v1.ub_profile import data_profile_t, LazyProfile, ProfileBatch, cell_positions, clear_position_cache, np, PROFILE_DECODER_PYTHON, PROFILE_DECODER_STDLIB, PROFILE_DECODER_NUMPY, PROFILE_DECODER_AUTO, PROFILE_FIELDS
+
+N_VOL = 40
+N_SUBVOL = 2
+N_ECH = 8
+config = {'n_vol': N_VOL, 'n_subvol': N_SUBVOL, 'n_ech': N_ECH}
+
+
+## \brief construit un chunk de profil (ANS_TCP_PROFILE_*)
+def build_chunk(_velocity, _variance, _quality, _iq=b'', _ref=(25<<8)|1, _sec=1500000000, _n_sec=250000000):
+	arrays = array.array('f', _velocity).tobytes() + array.array('f', _variance).tobytes() + array.array('i', _quality).tobytes()
+	return pack('iIIii', _ref, len(arrays), len(_iq), _sec, _n_sec) + arrays + _iq
+
+
+## \brief chunk aléatoire : variances négatives, facteurs qualité négatifs (bit de poids fort)
+def random_chunk(_n_cells=N_VOL*N_SUBVOL, _iq=b'', _seed=1, _sec=1500000000, _n_sec=250000000):
+	rand = random.Random(_seed)
+	velocity = [rand.uniform(-2., 2.) for i in range(_n_cells)]
+	variance = [rand.uniform(-0.5, 4.) for i in range(_n_cells)]
+	quality = [rand.randint(-2**31, 2**31-1) for i in range(_n_cells)]
+	return build_chunk(velocity, variance, quality, _iq, _sec=_sec, _n_sec=_n_sec)
+
+
+## \brief traitement des profils dans ProfilePipeline
+def amplitude_and_iq_sum(_profile):
+	return _profile.t, _profile.amplitude, sum(sum(I) for I in _profile.I)
+
+
+class TestProfile(unittest.TestCase):
+
+	def test_01_decoder(self):
+		chunk = build_chunk([1.5, -0.25], [4., -1.], [(3<<24)|(2<<16)|(1<<8)|255, 0])
+		profile = data_profile_t(config)
+		profile.interpret_chunk(chunk)
+		self.assertEqual(profile.ref, 25)
+		self.assertEqual(profile.num_config, 1)
+		self.assertAlmostEqual(profile.t, 1500000000.25)
+		self.assertEqual(list(profile.velocity), [1.5, -0.25])
+		self.assertEqual(profile.amplitude[0], 2.)
+		self.assertNotEqual(profile.variance[1], profile.variance[1]) # NaN
+		self.assertEqual(list(profile.snr), [10., -10.])
+		self.assertEqual((profile.sat[0], profile.ny_jp[0], profile.sigma[0]), (1., 2., 3.))
+
+		with self.assertRaises(ap_protocol_error):
+			data_profile_t(config).interpret_chunk(pack('iIIii', (25<<8)|1, 0, 0, 0, 0))
+		with self.assertRaises(ap_protocol_error):
+			data_profile_t(config).interpret_chunk(build_chunk([0.], [0.], [0], _ref=(25<<8)|17))
+		with self.assertRaises(ValueError):
+			data_profile_t(config, _decoder="fortran")
+
+	@unittest.skipIf(np is None, "NumPy is not installed")
+	def test_02_numpy_decoder(self):
+		for seed in range(5):
+			chunk = random_chunk(_seed=seed)
+			reference = data_profile_t(config, _decoder=PROFILE_DECODER_PYTHON)
+			reference.interpret_chunk(chunk)
+			profile = data_profile_t(config, _decoder=PROFILE_DECODER_NUMPY)
+			profile.interpret_chunk(bytearray(chunk))
+			self.assertEqual((profile.ref, profile.num_config, profile.t), (reference.ref, reference.num_config, reference.t))
+			for field in PROFILE_FIELDS:
+				self.assertEqual(getattr(profile, field).dtype, np.float32)
+				# identiques au bit près (NaN compris)
+				self.assertEqual(getattr(profile, field).tobytes(), getattr(reference, field).tobytes(), field)
+
+	@unittest.skipIf(np is None, "NumPy is not installed")
+	def test_03_iq_view(self):
+		n_vol = N_VOL*N_SUBVOL
+		rand = random.Random(3)
+		iq = array.array('h', [rand.randint(-2**15, 2**15-1) for i in range(N_ECH*n_vol*2)]).tobytes()
+		chunk = random_chunk(_iq=iq)
+		reference = data_profile_t(config, _decoder=PROFILE_DECODER_PYTHON)
+		reference.interpret_chunk(chunk)
+		profile = data_profile_t(config, _decoder=PROFILE_DECODER_NUMPY)
+		profile.interpret_chunk(chunk)
+
+		self.assertEqual(profile.iq.shape, (N_ECH, n_vol, 2))
+		self.assertEqual(profile.iq.dtype, np.int16)
+		self.assertTrue(np.shares_memory(profile.iq, np.frombuffer(chunk, np.uint8))) # vue sur le chunk, pas de copie
+		for vol in (0, 17, n_vol-1):
+			self.assertEqual(list(profile.I[vol]), list(reference.I[vol]))
+			self.assertEqual(list(profile.Q[vol]), list(reference.Q[vol]))
+		self.assertEqual(profile.iq_float().dtype, np.float32)
+		self.assertEqual(profile.iq_float()[2, 5, 1], reference.Q[5][2])
+
+		with self.assertRaises(ap_protocol_error):
+			data_profile_t(config, _decoder=PROFILE_DECODER_NUMPY).interpret_chunk(random_chunk(_iq=iq[:-2]))
+
+	@unittest.skipIf(np is None, "NumPy is not installed")
+	def test_04_profile_batch(self):
+		chunks = [random_chunk(_seed=seed, _sec=1500000000+seed, _n_sec=999999999) for seed in range(10)]
+		batch = ProfileBatch(config, chunks[:3])
+		self.assertEqual((len(batch), batch.capacity), (3, 3))
+		batch.append(chunks[3])
+		self.assertEqual(batch.capacity, 6) # croissance géométrique
+		batch.extend(chunks[4:])
+		self.assertEqual((len(batch), batch.capacity), (10, 12))
+
+		self.assertEqual(batch.velocity.shape, (10, N_VOL*N_SUBVOL))
+		self.assertEqual(batch.t_ns.dtype, np.int64)
+		self.assertEqual(int(batch.t_ns[4]), 1500000004999999999)
+		for row, chunk in enumerate(chunks):
+			profile = data_profile_t(config, _decoder=PROFILE_DECODER_NUMPY)
+			profile.interpret_chunk(chunk)
+			self.assertEqual((batch.ref[row], batch.num_config[row]), (profile.ref, profile.num_config))
+			for field in PROFILE_FIELDS:
+				self.assertEqual(getattr(batch, field)[row].tobytes(), getattr(profile, field).tobytes(), field)
+
+		with self.assertRaises(ap_protocol_error):
+			batch.append(random_chunk(_n_cells=3))
+		self.assertEqual(len(batch), 10)
+		batch.clear()
+		self.assertEqual((len(batch), batch.capacity, batch.amplitude.shape[0]), (0, 12, 0))
+
+	def test_05_lazy_profile(self):
+		n_vol = N_VOL*N_SUBVOL
+		iq = array.array('h', range(-N_ECH*n_vol, N_ECH*n_vol)).tobytes()
+		chunk = random_chunk(_iq=iq)
+		decoders = [PROFILE_DECODER_PYTHON, PROFILE_DECODER_STDLIB] + ([PROFILE_DECODER_NUMPY] if np is not None else [])
+		for decoder in decoders:
+			reference = data_profile_t(config, _decoder=decoder)
+			reference.interpret_chunk(chunk)
+			profile = LazyProfile(config, chunk, _decoder=decoder)
+			self.assertFalse(hasattr(profile, "__dict__"))
+			self.assertEqual((profile.ref, profile.num_config, profile.t), (reference.ref, reference.num_config, reference.t))
+
+			self.assertEqual(profile.amplitude.tobytes(), reference.amplitude.tobytes())
+			self.assertEqual(LazyProfile.variance.__get__(profile).tobytes(), reference.variance.tobytes()) # décodé pour amplitude
+			for field in ("velocity", "snr", "sat", "ny_jp", "sigma", "I"):
+				with self.assertRaises(AttributeError): # pas encore décodé
+					LazyProfile.__dict__[field].__get__(profile)
+			self.assertIs(profile.amplitude, profile.amplitude) # gardé
+
+			for field in PROFILE_FIELDS:
+				self.assertEqual(getattr(profile, field).tobytes(), getattr(reference, field).tobytes(), (decoder, field))
+			for vol in (0, n_vol-1):
+				self.assertEqual(list(profile.I[vol]), list(reference.I[vol]))
+				self.assertEqual(list(profile.Q[vol]), list(reference.Q[vol]))
+			with self.assertRaises(AttributeError):
+				profile.unknown_field
+
+		with self.assertRaises(ap_protocol_error):
+			LazyProfile(config, pack('iIIii', (25<<8)|1, 0, 0, 0, 0))
+
+	def test_06_stdlib_decoder(self):
+		n_vol = N_VOL*N_SUBVOL
+		iq = array.array('h', range(-N_ECH*n_vol, N_ECH*n_vol)).tobytes()
+		for seed in range(5):
+			chunk = random_chunk(_iq=iq, _seed=seed)
+			reference = data_profile_t(config, _decoder=PROFILE_DECODER_PYTHON)
+			reference.interpret_chunk(chunk)
+			profile = data_profile_t(config, _decoder=PROFILE_DECODER_STDLIB)
+			profile.interpret_chunk(bytearray(chunk))
+			for field in PROFILE_FIELDS:
+				self.assertIsInstance(getattr(profile, field), array.array)
+				# identiques au bit près (NaN compris)
+				self.assertEqual(getattr(profile, field).tobytes(), getattr(reference, field).tobytes(), field)
+			self.assertEqual([I.tobytes() for I in profile.I], [I.tobytes() for I in reference.I])
+			self.assertEqual([Q.tobytes() for Q in profile.Q], [Q.tobytes() for Q in reference.Q])
+
+		# variances -0., NaN, -NaN, négative et positive
+		variance = array.array('f')
+		variance.frombytes(pack('5I', 0x80000000, 0x7fc00000, 0xffc00000, 0xbf800000, 0x40000000))
+		chunk = build_chunk([0.]*5, variance, [0]*5)
+		reference = data_profile_t(config, _decoder=PROFILE_DECODER_PYTHON)
+		reference.interpret_chunk(chunk)
+		for decoder in [PROFILE_DECODER_STDLIB] + ([PROFILE_DECODER_NUMPY] if np is not None else []):
+			profile = data_profile_t(config, _decoder=decoder)
+			profile.interpret_chunk(chunk)
+			self.assertEqual(profile.variance.tobytes(), reference.variance.tobytes(), decoder)
+			self.assertEqual(profile.amplitude.tobytes(), reference.amplitude.tobytes(), decoder)
+
+		# choix automatique du décodeur
+		self.assertEqual(data_profile_t(config, _decoder=PROFILE_DECODER_AUTO).decoder, PROFILE_DECODER_NUMPY if np is not None else PROFILE_DECODER_STDLIB)
+		saved_np, ub_profile.np = ub_profile.np, None # NumPy absent
+		try:
+			self.assertEqual(data_profile_t(config, _decoder=PROFILE_DECODER_AUTO).decoder, PROFILE_DECODER_STDLIB)
+			self.assertEqual(LazyProfile(config, chunk, _decoder=PROFILE_DECODER_AUTO).decoder, PROFILE_DECODER_STDLIB)
+			with self.assertRaises(ImportError):
+				data_profile_t(config, _decoder=PROFILE_DECODER_NUMPY)
+		finally:
+			ub_profile.np = saved_np
+
+	def test_07_pipeline(self):
+		n_vol = N_VOL*N_SUBVOL
+		iq = array.array('h', range(-N_ECH*n_vol, N_ECH*n_vol)).tobytes()
+		chunks = [random_chunk(_iq=iq, _seed=seed, _sec=1500000000+seed) for seed in range(12)]
+		chunks[5] = build_chunk([0.], [0.], [0], _ref=(25<<8)|17) # num_config erroné
+		for workers in (0, 2):
+			pipeline = ProfilePipeline(config, amplitude_and_iq_sum, _workers=workers, _slots=3)
+			try:
+				for chunk in chunks:
+					pipeline.submit(chunk)
+				self.assertEqual(len(pipeline), len(chunks))
+				for seed, chunk in enumerate(chunks):
+					if seed == 5:
+						with self.assertRaises(ap_protocol_error):
+							pipeline.get(5.)
+						continue
+					reference = LazyProfile(config, chunk, pipeline.decoder)
+					t, amplitude, iq_sum = pipeline.get(5.) # dans l'ordre de soumission
+					self.assertEqual(t, reference.t)
+					self.assertEqual(amplitude.tobytes(), reference.amplitude.tobytes())
+					self.assertEqual(iq_sum, sum(range(-N_ECH*n_vol, N_ECH*n_vol, 2)))
+				self.assertEqual(len(pipeline), 0)
+				self.assertIsNone(pipeline.get(0.01))
+
+				with self.assertRaises(ValueError):
+					pipeline.submit(chunks[0] + bytes(pipeline.slot_size))
+
+				# ready : après l'exception du chunk 5, les résultats suivants restent disponibles
+				for chunk in chunks[:8]:
+					pipeline.submit(chunk)
+				with pipeline.condition:
+					self.assertTrue(pipeline.condition.wait_for(lambda: len(pipeline.results) == 8, 5.))
+				results = pipeline.ready()
+				self.assertEqual(len([next(results) for _ in range(5)]), 5)
+				with self.assertRaises(ap_protocol_error):
+					next(results)
+				self.assertEqual(len(list(pipeline.ready())), 2)
+				self.assertEqual(len(pipeline), 0)
+			finally:
+				pipeline.stop()
+			self.assertIsNone(pipeline.shm)
+		with self.assertRaises(ValueError):
+			pipeline.submit(chunks[0])
+
+	def test_08_cell_positions(self):
+		settings, _ = read_settings(os.path.join(os.path.dirname(os.path.abspath(__file__)), "settings_models", "settings.ublab_2c.xml"))
+		config = settings['config1']
+		n_cells = config['n_vol']*config['n_subvol']
+		# ancienne boucle de set_position_data
+		reference = array.array('f')
+		for i in range(config['n_vol']):
+			for j in range(config['n_subvol']):
+				reference.append(config['r_vol1'] + config['r_dvol']*i + config['r_dsubvol']*j)
+
+		clear_position_cache()
+		chunk = random_chunk(_n_cells=n_cells)
+		profiles = [data_profile_t(config, _settings=settings), data_profile_t(config, _settings=settings)]
+		for profile in profiles:
+			profile.interpret_chunk(chunk)
+		lazy = LazyProfile(config, chunk, _settings=settings)
+		self.assertEqual(bytes(profiles[0].position), reference.tobytes())
+		# calculées une seule fois, partagées en lecture seule
+		self.assertIs(profiles[0].position, profiles[1].position)
+		self.assertIs(lazy.position, profiles[0].position)
+		with self.assertRaises((TypeError, ValueError)):
+			profiles[0].position[0] = 0.
+		self.assertIsNone(LazyProfile(config, chunk).position)
+
+		faster = cell_positions(25, 1, settings, _sound_speed=settings['sound_speed']*1.01)
+		self.assertIsNot(faster, profiles[0].position)
+		self.assertAlmostEqual(faster[n_cells-1], reference[n_cells-1]*1.01, places=6)
+		# une seule entrée par configuration, quelle que soit la célérité
+		for i in range(10):
+			cell_positions(25, 1, settings, _sound_speed=1400.+i)
+		self.assertEqual(len(ub_profile._position_cache), 1)
+		# autres settings sous la même ref : l'entrée n'est pas réutilisée
+		moved = dict(settings, config1=dict(config, r_vol1=config['r_vol1']+1.))
+		self.assertAlmostEqual(cell_positions(25, 1, moved)[0], reference[0]+1., places=5)
+		self.assertEqual(bytes(cell_positions(25, 1, settings)), reference.tobytes())
+		# nombre de configurations conservées borné
+		for ref in range(ub_profile.POSITION_CACHE_SIZE + 10):
+			cell_positions(ref, 1, settings)
+		self.assertEqual(len(ub_profile._position_cache), ub_profile.POSITION_CACHE_SIZE)
+
+		saved_np, ub_profile.np = ub_profile.np, None # NumPy absent
+		try:
+			clear_position_cache()
+			positions = cell_positions(25, 1, settings)
+			self.assertIsInstance(positions, memoryview)
+			self.assertEqual(bytes(positions), reference.tobytes())
+			self.assertTrue(positions.readonly)
+		finally:
+			ub_profile.np = saved_np
+			clear_position_cache()
+
+		settings['config1'] = dict(config, r_dsubvol=None)
+		with self.assertRaises(ValueError):
+			cell_positions(26, 1, settings)
+
+
+# We need this to be able to run the tests outside a test framework.
+if __name__ == '__main__':
+	unittest.main()
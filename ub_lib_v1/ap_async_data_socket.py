@@ -0,0 +1,518 @@
+#!/usr/bin/env python
+# -*- coding: UTF_8 -*-
+# @copyright  this code is the property of Ubertone.
+# You may use this code for your personal, informational, non-commercial purpose.
+# You may not distribute, transmit, display, reproduce, publish, license, create derivative works from, transfer or sell any information, software, products or services based on this code.
+# @author Stéphane Fischer
+
+## @package ap_async_data_socket
+#\brief Equivalent asyncio de ApDataSocket
+#
+# Même protocole de trames, mêmes flags, mêmes modes sélectif / non sélectif
+# que ap_data_socket, mais sans thread de réception ni lock : la réception est
+# une tâche asyncio et toutes les fonctions d'attente sont des coroutines.
+# Une seule boucle d'événements peut ainsi piloter de nombreux instruments.
+#
+# le programme appelant peut utiliser les fonction suivantes
+# - AsyncApDataSocket ( HOST, PORT ) le constructeur de la classe
+# - await open ()
+# - await close ()
+# - await wait_connexion ()
+# - await set_connexion_timeout () : defini le timeout
+# - await send_frame ()
+# - await recv_frame ()
+# - set_event () puis await event.wait ()
+# - await wait_flag ()
+# - read_frame ()
+# - await send_recv_frame ()
+# - clear_buffer ()
+#
+# Les exceptions de la tâche de réception sont remontées, comme pour
+# ApDataSocket, lors de l'appel suivant à l'une de ces fonctions.
+
+import asyncio
+from asyncio import IncompleteReadError
+import socket
+from struct import Struct, pack
+from time import monotonic, monotonic_ns
+import traceback
+
+from ub_lib_v1.ap_data_socket import AP_DATA_SOCKET_SELECTIVE, CMD_TCP_TIMEOUT_SOCKET, ANS_TCP_TIMEOUT_SOCKET
+from ub_lib_v1.ap_socket import applyTransportProfile, checkTransportProfile, transportQuickack, rearmQuickack, reconnectDelay
+from ub_lib_v1.ap_exception import ap_socket_exception, ap_socket_error, ap_socket_timeout
+from ub_lib_v1.ap_frame_store import ApFrameStore, FRAME_STORE_DROP_OLDEST, FRAME_STORE_BLOCK, FRAME_STORE_POLICIES
+from ub_lib_v1.ap_waiter_registry import ApWaiterRegistry
+from ub_lib_v1.ap_deadline_scheduler import NS_PER_S
+from ub_lib_v1.ub_class_template import UbClassTemplate, txt_regular_blue
+
+_int_struct = Struct('i')
+_header_struct = Struct('ii')
+
+
+## \brief Evenement lié à la réception d'un flag par une AsyncApDataSocket
+# seul la fonction wait() est à utiliser
+class ap_async_socket_event:
+	def __init__(self, _socket, _flag):
+		self.socket = _socket
+		self.flag = _flag
+		self.future = asyncio.get_running_loop().create_future()
+		# mode pipeline, cf. ap_socket_event
+		self.frame = None
+		self.answer_expected = False
+		self.abandoned = False
+
+	def set(self):
+		if not self.future.done():
+			self.future.set_result(True)
+
+	def isSet(self):
+		self.socket._catch_exception_from_socket_task()
+		if not self.socket.event_is_connected.is_set():
+			raise ap_socket_error (308, "ap_async_socket_event::isSet : CONNEXION FAILURE")
+		return self.future.done()
+
+	async def wait(self, _timeout=None):
+		try:
+			await asyncio.wait_for(asyncio.shield(self.future), _timeout)
+		except asyncio.TimeoutError:
+			pass
+
+		self.socket._catch_exception_from_socket_task()
+
+		if not self.socket.event_is_connected.is_set():
+			raise ap_socket_error (309, "ap_async_socket_event::wait : CONNEXION FAILURE")
+
+		if not self.future.done():
+			self.socket.del_event(self)
+			raise ap_socket_timeout (208, "ap_async_socket_event::wait : TIMEOUT")
+
+
+class AsyncApDataSocket(UbClassTemplate):
+
+	## \brief Constructeur de la data_socket asyncio
+	# @param[in] _host the host address string
+	# @param[in] _port the socket port (integer)
+	# @param[in] _transport_profile optionnal - socket tuning, cf. ApDataSocket
+	# @param[in] _unique_waiter optionnal - cf. ApDataSocket
+	# @param[in] _pipelined optionnal - cf. ApDataSocket (les requêtes sont émises dans
+	#            l'ordre d'enregistrement, la boucle étant mono-thread)
+	def __init__(self, _host, _port, _transport_profile=None, _unique_waiter=True, _pipelined=False):
+		UbClassTemplate.__init__(self)
+
+		self.flag_debug_mess=False
+		self.debug_marker_start=txt_regular_blue
+		self.mode=AP_DATA_SOCKET_SELECTIVE
+		self.host = _host
+		self.port = int(_port)
+		checkTransportProfile(_transport_profile)
+		self.transport_profile = _transport_profile
+		self.transport_info = {}
+		self.reader = None
+		self.writer = None
+		self.recv_task = None
+
+		self.is_open = False
+		# timeout de déconnexion :
+		self.timeout = 18
+		self.tic_ns = monotonic_ns()
+		# le keepalive n'est envoyé que si rien n'a été émis depuis
+		# keepalive_ratio*timeout (et que la data_socket est active ou reçoit
+		# encore des trames)
+		self.keepalive_ratio = 0.5
+		self.last_send_time = monotonic()
+		self.last_recv_time = 0.
+		self.event_is_connected = asyncio.Event()
+		# reprends l'exception attrapée dans la tâche de réception :
+		self.system_exception = None
+		self.pipelined = _pipelined
+		self.wait_buffer = ApWaiterRegistry(_unique_waiter and not _pipelined)
+		self.recv_buffer = ApFrameStore()
+		# politique FRAME_STORE_BLOCK : levé lorsque le consommateur libère de la place
+		self.space_available = asyncio.Event()
+
+	def __pop_frame(self, _flag=None):
+		if not len(self.recv_buffer):
+			raise ap_socket_exception (322, "async_data_socket::__pop_frame : recv_buffer empty")
+
+		frame = self.recv_buffer.pop(_flag)
+		if frame is not None:
+			self.space_available.set()
+			return frame
+
+		raise ap_socket_exception (303, "async_data_socket: flag %d not found in recv_buffer"%(_flag))
+
+	def __private_set_event(self, _flag):
+		sock_event = ap_async_socket_event(self, _flag)
+		self.wait_buffer.add(sock_event) # raise 320 si wait_buffer.unique
+		return sock_event
+
+	def _catch_exception_from_socket_task(self):
+		""" @brief Catch any exception raised in the receive task
+		"""
+		if self.system_exception :
+			self.info("exception received from socket task : %s"%str(self.system_exception))
+			tmp = self.system_exception
+			self.system_exception = None
+			raise tmp
+
+	def __check_connected(self, _code, _caller):
+		self._catch_exception_from_socket_task()
+		if not self.event_is_connected.is_set():
+			raise ap_socket_exception (_code, "async_data_socket::%s : socket is not connected"%_caller)
+
+	def __write_frame(self, _flag, _message):
+		if _message is None:
+			_message = b''
+		elif isinstance(_message, str):
+			_message = _message.encode('UTF8')
+		# le transport bufferise les deux blocs, le message n'est pas concaténé
+		self.writer.write(_header_struct.pack(_flag, len(_message)))
+		if len(_message):
+			self.writer.write(_message)
+		self.last_send_time = monotonic()
+
+	## \brief envoie un keepalive si rien n'a été émis depuis keepalive_ratio*timeout
+	# et que la data_socket est active ou que des trames ont été reçues depuis la
+	# dernière émission (cf. ApDataSocket.private_keepalive)
+	# @return le délai (s) avant la prochaine vérification
+	def __keepalive(self):
+		period = self.timeout*self.keepalive_ratio
+		delay = self.last_send_time + period - monotonic()
+		if delay > 0:
+			return delay
+		if self._is_active() or self.last_recv_time > self.last_send_time:
+			self.writer.write(_int_struct.pack(1)) # flag keepalive
+			self.last_send_time = monotonic()
+		return period
+
+#######################################################################
+# Tâche de réception                                                  #
+#######################################################################
+
+	## \brief lecture du flag de la prochaine trame, le keepalive est envoyé
+	# pendant l'attente si la liaison est inactive
+	async def __recv_flag(self):
+		while True:
+			try:
+				# en cas de timeout, les octets déjà reçus restent dans le buffer du reader
+				return _int_struct.unpack(await asyncio.wait_for(self.reader.readexactly(4), self.__keepalive()))[0]
+			except asyncio.TimeoutError:
+				pass
+
+	async def __recv_anyframe(self):
+		flag = await self.__recv_flag()
+		while flag < 2 and flag != 0:
+			flag = await self.__recv_flag()
+		if flag == 0:
+			raise ap_socket_error(30, "async_data_socket : driver error while reading the socket")
+
+		tab_size = _int_struct.unpack(await self.reader.readexactly(4))[0]
+		if tab_size < 0:
+			raise ap_socket_error(31, "async_data_socket : taille de frame erronée (%d)"%(tab_size))
+		data = await self.reader.readexactly(tab_size)
+		return flag, tab_size, data
+
+	async def __run(self):
+		print_connect_failed = None
+		connect_attempts = 0 # échecs de connexion consécutifs (cf. reconnectDelay)
+		while self.is_open:
+			self.event_is_connected.clear()
+			try:
+				try:
+					sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+					# réglages TCP (avant le connect pour la taille des buffers)
+					self.transport_info = applyTransportProfile(sock, self.transport_profile)
+					sock.setblocking(False)
+					try:
+						await asyncio.get_running_loop().sock_connect(sock, (self.host, self.port))
+					except:
+						sock.close()
+						raise
+					self.reader, self.writer = await asyncio.open_connection(sock=sock)
+				except OSError as serr:
+					if serr.errno != print_connect_failed:
+						self.info("connexion to %s:%d failed (with error %s), try undefinitely"%(self.host, self.port, serr.errno))
+						print_connect_failed = serr.errno
+					await asyncio.sleep(reconnectDelay(connect_attempts))
+					connect_attempts += 1
+					continue
+				self.info("connected to the driver (%s:%d)"%(self.host, self.port))
+				print_connect_failed = None
+				connect_attempts = 0
+
+				# at startup, reset the timeout on server side
+				self.__write_frame(CMD_TCP_TIMEOUT_SOCKET, pack("i", int(self.timeout+2)))
+				await self.writer.drain()
+				self.event_is_connected.set()
+
+				quickack = transportQuickack(self.transport_profile)
+				while True:
+					flag, tab_size, data = await self.__recv_anyframe()
+					if quickack: # non permanent, cf. ap_socket.rearmQuickack
+						rearmQuickack(sock)
+					self.debug("on recoit flag %d (size = %d)"%(flag, tab_size))
+					while not self.push_recv_buffer(flag, tab_size, data):
+						# recv_buffer plein (FRAME_STORE_BLOCK) : la socket n'est plus lue,
+						# le driver est ralenti par le contrôle de flux TCP
+						self.space_available.clear()
+						try:
+							await asyncio.wait_for(self.space_available.wait(), self.__keepalive())
+						except asyncio.TimeoutError:
+							pass
+
+			except asyncio.CancelledError:
+				raise
+			except IncompleteReadError:
+				self.info("socket closed by driver (probably due to inactivity)")
+				self.system_exception = None
+				self.is_open = False
+			except OSError as serr:
+				self.system_exception = ap_socket_error(serr.errno or 0, serr.strerror or str(serr))
+				self.info("%s : %s"%(serr.errno, serr.strerror))
+			except ap_socket_error as sexcept:
+				self.info("ap_socket_error \"%s\"-> reset"%sexcept.message)
+				self.system_exception = sexcept
+			except Exception:
+				self.system_exception = ap_socket_error(132, "async_data_socket : unexpected exception while receiving frame")
+				self.info("WARNING unexpected exception while receiving frame")
+				print (traceback.format_exc())
+
+			self.private_reset()
+			if self.system_exception and not self._is_active():
+				self.info("closing because of exception while socket is inactive")
+				self.is_open = False
+			if self.is_open:
+				self.info("try to reconnect")
+
+		self.info("data_socket has been closed")
+
+	## \brief ajoute la nouvelle trame au buffer et prévient le demandeur
+	# utilisé uniquement par la tâche de réception
+	# @return False si la trame est refusée (recv_buffer plein, politique FRAME_STORE_BLOCK)
+	def push_recv_buffer(self, flag, tab_size, data):
+		self.last_recv_time = monotonic()
+		if self.pipelined:
+			sock_event = self.wait_buffer.pop(flag)
+			if sock_event is not None:
+				if not sock_event.abandoned:
+					sock_event.frame = (flag, tab_size, data)
+					sock_event.set()
+				return True
+		if not self.mode==AP_DATA_SOCKET_SELECTIVE:
+			if not self.recv_buffer.push((flag, tab_size, data)):
+				if self.recv_buffer.policy == FRAME_STORE_BLOCK and self.event_is_connected.is_set():
+					return False
+				self.debug("INFO frame %d is dropped (recv_buffer full)"%flag)
+				return True
+
+		sock_event = self.wait_buffer.pop(flag)
+		if sock_event is not None:
+			if self.mode==AP_DATA_SOCKET_SELECTIVE:
+				self.recv_buffer.push((flag, tab_size, data), _force=True)
+			sock_event.set()
+		elif self.mode==AP_DATA_SOCKET_SELECTIVE:
+			self.debug("INFO frame %d is lost (selective mode)"%flag)
+		return True
+
+	## \brief deconnecte la socket et réveille tous les demandeurs
+	def private_reset(self):
+		self.event_is_connected.clear()
+		if self.writer is not None:
+			self.writer.close()
+			self.writer = None
+		self.reader = None
+		for sock_event in self.wait_buffer.clear():
+			sock_event.set()
+		self.space_available.set()
+
+	def del_event(self, _event):
+		self.tic_ns = monotonic_ns()
+		if self.pipelined and _event.answer_expected:
+			_event.abandoned = True # absorbe la réponse tardive, cf. ApDataSocket
+		else:
+			self.wait_buffer.remove(_event)
+
+	def _is_active(self):
+		""" @brief test si la data_socket est active
+		"""
+		return monotonic_ns() - self.tic_ns <= self.timeout*NS_PER_S or len(self.wait_buffer) > 0
+
+#######################################################################
+# Fonctions publiques                                                 #
+#######################################################################
+
+	## \brief ouvre la socket et lance la tâche de réception
+	async def open(self):
+		if self.is_open :
+			raise ap_socket_exception (312, "async_data_socket::open : socket already open")
+		self.is_open = True
+		self.recv_task = asyncio.ensure_future(self.__run())
+
+	## \brief cloture la socket et arrete la tâche de réception
+	async def close(self):
+		self.info("demande de cloture de la socket")
+		self._catch_exception_from_socket_task()
+		if self.writer is not None:
+			try:
+				self.writer.write(_int_struct.pack(0))
+				await self.writer.drain()
+			except Exception: # on ne remonte pas d'exception en cas d'échec
+				self.info("WARNING, fail to send close commande to the driver")
+		self.is_open = False
+		self.private_reset()
+		if self.recv_task is not None:
+			self.recv_task.cancel()
+			try:
+				await self.recv_task
+			except asyncio.CancelledError:
+				pass
+			self.recv_task = None
+
+	## \brief attend que la connexion avec le driver soit établie
+	# ouvre la socket si besoin
+	async def wait_connexion(self, _timeout=None):
+		if not self.is_open:
+			await self.open()
+		try:
+			await asyncio.wait_for(self.event_is_connected.wait(), _timeout)
+		except asyncio.TimeoutError:
+			self._catch_exception_from_socket_task()
+			raise ap_socket_timeout (209, "async_data_socket::wait_connexion : TIMEOUT")
+		self._catch_exception_from_socket_task()
+
+	## \brief defini le timeout de déconnexion du driver
+	async def set_connexion_timeout(self, _timeout):
+		self.__check_connected(319, "set_connexion_timeout")
+		self.info ("setting timeout at %fs"%_timeout)
+		self.timeout = _timeout
+		await self.send_recv_frame(CMD_TCP_TIMEOUT_SOCKET, pack("i", int(_timeout+2)), ANS_TCP_TIMEOUT_SOCKET, 5.)
+
+	## \brief envoie une trame TCP
+	async def send_frame(self, _flag, _message):
+		self.__check_connected(316, "send_frame")
+		try:
+			self.__write_frame(_flag, _message)
+			await self.writer.drain()
+		except OSError as serr:
+			self.private_reset()
+			raise ap_socket_error (118, "async_data_socket::send_frame : send fail, socket reconnect (%s)"%serr)
+
+	## \brief Attache un évènement à la réception d'un flag particulier
+	# le set_event doit être fait avant d'envoyer la trame susceptible de le déclencher
+	# @return ap_async_socket_event dont la coroutine wait() attend la trame
+	def set_event(self, _flag):
+		self.__check_connected(315, "set_event")
+		return self.__private_set_event(_flag)
+
+	## \brief attend la réception d'une trame identifiée par son flag et la retourne
+	async def wait_flag(self, _flag, _timeout=10.):
+		frame_ready = self.set_event(_flag)
+		await frame_ready.wait(_timeout)
+		if frame_ready.frame is not None:
+			return frame_ready.frame
+		return self.read_frame(_flag)
+
+	## \brief reception d'une trame identifiée par son flag
+	# retourne directement la trame si elle est déjà dans le buffer
+	async def recv_frame(self, _flag, _timeout=10.):
+		self.__check_connected(314, "recv_frame")
+		try:
+			return self.__pop_frame(_flag)
+		except ap_socket_exception:
+			frame_ready = self.__private_set_event(_flag)
+		await frame_ready.wait(_timeout)
+		if frame_ready.frame is not None:
+			return frame_ready.frame
+		return self.read_frame(_flag)
+
+	## \brief envoie une trame TCP et recoit une réponse
+	# remonte l'exception 317 si la réponse est déjà présente dans le buffer (sauf en mode pipeline)
+	async def send_recv_frame(self, _flag_send, _message_send, _flag_recv, _timeout=10.):
+		self.__check_connected(318, "send_recv_frame")
+		if not self.pipelined and _flag_recv in self.recv_buffer:
+			raise ap_socket_exception (317, "async_data_socket::send_recv_frame : flag %d already received"%(_flag_recv))
+
+		frame_ready = self.__private_set_event(_flag_recv)
+		frame_ready.answer_expected = True
+		try:
+			self.__write_frame(_flag_send, _message_send)
+			await self.writer.drain()
+		except OSError as serr:
+			self.private_reset()
+			raise ap_socket_error (119, "async_data_socket::send_recv_frame : send fail, socket reconnect (%s)"%serr)
+
+		await frame_ready.wait(_timeout)
+		if frame_ready.frame is not None:
+			return frame_ready.frame
+		return self.read_frame(_flag_recv)
+
+	## \brief envoie une série de requêtes et attend leurs réponses, cf. ApDataSocket.send_recv_many
+	# les évenements sont enregistrés et les trames écrites sans rendre la main à
+	# la boucle, avec un seul drain
+	# @param _requests liste de (flag_send, message_send, flag_recv)
+	# @return la liste des réponses (flag, size, data) dans l'ordre des requêtes
+	async def send_recv_many(self, _requests, _timeout=10.):
+		self.__check_connected(325, "send_recv_many")
+		batch = []
+		try:
+			for flag_send, message_send, flag_recv in _requests:
+				if not self.pipelined and flag_recv in self.recv_buffer:
+					raise ap_socket_exception (317, "async_data_socket::send_recv_many : flag %d already received"%(flag_recv))
+				frame_ready = self.__private_set_event(flag_recv)
+				frame_ready.answer_expected = True
+				batch.append(frame_ready)
+		except:
+			for frame_ready in batch:
+				self.wait_buffer.remove(frame_ready)
+			raise
+		try:
+			for flag_send, message_send, flag_recv in _requests:
+				self.__write_frame(flag_send, message_send)
+			await self.writer.drain()
+		except OSError as serr:
+			self.private_reset()
+			raise ap_socket_error (119, "async_data_socket::send_recv_many : send fail, socket reconnect (%s)"%serr)
+
+		deadline = monotonic() + _timeout
+		answers = []
+		try:
+			for frame_ready in batch:
+				await frame_ready.wait(max(0., deadline - monotonic()))
+				answers.append(frame_ready.frame if frame_ready.frame is not None else self.read_frame(frame_ready.flag))
+		except:
+			# les requêtes suivantes ne sont plus attendues
+			for frame_ready in batch:
+				if not frame_ready.future.done():
+					self.del_event(frame_ready)
+			raise
+		return answers
+
+	## \brief lecture d'une trame dans le buffer de réception
+	# remonte une socket_exception si la trame est absente
+	def read_frame(self, _flag=None):
+		self._catch_exception_from_socket_task()
+		return self.__pop_frame(_flag)
+
+	## \brief nettoie le buffer des trames TCP
+	# @param _flag défini le type de trames à supprimer du buffer \
+	#              si ce paramètre n'est pas spécifié, le buffer est entièrement vidé
+	# @return nombre de trames supprimées
+	def clear_buffer (self, _flag=None):
+		self._catch_exception_from_socket_task()
+		size = self.recv_buffer.clear(_flag)
+		self.space_available.set()
+		self.debug("receive buffer cleared (%d frames)"%size)
+		return size
+
+	## \brief borne le buffer des trames TCP, cf. ApDataSocket.set_buffer_limits
+	def set_buffer_limits(self, _max_frames=None, _max_bytes=None, _max_frames_per_flag=None, _max_bytes_per_flag=None, _policy=FRAME_STORE_DROP_OLDEST):
+		if _policy not in FRAME_STORE_POLICIES:
+			raise ap_socket_exception (324, "async_data_socket::set_buffer_limits : unknown policy %s"%str(_policy))
+		self.recv_buffer.set_limits(_max_frames, _max_bytes, _max_frames_per_flag, _max_bytes_per_flag, _policy)
+		self.space_available.set()
+
+	## \brief compteurs des trames supprimées ou rejetées, cf. ApDataSocket.get_drop_counters
+	def get_drop_counters(self):
+		return {"frames": self.recv_buffer.dropped_frames,
+		        "bytes": self.recv_buffer.dropped_bytes,
+		        "by_flag": dict(self.recv_buffer.dropped_by_flag)}
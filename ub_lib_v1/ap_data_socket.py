@@ -22,6 +22,11 @@
 # - read_frame ()
 # - send_recv_frame ()
 # - clear_buffer ()
+# - subscribe () / unsubscribe ()
+# - submit () / send_recv_many ()
+# - set_session_replay () / get_recovery_stats ()
+# - stats () : compteurs de fonctionnement (cf. ap_stats_exporter)
+# - enable_trace () / disable_trace () : traces de latence des requêtes (cf. ap_trace)
 
 
 # GESTION DES EXCEPTIONS SYSTEME
@@ -50,7 +55,59 @@
 # en cas de deconnexion ou timeout on remonte une execption pour que
 # l'appelent puisse attendre la reconnexion (automatique)
 #
-# TODO ? changer wait_buffer en event_list? waiting_list? et intégrer le flag dans les ap_socket_event ?
+# wait_buffer est un ApWaiterRegistry : les évenements sont indexés par flag
+# et chaque ap_socket_event connait son flag
+#
+# ABONNEMENTS (subscribe)
+# Pour les flux à haut débit (ANS_TCP_PROFILE_INST ...), plutôt que
+# set_event / wait / read_frame pour chaque trame, un callback(flag, size, data)
+# peut être abonné à un flag : la réception lui remet directement les trames,
+# sans passer par recv_buffer (et y compris en mode sélectif).
+# Le callback est appelé hors lock, soit dans le thread de réception (ou du
+# InstrumentHub : il doit alors être court), soit via l'executor fourni
+# (concurrent.futures.Executor, par ex. un ThreadPoolExecutor dont max_workers
+# borne le nombre de callbacks simultanés). Un évenement en attente du même
+# flag reçoit également la trame.
+# Avec un executor, le nombre de trames en attente de leur callback est borné
+# par abonnement (_max_pending) : au-delà la trame est rejetée et comptée
+# (FRAME_STORE_DROP_NEWEST) ou la réception attend (FRAME_STORE_BLOCK), cf.
+# ap_subscription et get_subscription_drop_counters.
+#
+# MODE PIPELINE (_pipelined=True)
+# Plusieurs send_recv_frame peuvent attendre le même flag de réponse (par ex.
+# plusieurs CMD_TCP_PROFILE_INST en cours) : les évenements sont servis dans
+# l'ordre d'enregistrement et les requêtes émises dans ce même ordre (ticket),
+# le driver répondant dans l'ordre des requêtes. La réponse est attachée à
+# l'évenement (attribut frame) et non rangée dans recv_buffer : l'erreur 317
+# (réponse déjà présente) ne s'applique pas.
+# Une requête abandonnée sur timeout reste dans la file pour absorber sa
+# réponse tardive, qui sinon serait remise à la requête suivante. Si le driver
+# ne répond jamais, le décalage persiste jusqu'à la prochaine reconnexion.
+#
+# REQUÊTES ASYNCHRONES (submit, send_recv_many)
+# submit émet une requête et retourne un concurrent.futures.Future, terminé
+# avec la réponse (flag, size, data), ap_socket_timeout (208) ou ap_socket_error
+# (309, déconnexion). send_recv_many enregistre les évenements de toutes ses
+# requêtes sous un seul lock et les émet en un seul appel (sendmsg), les
+# réponses arrivant pendant l'émission des suivantes. La réponse est attachée
+# à l'évenement, comme en mode pipeline.
+# Les timeouts sont gérés par ApDeadlineScheduler (un seul thread pour toutes
+# les data_sockets). Les Futures sont terminés hors lock, sauf lors d'une déconnexion
+# (private_reset) : leurs callbacks ne doivent pas attendre un autre thread
+# utilisant la data_socket.
+#
+# REPRISE DE SESSION (set_session_replay)
+# A la reconnexion, le handshake renvoie au driver, en un seul appel :
+# - le timeout (CMD_TCP_TIMEOUT_SOCKET, comme auparavant)
+# - le dernier message émis pour chaque flag de replay_requests (par défaut
+#   CMD_TCP_CONFIG : les settings appliqués), la réponse étant absorbée
+# - les requêtes idempotentes (idempotent_flags) en attente de réponse lors de
+#   la coupure : leurs évenements sont conservés par private_reset et la réponse
+#   est remise à l'appelant, toujours en attente (wait), comme sans coupure.
+#   L'erreur de connexion n'est alors pas remontée (system_exception).
+# Les autres requêtes en cours échouent (309) comme auparavant.
+# Le délai de reprise (de la coupure à la première trame reçue après la
+# reconnexion) est mesuré, cf. get_recovery_stats.
 
 # Flag interne à data socket (entre 0 et 99)
 # 0 : signal à l'interlocuteur la cloture de la socket
@@ -69,6 +126,7 @@
 # TAG_SYS_EXCEPTION : remonter en cas d'exception systeme ?
 
 #concernant la gestion des déconnexions de la data_socket :
+# (les settings sont désormais renvoyés à la reconnexion, cf. REPRISE DE SESSION)
 #dans l'état actuel des choses, quoi qu'on fasse on ne peut pas être certain qu'il n'y a pas eu de déconnexion juste avant une demande de mesure. 
 #
 #Pour contourner le problème (qui je pense ne peux pas être traiter simplement dans le module ap_data_socket) je propose de :
@@ -81,15 +139,23 @@
 #
 
 
-from threading import Event, RLock
-from time import localtime, mktime
+import socket
+from collections import deque
+from concurrent.futures import Future
+from threading import Condition, Event, Lock, RLock
+from time import monotonic, monotonic_ns
 from copy import deepcopy
 from struct import calcsize, pack
 
 from ub_lib_v1.ap_socket_recv_thread import ApSocketRecvTh
-from ub_lib_v1.ap_socket import sendAll
-from ub_lib_v1.ap_exception import ap_socket_exception, ap_socket_error
+from ub_lib_v1.ap_socket import sendAll, sendFrame, sendFrames, sendNoWait, checkTransportProfile
+from ub_lib_v1.ap_exception import ap_socket_exception, ap_socket_error, ap_socket_timeout
 from ub_lib_v1.ap_socket_event import ap_socket_event
+from ub_lib_v1.ap_frame_store import ApFrameStore, FRAME_STORE_DROP_OLDEST, FRAME_STORE_DROP_NEWEST, FRAME_STORE_BLOCK, FRAME_STORE_POLICIES
+from ub_lib_v1.ap_waiter_registry import ApWaiterRegistry
+from ub_lib_v1.ap_subscription import ApSubscription, SUBSCRIPTION_MAX_PENDING, SUBSCRIPTION_POLICIES
+from ub_lib_v1.ap_deadline_scheduler import get_deadline_scheduler, NS_PER_S
+from ub_lib_v1.ap_trace import ApTraceBuffer, trace_mark, TRACE_SEND, TRACE_HEADER, TRACE_COMPLETE, TRACE_DISPATCH, TRACE_WAKE
 from ub_lib_v1.ub_class_template import UbClassTemplate, txt_regular_blue
 import traceback
 
@@ -104,6 +170,10 @@ AP_DATA_SOCKET_NON_SELECTIVE = 2
 CMD_TCP_TIMEOUT_SOCKET = 10007
 ANS_TCP_TIMEOUT_SOCKET = 20007
 
+# requêtes renvoyées à la reconnexion (flag émis -> flag de la réponse) :
+# CMD_TCP_CONFIG -> ANS_TCP_CONFIG (cf. apf02_frame_flags)
+DEFAULT_SESSION_REPLAY = {10000: 20000}
+
 
 class ApDataSocket(UbClassTemplate):
 	
@@ -111,7 +181,14 @@ class ApDataSocket(UbClassTemplate):
 	# @param[in] _host the host address string
 	# @param[in] _port the socket port (integer)
 	# @param[in] _is_reset optionnal - Event that warn in cas of connexion reset : not used in this project
-	def __init__(self, _host, _port, _is_reset=Event()):
+	# @param[in] _hub optionnal - InstrumentHub servicing the socket (instead of a dedicated receive thread)
+	# @param[in] _transport_profile optionnal - socket tuning : "low_latency", "bulk", a dict of
+	#            parameters (custom profile, cf. ap_socket.TRANSPORT_PROFILES) or None (OS defaults)
+	# @param[in] _unique_waiter optionnal - if True (default) a second event on a flag already
+	#            waited raises 320, otherwise the events are woken up in registration order
+	# @param[in] _pipelined optionnal - several send_recv_frame may wait for the same answer flag,
+	#            answers are matched to the requests in order (implies _unique_waiter=False)
+	def __init__(self, _host, _port, _is_reset=Event(), _hub=None, _transport_profile=None, _unique_waiter=True, _pipelined=False):
 		UbClassTemplate.__init__(self)
 
 		self.flag_debug_mess=False
@@ -122,22 +199,78 @@ class ApDataSocket(UbClassTemplate):
 		self.socket_id = -1
 		self.host = _host
 		self.port = _port
+		# InstrumentHub gérant la réception (None : thread de réception dédié)
+		self.hub = _hub
+		# réglages de la socket TCP, appliqués à chaque connexion
+		checkTransportProfile(_transport_profile)
+		self.transport_profile = _transport_profile
+		# valeurs effectives des réglages de la dernière connexion (diagnostic)
+		self.transport_info = {}
 
 		# variable décrivant si la connexion est ouverte, permettant une recconnexion automatique par 
 		self.is_open = False
 		# timeout de déconnexion :
 		self.timeout = 18
-		self.tic = mktime(localtime())
+		# date (monotonic_ns) de référence du timeout d'inactivité
+		self.tic_ns = monotonic_ns()
 		   # rafraichi/stimulé par chaque appel à frame_ready.wait()
+		# le keepalive n'est envoyé que si rien n'a été émis depuis
+		# keepalive_ratio*timeout (et que la data_socket est active ou reçoit
+		# encore des trames)
+		self.keepalive_ratio = 0.5
+		self.last_send_time = monotonic()
+		self.last_recv_time = 0.
 		self.event_is_connected = Event()
 		self.event_is_reset = _is_reset 
 		# reprends l'exception attrapée dans socket_recv_thread :
 		self.system_exception = None
 		# self.test_system_exception = False
-		self.wait_buffer = []
-		self.recv_buffer = [] # on ne peut pas utiliser un objet queue car 
-		# on n'attends pas une frame quelconque mais avec un tag particulier
+		self.pipelined = _pipelined
+		self.wait_buffer = ApWaiterRegistry(_unique_waiter and not _pipelined)
+		# flag -> tuple d'ApSubscription, remplacé à chaque modification
+		# pour être parcouru hors lock
+		self.subscribers = {}
+		self.recv_buffer = ApFrameStore() # une file par flag (et non un simple objet queue)
+		# car on n'attends pas une frame quelconque mais avec un tag particulier
 		self.__socket_lock = RLock()
+		# politique FRAME_STORE_BLOCK : la réception attend que le consommateur
+		# libère de la place dans recv_buffer
+		self.__space_available = Condition(self.__socket_lock)
+		self.__recv_blocked = False
+		# sérialise les émissions, qui sont faites hors de __socket_lock : la
+		# réception (thread dédié ou InstrumentHub) n'attend jamais la fin d'une
+		# émission bloquante (buffer d'émission plein, gros CMD_TCP_CONFIG ...)
+		# ordre de prise : __socket_lock puis __send_lock, jamais l'inverse
+		self.__send_lock = Lock()
+		# mode pipeline : les requêtes sont émises dans l'ordre d'enregistrement
+		# de leurs évenements (ticket attribué sous __socket_lock)
+		self.__send_turn_changed = Condition(self.__send_lock)
+		self.__send_ticket = 0
+		self.__send_turn = 0
+
+		# reprise de session (cf. REPRISE DE SESSION)
+		self.replay_requests = dict(DEFAULT_SESSION_REPLAY)
+		self.idempotent_flags = frozenset()
+		# flag émis -> dernier message émis, dans l'ordre des dernières émissions
+		self.replay_frames = {}
+		# flag de réponse -> nombre de réponses aux trames renvoyées à absorber
+		self.__replay_answers = {}
+		# délai de reprise : date de la coupure (monotonic_ns), nombre de
+		# reconnexions et derniers délais mesurés (s)
+		self.disconnect_ns = None
+		self.reconnect_count = 0
+		self.recovery_times = deque(maxlen=64)
+
+		# compteurs (cf. stats) : flag -> [trames, octets], mis à jour sous
+		# __socket_lock (réception, trames perdues) ou __send_lock (émission)
+		self.recv_counters = {}
+		self.send_counters = {}
+		self.lost_counters = {}
+		# attentes du lock principal : nombre et durée cumulée (ns)
+		self.lock_contended = 0
+		self.lock_wait_ns = 0
+		# traces de latence des requêtes (ApTraceBuffer), None : désactivées
+		self.trace = None
 
 	#	def read_frame(self, _flag=None): si None on pop le premier (tester si 0)
 	def __pop_frame(self, _flag=None):
@@ -145,36 +278,166 @@ class ApDataSocket(UbClassTemplate):
 			raise ap_socket_exception (322, "data_socket_c::__pop_frame : recv_buffer empty")
 
 #		self.debug("data_socket_c::__pop_frame : size = %d"%(len(self.recv_buffer)))
-		if _flag==None and len(self.recv_buffer) > 0:
+		if _flag==None:
 			self.debug("pop any frame")
-			return self.recv_buffer.pop(0)
-
-		for i in range(len(self.recv_buffer)):
-			if self.recv_buffer[i][0] == _flag:
-#				self.debug("data_socket_c::__pop_frame : data ready")
-				# il faut extraire la bonne
-				flag, size, data = self.recv_buffer.pop(i)
-	#			self.debug("data_socket_c::__pop_frame : get data")
-				return flag, size, data
-		
+			frame = self.recv_buffer.pop()
+			self.__space_freed()
+			return frame
+
+		# extraction de la plus ancienne trame du flag, sans parcours du buffer
+		frame = self.recv_buffer.pop(_flag)
+		if frame is not None:
+			self.__space_freed()
+			return frame
+
 		raise ap_socket_exception (303, "data_socket_c: flag %d not found in recv_buffer"%(_flag))
 
+	## \brief relance la réception bloquée par la politique FRAME_STORE_BLOCK
+	# version sans lock
+	def __space_freed(self):
+		if self.__recv_blocked:
+			self.__recv_blocked = False
+			self.__space_available.notify_all()
+			if self.hub is not None:
+				self.hub.wakeup()
+
 	## \brief Attache un évènement d'un thread
 	# pour une réception ultérieure (type BLOC_END) 
 	# version sans lock 
 	def __private_set_event(self, _flag):
 		self.debug("flag %d" % (_flag))
-		# abort on the same flag 
-		for i in range(len(self.wait_buffer)):
-			if self.wait_buffer[i][0]==_flag:
-				self.debug("flag %d twice !" % _flag)
-				raise ap_socket_exception(320, "data_socket_c: flag %d twice !" % _flag)
-		
-		sock_event = ap_socket_event(self)
-		self.wait_buffer.append((_flag, sock_event))
+		sock_event = ap_socket_event(self, _flag)
+		# abort on the same flag (raise 320 si wait_buffer.unique)
+		self.wait_buffer.add(sock_event)
 
 		return sock_event
 
+	## \brief attribue le rang d'émission d'une requête en mode pipeline
+	# version sans lock, appelée avec l'enregistrement de l'évenement
+	def __take_ticket(self):
+		if not self.pipelined:
+			return None
+		ticket = self.__send_ticket
+		self.__send_ticket += 1
+		return ticket
+
+	## \brief remet une trame à l'évenement qui l'attend
+	# version sans lock
+	# @param _recv_ns dates de réception de la trame (cf. ApFrameReader.frame_ns)
+	# @return l'évenement si son Future (submit) est à terminer hors lock, sinon None
+	def __deliver(self, _sock_event, _frame, _recv_ns=None):
+		if self.pipelined or _sock_event.future is not None:
+			if _sock_event.abandoned:
+				self.debug("INFO late answer %d absorbed (pipelined mode)"%_frame[0])
+				return None
+			_sock_event.frame = _frame
+		else:
+			# attendue, la trame n'est pas soumise aux limites de recv_buffer
+			self.recv_buffer.push(_frame, _force=True)
+		if _sock_event.trace is not None:
+			self.__trace_dispatch(_sock_event, _recv_ns)
+		_sock_event.set()
+		return _sock_event if _sock_event.future is not None else None
+
+	## \brief envoie une trame hors du lock principal (cf. __send_lock)
+	# en cas d'échec, la connexion est coupée pour être relancée par la réception
+	# @param _sock la socket relevée sous lock lors de la vérification de la connexion
+	# @param _code code de l'ap_socket_error remontée en cas d'erreur inattendue
+	# @param _ticket mode pipeline : rang d'émission (cf. __take_ticket), None : pas d'ordre imposé
+	# @param _frames trames supplémentaires [(flag, message), ...] émises par le même appel (send_recv_many)
+	# @param _trace trace de la requête (cf. ap_trace), la date d'émission y est notée
+	def __send_unlocked(self, _sock, _flag, _message, _code, _caller, _ticket=None, _frames=None, _trace=None):
+		failure = None
+		self.__send_lock.acquire()
+		try:
+			while _ticket is not None and self.__send_turn != _ticket:
+				self.__send_turn_changed.wait()
+			if _trace is not None:
+				trace_mark(_trace, TRACE_SEND, monotonic_ns())
+			if _frames is None:
+				sendFrame(_sock, _flag, _message) # en-tête et message envoyés sans concaténation
+			else:
+				sendFrames(_sock, [(_flag, _message)] + _frames)
+			self.last_send_time = monotonic()
+			self.__count_sent(_flag, _message)
+			for flag, message in _frames or ():
+				self.__count_sent(flag, message)
+			if self.replay_requests:
+				self.__record_replay(_flag, _message)
+				for flag, message in _frames or ():
+					self.__record_replay(flag, message)
+		except ap_socket_error as sockexc:
+			self.debug("ap_socket_error \"%s\""%str(sockexc))
+			failure = sockexc
+		except:
+			self.info( "sendAll fail, socket reconnect")
+			print (traceback.format_exc())
+			failure = ap_socket_error (_code, "ap_data_socket::%s : sendAll fail, socket reconnect"%_caller)
+		finally:
+			if _ticket is not None: # au tour de la requête suivante, même en cas d'échec
+				self.__send_turn += 1
+				self.__send_turn_changed.notify_all()
+			self.__send_lock.release()
+
+		if failure is not None:
+			self.lock()
+			try:
+				if self.socket_id is _sock: # pas déjà reconnectée entre temps
+					self.private_reset()
+			finally:
+				self.unlock()
+			raise failure
+
+	## \brief note la réception et la remise de la trame dans la trace de l'évenement
+	def __trace_dispatch(self, _sock_event, _recv_ns):
+		if _recv_ns is not None:
+			trace_mark(_sock_event.trace, TRACE_HEADER, _recv_ns[0])
+			trace_mark(_sock_event.trace, TRACE_COMPLETE, _recv_ns[1])
+		trace_mark(_sock_event.trace, TRACE_DISPATCH, monotonic_ns())
+
+	## \brief compte une trame émise (sous __send_lock)
+	def __count_sent(self, _flag, _message):
+		counter = self.send_counters.get(_flag)
+		if counter is None:
+			counter = self.send_counters[_flag] = [0, 0]
+		counter[0] += 1
+		if _message is not None:
+			counter[1] += len(_message.encode('UTF8')) if isinstance(_message, str) else memoryview(_message).nbytes
+
+	## \brief compte une trame reçue (counters : recv_counters ou lost_counters), sous lock
+	def __count_frame(self, _counters, _flag, _size):
+		counter = _counters.get(_flag)
+		if counter is None:
+			counter = _counters[_flag] = [0, 0]
+		counter[0] += 1
+		counter[1] += _size
+
+	## \brief conserve le dernier message émis d'un flag renvoyé à la reconnexion
+	# appelé sous __send_lock
+	def __record_replay(self, _flag, _message):
+		if _flag in self.replay_requests:
+			self.replay_frames.pop(_flag, None) # renvoyés dans l'ordre des dernières émissions
+			# copie d'un buffer modifiable par l'appelant
+			self.replay_frames[_flag] = _message if _message is None or isinstance(_message, (bytes, str)) else bytes(_message)
+
+	## \brief traite une trame reçue après une coupure (sous lock)
+	# mesure le délai de reprise et absorbe les réponses aux trames renvoyées
+	# @return True si la trame est absorbée
+	def __after_reconnect(self, _flag):
+		if self.disconnect_ns is not None and _flag != ANS_TCP_TIMEOUT_SOCKET:
+			self.recovery_times.append((monotonic_ns() - self.disconnect_ns)/NS_PER_S)
+			self.debug("session recovered in %fs"%self.recovery_times[-1])
+			self.disconnect_ns = None
+		count = self.__replay_answers.get(_flag)
+		if count is None:
+			return False
+		if count > 1:
+			self.__replay_answers[_flag] = count - 1
+		else:
+			del self.__replay_answers[_flag]
+		self.debug("answer %d to a replayed frame absorbed"%_flag)
+		return True
+
 	# pseudo private (utilisé dans socket_event
 	def _catch_exception_from_socket_thread(self):
 		""" @brief Catch any exception raised in socket thread
@@ -193,8 +456,13 @@ class ApDataSocket(UbClassTemplate):
 #######################################################################
 
 	## \brief Fait un lock sur la socket
+	# l'attente n'est mesurée que si le lock est déjà pris (cf. stats)
 	def lock(self):
-		self.__socket_lock.acquire()
+		if not self.__socket_lock.acquire(False):
+			start = monotonic_ns()
+			self.__socket_lock.acquire()
+			self.lock_contended += 1
+			self.lock_wait_ns += monotonic_ns() - start
 
 	## \brief Enlève le lock de la socket
 	def unlock(self):
@@ -202,52 +470,255 @@ class ApDataSocket(UbClassTemplate):
 
 
 	## \brief ajoute la nouvelle recv_buffer à la liste et prévient le demandeur
-	# utilisé uniquement par le thread socket_recv
-	def push_recv_buffer(self, flag, tab_size, data):
+	# utilisé uniquement par le thread socket_recv et par InstrumentHub
+	# @param _block avec la politique FRAME_STORE_BLOCK et un recv_buffer plein,
+	#        attend que de la place se libère (thread socket_recv). Sinon retourne
+	#        False sans traiter la trame (InstrumentHub, qui suspend la lecture de
+	#        la socket et représentera la trame)
+	# @param _recv_ns optionnal - (premier octet, trame complète) dates de réception
+	#        de la trame (monotonic_ns, cf. ApFrameReader.frame_ns), pour les traces
+	# @return True si la trame a été traitée (ajoutée, attendue, perdue ou rejetée)
+	def push_recv_buffer(self, flag, tab_size, data, _block=True, _recv_ns=None):
+		subscribers = self.subscribers.get(flag)
+		if subscribers is not None:
+			return self.__push_subscribers(subscribers, flag, tab_size, data, _block, _recv_ns)
+
 		self.debug("size recv_buffer = %d"%(len(self.recv_buffer)))
 		self.debug("size wait_buffer = %d"%(len(self.wait_buffer)))
+		completed = None
 		self.lock()
 
 		try:
+			self.last_recv_time = monotonic()
+			self.__count_frame(self.recv_counters, flag, tab_size)
+			if (self.disconnect_ns is not None or self.__replay_answers) and self.__after_reconnect(flag):
+				return True
 			# on accepte plusieurs frames avec le même flag (pour l'instant on prévient
-			for i in range(len(self.recv_buffer)):
-				if self.recv_buffer[i][0] == flag:
-	#				self.recv_buffer.pop(i)
-					self.debug("INFO flag %d already in recv_buffer : user have to clear"%(flag))
+			if self.flag_debug_mess and flag in self.recv_buffer:
+				self.debug("INFO flag %d already in recv_buffer : user have to clear"%(flag))
+
+			# en mode pipeline ou pour une requête soumise par submit, la réponse
+			# attendue est attachée à son évenement
+			sock_event = self.wait_buffer.first(flag)
+			if sock_event is not None and (self.pipelined or sock_event.future is not None):
+				self.wait_buffer.pop(flag)
+				completed = self.__deliver(sock_event, (flag, tab_size, data), _recv_ns)
+				return True
 
 			# en mode non selectif, toutes les trames recues sont mises dans le buffer
 			if not self.mode==AP_DATA_SOCKET_SELECTIVE:
-				# on ajoute la trame TCP dans la liste
-				self.recv_buffer.append((flag, tab_size, data))
+				frame = (flag, tab_size, data)
+				if sock_event is not None:
+					# trame attendue : elle n'est pas soumise aux limites de recv_buffer
+					self.recv_buffer.push(frame, _force=True)
+				# sinon on ajoute la trame TCP dans la liste (dans les limites de recv_buffer)
+				while sock_event is None and not self.recv_buffer.push(frame):
+					if self.recv_buffer.policy != FRAME_STORE_BLOCK:
+						self.debug("INFO frame %d is dropped (recv_buffer full)"%flag)
+						return True
+					self.__recv_blocked = True
+					if not _block:
+						self.recv_counters[flag][0] -= 1 # trame représentée par InstrumentHub
+						self.recv_counters[flag][1] -= tab_size
+						return False
+					if not self.event_is_connected.is_set(): # reset pendant l'attente
+						self.__count_frame(self.lost_counters, flag, tab_size)
+						return True
+					# le driver est ralenti par le contrôle de flux TCP, la liaison
+					# est maintenue par le keepalive
+					self.__space_available.wait(self.private_keepalive())
 				self.debug("data is set (non-selective mode)")
 
-			find_flag=False
-			# on commence par les requettes les plus anciennes
-			for i in range(len(self.wait_buffer)):
-				if self.wait_buffer[i][0] == flag:
-					find_flag=True
-					if self.mode==AP_DATA_SOCKET_SELECTIVE:
-						# on ajoute la trame TCP dans la liste
-						self.recv_buffer.append((flag, tab_size, data))
-						self.debug("data %s is set (selective mode)"%(flag))
-					# on leve l'event
-					self.wait_buffer[i][1].set()
-					# on supprime la requête
-	#				self.debug( "del request %s"%(flag))
-					del self.wait_buffer[i]
-					break # on ne traite qu'une seule requête
-
-			# si on arrive ici en mode sélectif, c'est que le falg n'est pas attendu
-			if self.mode==AP_DATA_SOCKET_SELECTIVE and not find_flag:
+			# on ne traite qu'une seule requête, la plus ancienne
+			sock_event = self.wait_buffer.pop(flag)
+			if sock_event is not None:
+				if self.mode==AP_DATA_SOCKET_SELECTIVE:
+					# on ajoute la trame TCP dans la liste : attendue, elle n'est
+					# pas soumise aux limites de recv_buffer
+					self.recv_buffer.push((flag, tab_size, data), _force=True)
+					self.debug("data %s is set (selective mode)"%(flag))
+				if sock_event.trace is not None:
+					self.__trace_dispatch(sock_event, _recv_ns)
+				# on leve l'event
+				sock_event.set()
+
+			# en mode sélectif, une trame non attendue est perdue
+			elif self.mode==AP_DATA_SOCKET_SELECTIVE:
 				self.debug("INFO frame %d is lost (selective mode)"%flag)
+				if flag != ANS_TCP_TIMEOUT_SOCKET: # retour du handshake, jamais attendu
+					self.__count_frame(self.lost_counters, flag, tab_size)
+			return True
 				
 		finally:
 			self.unlock()
+			if completed is not None:
+				completed.complete()
+
+	## \brief remet une trame aux callbacks abonnés à son flag
+	# @param _block cf. push_recv_buffer (abonnement FRAME_STORE_BLOCK dont
+	#        l'executor a max_pending trames en attente)
+	# @return False si la trame doit être représentée (InstrumentHub), True sinon
+	def __push_subscribers(self, _subscribers, flag, tab_size, data, _block=True, _recv_ns=None):
+		# réserve une place pour la trame auprès de chaque abonnement, avant
+		# tout traitement : une trame représentée ne doit pas être comptée deux fois
+		accepted = []
+		for subscription in _subscribers:
+			if subscription.reserve():
+				accepted.append(subscription)
+			elif subscription.policy != FRAME_STORE_BLOCK:
+				self.debug("INFO frame %d is dropped (subscriber busy)"%flag)
+				subscription.drop(tab_size)
+			elif not _block:
+				for reserved in accepted:
+					reserved.release()
+				subscription.blocked = True
+				return False
+			else:
+				# le driver est ralenti par le contrôle de flux TCP, la liaison
+				# est maintenue par le keepalive
+				while not subscription.wait(self.private_keepalive()):
+					if not self.event_is_connected.is_set(): # reset pendant l'attente
+						subscription.blocked = False
+						subscription.drop(tab_size)
+						break
+				else:
+					accepted.append(subscription)
+
+		completed = None
+		self.lock()
+		try:
+			self.last_recv_time = monotonic()
+			self.__count_frame(self.recv_counters, flag, tab_size)
+			if (self.disconnect_ns is not None or self.__replay_answers) and self.__after_reconnect(flag):
+				for subscription in accepted:
+					subscription.release()
+				return True
+			sock_event = self.wait_buffer.pop(flag)
+			if sock_event is not None:
+				completed = self.__deliver(sock_event, (flag, tab_size, data), _recv_ns)
+		finally:
+			self.unlock()
+		if completed is not None:
+			completed.complete()
+
+		for subscription in accepted:
+			try:
+				subscription.dispatch(flag, tab_size, data)
+			except Exception as e:
+				# une erreur de l'utilisateur ne doit pas interrompre la réception
+				self.info("WARNING callback on flag %d failed :\n%s"%(flag, "".join(traceback.format_exception(type(e), e, e.__traceback__))))
+		return True
+
+	## \brief termine l'établissement de la connexion avec le driver
+	# utilisé par le thread socket_recv et par InstrumentHub, sous lock, une fois
+	# la socket connectée
+	def private_handshake(self):
+		# at startup, reset the timeout on server side : TODO ? intégrer dans le protocole ?
+		frames = [(CMD_TCP_TIMEOUT_SOCKET, pack("i",int(self.timeout+2)))]
+		# reprise de session : requêtes conservées par private_reset, précédées
+		# des derniers messages de replay_requests (cf. REPRISE DE SESSION)
+		held = []
+		for flag, sock_event in self.wait_buffer:
+			if sock_event.abandoned: # timeout pendant la coupure (mode pipeline)
+				self.wait_buffer.remove(sock_event)
+			else:
+				held.append(sock_event)
+		held_flags = set(sock_event.request[0] for sock_event in held)
+		self.__replay_answers = {}
+		with self.__send_lock: # libre : la connexion n'est pas encore signalée
+			for flag, message in self.replay_frames.items():
+				if flag not in held_flags: # sinon renvoyé avec la requête en attente
+					frames.append((flag, message))
+					flag_recv = self.replay_requests[flag]
+					self.__replay_answers[flag_recv] = self.__replay_answers.get(flag_recv, 0) + 1
+			frames += [sock_event.request for sock_event in held]
+			sendFrames(self.socket_id, frames)
+			self.last_send_time = monotonic()
+		if self.disconnect_ns is not None:
+			self.reconnect_count += 1
+			if len(frames) > 1:
+				self.info("session replayed : %d frame(s), %d pending request(s)"%(len(frames)-1-len(held), len(held)))
+		# le retour est récupéré dans la boucle de réception (et n'est pas traité)
+		self.event_is_connected.set()
+		self.event_is_reset.clear()
+
+	## \brief envoie un keepalive (flag 1) si rien n'a été émis depuis keepalive_ratio*timeout
+	# et que la data_socket est active ou que des trames ont été reçues depuis la
+	# dernière émission (acquisition en cours, mode non sélectif). Sinon le driver
+	# doit pouvoir cloturer la connexion pour inactivité
+	# utilisé par le thread socket_recv et par InstrumentHub. Ne bloque jamais :
+	# ni le lock principal, ni l'émission (si une émission est en cours ou si le
+	# buffer d'émission est plein, la liaison n'est pas inactive)
+	# @return le délai (s) avant la prochaine vérification
+	def private_keepalive(self):
+		period = self.timeout*self.keepalive_ratio
+		if not self.__send_lock.acquire(False):
+			return period
+		try:
+			if not self.event_is_connected.isSet():
+				return period
+			delay = self.last_send_time + period - monotonic()
+			if delay > 0:
+				return delay
+			if self._is_active() or self.last_recv_time > self.last_send_time:
+				self.debug("link idle, send keepalive")
+				if sendNoWait(self.socket_id, pack('i', 1)): # flag keepalive
+					self.last_send_time = monotonic()
+			return period
+		finally:
+			self.__send_lock.release()
+
+	## \brief traite l'exception qui a interrompu la réception des trames
+	# utilisé par le thread socket_recv et par InstrumentHub
+	# On ne remonte aucune exception par "raise" (il n'y a personne au dessus pour la rattraper)
+	# On utilise donc le mécanisme de transfert via system_exception
+	def private_recv_failure(self, _exception):
+		if isinstance(_exception, OSError):
+			self.system_exception = ap_socket_error(_exception.errno, _exception.strerror)
+			self.info ("%s : %s"%(_exception.errno, _exception.strerror))
+
+		elif isinstance(_exception, ap_socket_error):
+			if _exception.code == 21 :
+				self.info("socket closed by driver (probably due to inactivity)")
+				self.system_exception = None # pas d'exception, c'est une situation normale
+				self.is_open = False # on force la cloture de la data_socket (pour ne pas garder la main sur le driver)
+			else:
+				self.info("ap_socket_error \"%s\"-> reset"%_exception.message)
+				# on transmet l'erreur à la prochaine fonction externe qui tente un acces à la socket :
+				self.system_exception = _exception
+
+		else: # jamais vu pour l'instant
+			self.system_exception = ap_socket_error(132, "socket_recv_th : unexpected exception while receiving frame")
+			self.info("WARNING unexpected exception while receiving frame")
+			# l'appelant n'est pas forcément dans le bloc except (cf. InstrumentHub)
+			print ("".join(traceback.format_exception(type(_exception), _exception, _exception.__traceback__)))
+
+		try:
+			self.lock()
+			try:
+				self.private_reset() # inclu un event_is_connected.clear()
+				# si il y a eu une exception et que la data_socket n'est pas active, on force la déconnexion (pour ne pas garder la main sur le driver)
+				if self.system_exception and not self._is_active() :
+					self.info("closing because of exception while socket is inactive")
+					self.is_open = False
+				if not self.is_open:
+					self.__release_waiters()
+				elif len(self.wait_buffer):
+					# des requêtes sont conservées pour être renvoyées à la reconnexion :
+					# l'erreur de connexion n'est pas remontée (cf. REPRISE DE SESSION)
+					self.system_exception = None
+			finally:
+				self.unlock()
+		except:
+			self.info("WARNING unexpected exception")
+			print (traceback.format_exc())
 
 	## \brief deconnecte la socket 
 	# le recv_thread va ensuite se reconnecter automatiquement si nécessaire (si is_open)
 	# utiliser wait_connexion() pour attendre que la connexion soit établie
 	def private_reset(self):
+		if self.is_open and self.event_is_connected.is_set():
+			self.disconnect_ns = monotonic_ns() # mesure du délai de reprise
 		self.event_is_connected.clear()
 		self.event_is_reset.set()
 		try:
@@ -261,21 +732,44 @@ class ApDataSocket(UbClassTemplate):
 		except: # jamais constaté
 			self.info("WARNING socket was not open")
 
-		for req in self.wait_buffer:
-			self.debug("remove request waiting on %d"%(req[0]))
-			# on leve l'event
-			req[1].set()
+		# réveille la réception bloquée sur un recv_buffer plein
+		with self.__space_available:
+			self.__space_available.notify_all()
+
+		# on vide la liste des trames attendues et on leve les events, sauf
+		# ceux des requêtes idempotentes à renvoyer à la reconnexion
+		held = self.__release_waiters(self.idempotent_flags if self.is_open else ())
+		for sock_event in held:
+			sock_event.held = True
+			self.wait_buffer.add(sock_event)
 
-		# on vide la liste des trames attendues:
-		self.wait_buffer = []
+		if self.hub is not None:
+			self.hub.wakeup()
 		# on ne vide pas le buffer des trames, c'est à l'utilisateur de le faire
 		# avec la methode clear_buffer() en cas d'exception
 
 
+	## \brief vide wait_buffer et lève les events (version sans lock)
+	# @param _keep flags des requêtes émises à conserver (non levées)
+	# @return la liste des évenements conservés, retirés de wait_buffer
+	def __release_waiters(self, _keep=()):
+		held = []
+		for sock_event in self.wait_buffer.clear():
+			if sock_event.answer_expected and not sock_event.abandoned and sock_event.request[0] in _keep \
+					and (sock_event.future is None or not sock_event.future.done()):
+				self.debug("hold request waiting on %d"%(sock_event.flag))
+				held.append(sock_event)
+				continue
+			self.debug("remove request waiting on %d"%(sock_event.flag))
+			sock_event.set()
+			if sock_event.future is not None:
+				sock_event.complete(ap_socket_error (309, "data_socket_c::private_reset : CONNEXION FAILURE"))
+		return held
+
 	# pour gérér le timeout : si timeout-> sortir de la queue
 	# utilisé uniquement par le wait de ap_event en cas de timeout
 	# inclu un lock
-	# on gère aussi le timeout de déconnexion. Celui-ci est compté (tic) à 
+	# on gère aussi le timeout de déconnexion. Celui-ci est compté (tic_ns) à 
 	# partir du dernier de la réception d'un flag
 	# TODO fonction publique ? (elle est utilisée dans webserver_apf02)
 	# @param l'objet Event
@@ -283,17 +777,15 @@ class ApDataSocket(UbClassTemplate):
 		self.debug("try to delete event")
 		self.lock()
 		try:
-			self._catch_exception_from_socket_thread()
+			self.tic_ns = monotonic_ns()
+			if self.pipelined and _event.answer_expected:
+				# la requête a été émise : l'évenement reste dans la file pour absorber
+				# la réponse tardive (cf. MODE PIPELINE)
+				_event.abandoned = True
+			elif self.wait_buffer.remove(_event):
+				self.debug("delete event for flag %s"%(_event.flag))
 
-			self.tic = mktime(localtime())
-			# abort on the same flag 
-			for i in range(len(self.wait_buffer)):
-				if self.wait_buffer[i][1]==_event:
-					self.debug("delete event for flag %s"%(self.wait_buffer[i][0]))
-					self.wait_buffer.pop(i)
-					break
-					# il ne peut y avoir qu'une seule fois le même flag /
-					# le même event
+			self._catch_exception_from_socket_thread()
 		finally:
 				self.unlock()
 
@@ -311,8 +803,13 @@ class ApDataSocket(UbClassTemplate):
 			if self.event_is_connected.isSet():
 				raise ap_socket_exception (401, "BUG WARNING data_socket_c::open : socket connected")
 
-			self.debug("créer le thread de reception")
 			self.is_open = True 
+			if self.hub is not None:
+				self.debug("confie la socket au hub")
+				self.hub.register(self)
+				return
+
+			self.debug("créer le thread de reception")
 			# Lancement du thread de réception de données
 			th_sock = ApSocketRecvTh(self, self.host, self.port)
 			self.debug("démarre le thread")
@@ -329,11 +826,19 @@ class ApDataSocket(UbClassTemplate):
 		self.lock()
 		try:
 			self._catch_exception_from_socket_thread()
+			sock = self.socket_id
+		finally:
+			self.unlock()
+
+		with self.__send_lock: # hors du lock principal (cf. __send_lock)
 			try:
-				sendAll(self.socket_id,pack('i', 0))
+				sendAll(sock,pack('i', 0))
 			except: # on ne remonte pas d'exception en cas d'échec
 				self.info("WARNING, fail to send close commande to the driver")
 				print (traceback.format_exc())
+
+		self.lock()
+		try:
 			self.is_open = False
 
 			self.private_reset()
@@ -351,16 +856,39 @@ class ApDataSocket(UbClassTemplate):
 		# le timeout est dépassé et aucun élément attendu
 		# si le driver se déconnecte si pas de requete durant la durée de timeout et qu'il n'y a pas de requete en cours il faut
 		# cloturer pour éviter de garder la main sur le driver (utilisé par recv_thread)
-		if mktime(localtime()) - self.tic > self.timeout and not len(self.wait_buffer):
-			self.debug("the socket is inactive (timeout %f/%f)"%(mktime(localtime()) - self.tic , self.timeout))
+		elapsed = (monotonic_ns() - self.tic_ns)/NS_PER_S
+		if elapsed > self.timeout and not len(self.wait_buffer):
+			self.debug("the socket is inactive (timeout %f/%f)"%(elapsed, self.timeout))
 			return False
 		else :
 			return True
 
+	## \brief teste si la socket est opérationnelle en envoyant un keepalive
+	# en cas d'échec, la socket est reset et une exception est remontée
 	def test (self):
-		self.send_frame(1, '')
-		# tester (keepalive ?) si la socket est opérationnelle,
-		# sinon faire un reset + exception
+		self.lock()
+		try:
+			self._catch_exception_from_socket_thread()
+
+			if not self.event_is_connected.isSet():
+				raise ap_socket_exception (316, "data_socket_c::test : socket is not connected")
+			sock = self.socket_id
+		finally:
+			self.unlock()
+
+		try:
+			with self.__send_lock: # hors du lock principal (cf. __send_lock)
+				sendAll(sock, pack('i', 1)) # flag keepalive : flag seul, sans taille
+				self.last_send_time = monotonic()
+		except ap_socket_error as sockexc:
+			self.debug("ap_socket_error \"%s\""%str(sockexc))
+			self.lock()
+			try:
+				if self.socket_id is sock:
+					self.private_reset()
+			finally:
+				self.unlock()
+			raise sockexc
 
 	# TODO ? rajouter un timeout
 	def wait_connexion(self):
@@ -413,24 +941,13 @@ class ApDataSocket(UbClassTemplate):
 				raise ap_socket_exception (316, "data_socket_c::send_frame : socket is not connected")
 
 			self.debug ("flag : %d"%(_flag))
-			try:
-				size = len(_message)
-				sendAll(self.socket_id,pack('i', _flag)+pack('i', size)+_message)
-																								# taille du message
-																																 # chaine de caractere
-			except ap_socket_error as sockexc:
-				self.debug("ap_socket_error \"%s\""%str(sockexc))
-				self.private_reset()
-				raise sockexc
-			except:
-				self.debug( "sendAll fail, socket reconnect")
-				print (traceback.format_exc())
-				self.private_reset()
-				raise ap_socket_error (118, "ap_data_socket::send_frame : sendAll fail, socket reconnect")
-		
+			sock = self.socket_id
 		finally:
 			self.unlock()
 
+		# l'émission est faite hors du lock principal (cf. __send_lock)
+		self.__send_unlocked(sock, _flag, _message, 118, "send_frame")
+
 
 	## \brief Attache un évènement à la réception d'un flag particulier
 	# pour une réception par un autre thread. 
@@ -473,14 +990,20 @@ class ApDataSocket(UbClassTemplate):
 																	 # dans le buffer, on set un event
 				# ici on utilise l'event interne : frame ready
 				frame_ready = self.__private_set_event(_flag)
+				if self.trace is not None:
+					frame_ready.trace = self.trace.begin("recv_frame", None, _flag, monotonic_ns())
 		finally:
 			self.unlock()
 		
-		self.info("data_socket_c::recv_frame : wait frame_ready")
+		self.debug("data_socket_c::recv_frame : wait frame_ready")
 		
 		# le unlock doit être fait avant le wait pour permettre à recv_sock_th 
 		# d'écrire dans le buffer
 		frame_ready.wait(_timeout)
+		if frame_ready.trace is not None:
+			trace_mark(frame_ready.trace, TRACE_WAKE, monotonic_ns())
+		if frame_ready.frame is not None: # mode pipeline
+			return frame_ready.frame
 		# la trame est arrivée, on la lit
 		return self.read_frame(_flag)
 
@@ -493,6 +1016,7 @@ class ApDataSocket(UbClassTemplate):
 	# précédente, la fonction vérifie que cette réponse n'est pas déjà présente,
 	# sinon elle remonte l'exception 317 : data_socket_c::send_recv_frame : flag 20007 already received.
 	# pour éviter ça, il faut vider le buffer de réception (clear_buffer() ou clear_buffer(20007)) avant d'appeler la fonction.
+	# En mode pipeline, la réponse est attachée à la requête : pas de vérification (cf. MODE PIPELINE)
 	def send_recv_frame(self, _flag_send, _message_send, _flag_recv, _timeout=10.):
 		self.lock() # on encadre le pop et le set_event par un seul lock pour éviter
 		            # l'arrivée d'une trame entre les deux
@@ -504,52 +1028,138 @@ class ApDataSocket(UbClassTemplate):
 				raise ap_socket_exception (318, "data_socket_c::send_recv_frame : socket is not connected")
 
 			self.debug ("send : %d ; recv %d"%(_flag_send, _flag_recv))
-			try: #on verifie si le flag est déjà présent (il sera jeté)
-				flag, size, data = self.__pop_frame(_flag_recv)
-			except ap_socket_exception as e: # ici l'exception est normale et attendue
-				#normalement le buffer ne contient pas le flag et lève une exception 322 (empty) ou 303 (not found)
-				self.debug("socket exception normal apres pop_frame %s"%(str(e)))
-			else: # si pas d'exception, c'est anormal:
-				# la forme est une peu bizarre ici, on pourrait remplacer par une fonction qui test l'inexistance du flag dans le buffer
-				self.info("flag %d already received"%(_flag_recv)) 
-				raise ap_socket_exception (317, "data_socket_c::send_recv_frame : flag %d already received"%(_flag_recv))
-												# the developper should clear_buffer before using send_recv_frame
-
-			try:
-				self.debug ("set event %d"%(_flag_recv))
-				frame_ready = self.__private_set_event(_flag_recv)
-				if _message_send is None:
-					self.info ("Warning, data to send is None")
-					_message_send = "" # to avoid fail of len()
-
-				message_size = len(_message_send)
-				self.debug ("sendAll %d"%(_flag_send))
-				sendAll(self.socket_id,pack('i', _flag_send)+pack('i', message_size)+_message_send)
-																								# taille du message
-																																 # chaine de caractere
-			except ap_socket_error as sockexc:
-				self.debug("ap_socket_error \"%s\""%str(sockexc))
-				self.private_reset()
-				raise sockexc
-			except:
-				# l'emission à échoué, on coupe la connexion pour qu'elle soit relancée 
-				# par sock_recv_th
-				self.info( "sendAll fail, socket reconnect")
-				print (traceback.format_exc())
-				self.private_reset()
-				raise ap_socket_error (119, "ap_data_socket::send_recv_frame : sendAll fail, socket reconnect")
-
+			if not self.pipelined:
+				try: #on verifie si le flag est déjà présent (il sera jeté)
+					flag, size, data = self.__pop_frame(_flag_recv)
+				except ap_socket_exception as e: # ici l'exception est normale et attendue
+					#normalement le buffer ne contient pas le flag et lève une exception 322 (empty) ou 303 (not found)
+					self.debug("socket exception normal apres pop_frame %s"%(str(e)))
+				else: # si pas d'exception, c'est anormal:
+					# la forme est une peu bizarre ici, on pourrait remplacer par une fonction qui test l'inexistance du flag dans le buffer
+					self.info("flag %d already received"%(_flag_recv)) 
+					raise ap_socket_exception (317, "data_socket_c::send_recv_frame : flag %d already received"%(_flag_recv))
+													# the developper should clear_buffer before using send_recv_frame
+
+			self.debug ("set event %d"%(_flag_recv))
+			frame_ready = self.__private_set_event(_flag_recv)
+			frame_ready.answer_expected = True
+			frame_ready.request = (_flag_send, _message_send)
+			if self.trace is not None:
+				frame_ready.trace = self.trace.begin("send_recv_frame", _flag_send, _flag_recv)
+			if _message_send is None:
+				self.info ("Warning, data to send is None")
+			sock = self.socket_id
+			ticket = self.__take_ticket()
 		finally:
 			self.unlock()
 
+		# l'évenement est attaché avant l'émission, qui est faite hors du lock
+		# principal (cf. __send_lock). Si l'emission échoue, la connexion est
+		# coupée pour être relancée par sock_recv_th
+		self.debug ("sendFrame %d"%(_flag_send))
+		try:
+			self.__send_unlocked(sock, _flag_send, _message_send, 119, "send_recv_frame", ticket, _trace=frame_ready.trace)
+		except ap_socket_error:
+			if not frame_ready.held:
+				raise
+			# requête idempotente : elle sera renvoyée à la reconnexion
+			self.info("send failed, request %d held until reconnexion"%(_flag_send))
+
 		self.debug ("wait %d"%(_flag_recv))
 		frame_ready.wait(_timeout)
+		if frame_ready.trace is not None:
+			trace_mark(frame_ready.trace, TRACE_WAKE, monotonic_ns())
 		self.debug ("wake up %d"%(_flag_recv))
+		if frame_ready.frame is not None: # mode pipeline
+			return frame_ready.frame
 		# la trame est arrivée, on la lit
 		flag, size, data = self.read_frame(_flag_recv)
 		return flag, size, data
 
 
+	## \brief envoie une trame TCP sans attendre la réponse
+	# @return concurrent.futures.Future terminé avec la réponse (flag, size, data)
+	#         ou l'exception (ap_socket_timeout, ap_socket_error), cf. REQUÊTES ASYNCHRONES
+	def submit(self, _flag_send, _message_send, _flag_recv, _timeout=10.):
+		return self.__submit([(_flag_send, _message_send, _flag_recv)], _timeout, "submit")[0]
+
+	## \brief envoie une série de requêtes en un seul appel et attend leurs réponses
+	# les réponses sont attendues en parallèle (un seul délai pour toutes) : pour
+	# plusieurs requêtes ayant le même flag de réponse, utiliser le mode pipeline
+	# @param _requests liste de (flag_send, message_send, flag_recv)
+	# @return la liste des réponses (flag, size, data) dans l'ordre des requêtes,
+	#         remonte la première exception rencontrée
+	def send_recv_many(self, _requests, _timeout=10.):
+		return [future.result() for future in self.__submit(_requests, _timeout, "send_recv_many")]
+
+	## \brief enregistre les évenements des requêtes sous un seul lock, puis les émet
+	# en un seul appel
+	# @return la liste des Futures (vide si _requests est vide : rien n'est émis)
+	def __submit(self, _requests, _timeout, _caller):
+		frames = [(flag_send, message_send) for flag_send, message_send, flag_recv in _requests]
+		if not frames:
+			return []
+
+		self.lock()
+		try:
+			self._catch_exception_from_socket_thread()
+			if not self.event_is_connected.isSet():
+				raise ap_socket_exception (325, "data_socket_c::%s : socket is not connected"%_caller)
+
+			# une seule échéance pour le lot, annulée lorsque toutes les réponses
+			# sont arrivées. Elle est attribuée aux évenements sous lock, avant
+			# qu'une réponse puisse les terminer (complete), et ne peut expirer
+			# qu'une fois le lot complet (__expire_requests prend le lock)
+			batch = []
+			deadline = get_deadline_scheduler().schedule(_timeout, self.__expire_requests, batch)
+			try:
+				for flag_send, message_send, flag_recv in _requests:
+					if not self.pipelined and flag_recv in self.recv_buffer:
+						raise ap_socket_exception (317, "data_socket_c::%s : flag %d already received"%(_caller, flag_recv))
+					sock_event = self.__private_set_event(flag_recv)
+					sock_event.answer_expected = True
+					sock_event.request = (flag_send, message_send)
+					sock_event.future = Future()
+					sock_event.deadline = deadline
+					sock_event.batch = batch
+					batch.append(sock_event)
+			except:
+				get_deadline_scheduler().cancel(deadline)
+				for sock_event in batch:
+					self.wait_buffer.remove(sock_event)
+				raise
+			sock = self.socket_id
+			# en dernier : rien ne peut échouer entre la prise du ticket et
+			# __send_unlocked, qui passe au ticket suivant même en cas d'échec
+			ticket = self.__take_ticket()
+		finally:
+			self.unlock()
+
+		try:
+			self.__send_unlocked(sock, frames[0][0], frames[0][1], 119, _caller, ticket, frames[1:] or None)
+		except ap_socket_error:
+			# requêtes idempotentes : renvoyées à la reconnexion, les autres ont échoué (309)
+			if not all(sock_event.held for sock_event in batch):
+				raise
+		return [sock_event.future for sock_event in batch]
+
+	## \brief termine sur timeout les requêtes d'un lot encore en attente (thread ApDeadlineScheduler)
+	def __expire_requests(self, _batch):
+		expired = []
+		self.lock()
+		try:
+			for sock_event in _batch:
+				if not sock_event.sock_event.is_set():
+					if self.pipelined: # absorbe la réponse tardive, cf. del_event
+						sock_event.abandoned = True
+					else:
+						self.wait_buffer.remove(sock_event)
+					expired.append(sock_event)
+		finally:
+			self.unlock()
+		for sock_event in expired:
+			sock_event.complete(ap_socket_timeout (208, "data_socket_c::submit : TIMEOUT on flag %d"%sock_event.flag))
+
 	## \brief lecture d'une trame dans le buffer de réception
 	# retourne la trame
 	# remonte une socket_exception si la trame est absente 
@@ -587,19 +1197,11 @@ class ApDataSocket(UbClassTemplate):
 			self.debug ("clearing buffer")
 			self._catch_exception_from_socket_thread()
 				
-			if _flag==None:
-				size = len(self.recv_buffer)
-				if self.flag_debug_mess :
-					for frame in self.recv_buffer:
-						self.debug ("del recv_buffer flag=%d"%frame[0])
-				self.recv_buffer = []
-			else:
-				size = 0
-				for i in reversed(range(len(self.recv_buffer))):
-					if self.recv_buffer[i][0] == _flag:
-						size += 1
-						self.debug ("del recv_buffer flag=%d" % _flag)
-						del self.recv_buffer[i]
+			if _flag==None and self.flag_debug_mess :
+				for frame in self.recv_buffer:
+					self.debug ("del recv_buffer flag=%d"%frame[0])
+			size = self.recv_buffer.clear(_flag)
+			self.__space_freed()
 			
 			self.debug("receive buffer cleared (%d frames)"%size)
 			return size
@@ -607,6 +1209,162 @@ class ApDataSocket(UbClassTemplate):
 		finally:
 			self.unlock()
 
+	## \brief abonne un callback aux trames d'un flag
+	# @param _flag le flag des trames
+	# @param _callback fonction appelée avec (flag, size, data) pour chaque trame
+	# @param _executor optionnal - concurrent.futures.Executor exécutant le
+	#        callback, None : appel direct par le thread de réception
+	# @param _max_pending optionnal - nombre maximum de trames soumises à l'executor
+	#        et pas encore traitées (cf. ap_subscription)
+	# @param _policy optionnal - FRAME_STORE_DROP_NEWEST (trame rejetée et comptée)
+	#        ou FRAME_STORE_BLOCK (la réception attend) lorsque _max_pending est atteint
+	def subscribe(self, _flag, _callback, _executor=None, _max_pending=SUBSCRIPTION_MAX_PENDING, _policy=FRAME_STORE_DROP_NEWEST):
+		if _policy not in SUBSCRIPTION_POLICIES or _max_pending < 1:
+			raise ap_socket_exception (326, "data_socket_c::subscribe : unknown policy %s or max_pending %s < 1"%(str(_policy), str(_max_pending)))
+		subscription = ApSubscription(_callback, _executor, _max_pending, _policy, self.hub.wakeup if self.hub is not None else None)
+		self.lock()
+		try:
+			self.subscribers[_flag] = self.subscribers.get(_flag, ()) + (subscription,)
+		finally:
+			self.unlock()
+
+	## \brief désabonne un callback (tous les callbacks du flag si _callback est None)
+	# @return le nombre de callbacks retirés
+	def unsubscribe(self, _flag, _callback=None):
+		self.lock()
+		try:
+			subscribers = self.subscribers.get(_flag, ())
+			kept = tuple(sub for sub in subscribers if _callback is not None and sub.callback != _callback)
+			if kept:
+				self.subscribers[_flag] = kept
+			else:
+				self.subscribers.pop(_flag, None)
+			return len(subscribers) - len(kept)
+		finally:
+			self.unlock()
+
+	## \brief configure la reprise de session à la reconnexion (cf. REPRISE DE SESSION)
+	# @param _replay_requests dictionnaire flag émis -> flag de la réponse : le
+	#        dernier message émis pour chacun de ces flags est renvoyé à la
+	#        reconnexion et sa réponse est absorbée (défaut : CMD_TCP_CONFIG)
+	# @param _idempotent_flags flags des requêtes pouvant être émises une seconde
+	#        fois sans effet de bord (CMD_TCP_PROFILE_INST ...) : celles en attente
+	#        de réponse lors d'une coupure sont renvoyées à la reconnexion
+	def set_session_replay(self, _replay_requests=DEFAULT_SESSION_REPLAY, _idempotent_flags=()):
+		self.lock()
+		try:
+			with self.__send_lock:
+				self.replay_requests = dict(_replay_requests)
+				self.replay_frames = dict((flag, message) for flag, message in self.replay_frames.items() if flag in self.replay_requests)
+			self.idempotent_flags = frozenset(_idempotent_flags)
+		finally:
+			self.unlock()
+
+	## \brief statistiques de reprise après coupure
+	# @return dictionnaire : reconnect_count, et sur les derniers délais de reprise
+	#         mesurés (s) : count, last, mean, max (None si aucune mesure)
+	def get_recovery_stats(self):
+		self.lock()
+		try:
+			times = list(self.recovery_times)
+		finally:
+			self.unlock()
+		return {"reconnect_count": self.reconnect_count,
+		        "count": len(times),
+		        "last": times[-1] if times else None,
+		        "mean": sum(times)/len(times) if times else None,
+		        "max": max(times) if times else None}
+
+	## \brief active les traces de latence de send_recv_frame et recv_frame (cf. ap_trace)
+	# @param _capacity nombre de requêtes conservées dans le buffer circulaire
+	# @return l'ApTraceBuffer (export : trace.export_chrome_trace(path))
+	def enable_trace(self, _capacity=4096):
+		self.trace = ApTraceBuffer(_capacity)
+		return self.trace
+
+	def disable_trace(self):
+		self.trace = None
+
+	## \brief compteurs de fonctionnement de la data_socket
+	# les compteurs sont cumulés depuis la création : chaque lecteur calcule les
+	# débits à partir de son relevé précédent (cf. ap_stats_exporter.stats_throughput),
+	# stats() ne garde aucun état partagé entre lecteurs
+	# @return dictionnaire (cf. ap_stats_exporter pour l'export JSON ou Prometheus) :
+	#   time_s : date du relevé (time.monotonic)
+	#   recv, send : frames, bytes et by_flag {flag: {frames, bytes}}
+	#   lost : trames non attendues perdues (mode sélectif), idem
+	#   dropped : trames supprimées ou rejetées par les limites de recv_buffer (cf. get_drop_counters)
+	#   recv_buffer : frames et bytes en attente de lecture, wait_buffer : nombre d'évenements en attente
+	#   reconnect_count, recovery_last : dernier délai de reprise (s) ou None
+	#   lock : contended (nombre d'attentes du lock principal) et wait_s (durée cumulée)
+	def stats(self):
+		self.lock()
+		try:
+			recv = self.__counters_stats(self.recv_counters)
+			lost = self.__counters_stats(self.lost_counters)
+			dropped = {"frames": self.recv_buffer.dropped_frames,
+			           "bytes": self.recv_buffer.dropped_bytes,
+			           "by_flag": dict(self.recv_buffer.dropped_by_flag)}
+			recv_buffer = {"frames": len(self.recv_buffer), "bytes": self.recv_buffer.bytes}
+			wait_buffer = len(self.wait_buffer)
+			lock = {"contended": self.lock_contended, "wait_s": self.lock_wait_ns/NS_PER_S}
+			recovery_last = self.recovery_times[-1] if self.recovery_times else None
+		finally:
+			self.unlock()
+		with self.__send_lock:
+			send = self.__counters_stats(self.send_counters)
+
+		return {"host": self.host, "port": self.port, "time_s": monotonic(),
+		        "connected": self.event_is_connected.is_set(),
+		        "recv": recv, "send": send, "lost": lost, "dropped": dropped,
+		        "recv_buffer": recv_buffer, "wait_buffer": wait_buffer,
+		        "reconnect_count": self.reconnect_count, "recovery_last": recovery_last,
+		        "lock": lock}
+
+	def __counters_stats(self, _counters):
+		by_flag = dict((flag, {"frames": frames, "bytes": size}) for flag, (frames, size) in _counters.items())
+		return {"frames": sum(counter["frames"] for counter in by_flag.values()),
+		        "bytes": sum(counter["bytes"] for counter in by_flag.values()),
+		        "by_flag": by_flag}
+
+	## \brief borne le buffer des trames TCP (utile en mode non sélectif)
+	# @param _max_frames, _max_bytes limites sur l'ensemble du buffer (None : pas de limite)
+	# @param _max_frames_per_flag, _max_bytes_per_flag limites pour chaque flag
+	# @param _policy comportement lorsqu'une limite est atteinte :
+	#        FRAME_STORE_DROP_OLDEST (défaut), FRAME_STORE_DROP_NEWEST ou
+	#        FRAME_STORE_BLOCK (la réception attend le consommateur, cf. ap_frame_store)
+	def set_buffer_limits(self, _max_frames=None, _max_bytes=None, _max_frames_per_flag=None, _max_bytes_per_flag=None, _policy=FRAME_STORE_DROP_OLDEST):
+		if _policy not in FRAME_STORE_POLICIES:
+			raise ap_socket_exception (324, "data_socket_c::set_buffer_limits : unknown policy %s"%str(_policy))
+		self.lock()
+		try:
+			self.recv_buffer.set_limits(_max_frames, _max_bytes, _max_frames_per_flag, _max_bytes_per_flag, _policy)
+			# la nouvelle politique peut débloquer la réception
+			self.__recv_blocked = True
+			self.__space_freed()
+		finally:
+			self.unlock()
+
+	## \brief compteurs des trames rejetées par les abonnements (max_pending atteint)
+	# @return dictionnaire flag -> {"frames", "bytes"}, cumulés sur les abonnements du flag
+	def get_subscription_drop_counters(self):
+		counters = {}
+		for flag, subscribers in list(self.subscribers.items()):
+			counters[flag] = {"frames": sum(sub.dropped_frames for sub in subscribers),
+			                  "bytes": sum(sub.dropped_bytes for sub in subscribers)}
+		return counters
+
+	## \brief compteurs des trames supprimées ou rejetées à cause des limites du buffer
+	# @return dictionnaire : frames, bytes et by_flag (nombre de trames par flag)
+	def get_drop_counters(self):
+		self.lock()
+		try:
+			return {"frames": self.recv_buffer.dropped_frames,
+			        "bytes": self.recv_buffer.dropped_bytes,
+			        "by_flag": dict(self.recv_buffer.dropped_by_flag)}
+		finally:
+			self.unlock()
+
 ###########################
 # Fonctions pour debug    #
 ###########################
@@ -615,16 +1373,16 @@ class ApDataSocket(UbClassTemplate):
 	## \brief Display the content of wait_buffer
 	def dbg_show_wait_buffer (self):
 		if len(self.wait_buffer):
-			for i in range(len(self.wait_buffer)):
-				print ("*** wait_buffer[%d]: flag=%d") % (i, self.wait_buffer[i][0])
+			for i, (flag, sock_event) in enumerate(self.wait_buffer):
+				print ("*** wait_buffer[%d]: flag=%d" % (i, flag))
 		else:
 			print ("*** wait_buffer is empty !")
 
 	## \brief Display the content of recv_buffer
 	def dbg_show_recv_buffer (self):
 		if len(self.recv_buffer):
-			for i in range(len(self.recv_buffer)):
-				print ("*** recv_buffer[%d]: flag=%d size=%d") % (i, self.recv_buffer[i][0], self.recv_buffer[i][1])
+			for i, frame in enumerate(self.recv_buffer):
+				print ("*** recv_buffer[%d]: flag=%d size=%d" % (i, frame[0], frame[1]))
 		else:
 			print ("*** recv_buffer is empty !")
 
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# -*- coding: UTF_8 -*-
+# @copyright  this code is the property of Ubertone.
+# You may use this code for your personal, informational, non-commercial purpose.
+# You may not distribute, transmit, display, reproduce, publish, license, create derivative works from, transfer or sell any information, software, products or services based on this code.
+# @author Stéphane Fischer
+
+## @package ap_deadline_scheduler
+#\brief Échéances des data_sockets sur une horloge monotone (time.monotonic_ns)
+#
+# Un unique thread par process gère toutes les échéances qui ne sont attendues
+# par aucun thread (timeout des requêtes submit / send_recv_many) : elles sont
+# rangées dans un tas (heapq), l'ajout et l'expiration coûtent O(log n) et le
+# thread dort jusqu'à la plus proche échéance, à la milliseconde près, sans
+# réveil périodique. L'annulation est paresseuse : l'entrée est marquée et
+# ignorée lorsqu'elle arrive en tête du tas.
+# L'horloge monotone n'est pas affectée par les changements d'heure système.
+#
+# Ne passent PAS par le scheduler :
+# - l'échéance d'inactivité (tic_ns + timeout, cf. ApDataSocket._is_active) :
+#   elle n'est pas programmée, _is_active la compare à monotonic_ns lorsque la
+#   réception en a besoin (keepalive, échec de la réception). Seule son horloge
+#   a changé (mktime(localtime()) -> monotonic_ns) ;
+# - le cadencement des keepalives, porté par l'attente de la réception
+#   (ApFrameReader.wait, InstrumentHub) ;
+# - les attentes d'un thread sur son propre Event (ap_socket_event.wait).
+#
+#   scheduler = get_deadline_scheduler()
+#   entry = scheduler.schedule(0.5, callback, arg)
+#   scheduler.cancel(entry)
+
+import heapq
+import traceback
+from threading import Condition, Lock, Thread
+from time import monotonic_ns
+
+from ub_lib_v1.ub_class_template import UbClassTemplate, txt_regular_purple
+
+NS_PER_S = 1000000000
+
+
+## \brief conversion d'un délai en secondes vers une échéance monotonic_ns
+def deadline_ns(_delay):
+	return monotonic_ns() + int(_delay*NS_PER_S)
+
+
+## \brief délai (s) restant avant une échéance monotonic_ns, 0 si elle est passée
+def remaining(_deadline_ns):
+	return max(0, _deadline_ns - monotonic_ns())/NS_PER_S
+
+
+## \brief une échéance : [date (ns), numéro d'ordre, callback, arguments]
+# le callback vaut None lorsque l'échéance est annulée
+class _deadline_entry(list):
+	__slots__ = ()
+
+
+class ApDeadlineScheduler(Thread, UbClassTemplate):
+	def __init__(self):
+		UbClassTemplate.__init__(self)
+		Thread.__init__(self)
+		self.flag_debug_mess=False
+		self.debug_marker_start=txt_regular_purple
+		self.daemon = True
+		self.name = "ApDeadlineScheduler"
+
+		self.heap = []
+		self.seq = 0
+		self.cancelled = 0
+		self.changed = Condition()
+
+	def __len__(self):
+		return len(self.heap) - self.cancelled
+
+	## \brief programme l'appel de _callback(*_args) à une échéance monotonic_ns
+	# @return l'échéance, à passer à cancel
+	def schedule_at(self, _deadline_ns, _callback, *_args):
+		with self.changed:
+			self.seq += 1
+			entry = _deadline_entry((_deadline_ns, self.seq, _callback, _args))
+			heapq.heappush(self.heap, entry)
+			# le thread n'est réveillé que si l'échéance devient la plus proche
+			if self.heap[0] is entry:
+				self.changed.notify()
+		return entry
+
+	## \brief programme l'appel de _callback(*_args) dans _delay secondes
+	def schedule(self, _delay, _callback, *_args):
+		return self.schedule_at(deadline_ns(_delay), _callback, *_args)
+
+	## \brief annule une échéance (sans effet si elle est déjà passée)
+	def cancel(self, _entry):
+		with self.changed:
+			if _entry[2] is not None:
+				_entry[2] = None
+				self.cancelled += 1
+				# le tas est reconstruit lorsqu'il contient surtout des échéances annulées
+				if self.cancelled > 64 and self.cancelled > len(self.heap)//2:
+					self.heap = [entry for entry in self.heap if entry[2] is not None]
+					heapq.heapify(self.heap)
+					self.cancelled = 0
+
+	def run(self):
+		while True:
+			with self.changed:
+				while True:
+					while self.heap and self.heap[0][2] is None:
+						heapq.heappop(self.heap)
+						self.cancelled -= 1
+					if not self.heap:
+						self.changed.wait()
+						continue
+					delay = self.heap[0][0] - monotonic_ns()
+					if delay <= 0:
+						break
+					self.changed.wait(delay/NS_PER_S)
+				entry = heapq.heappop(self.heap)
+				callback, args = entry[2], entry[3]
+				entry[2] = None
+
+			# hors lock : le callback peut programmer d'autres échéances
+			try:
+				callback(*args)
+			except Exception:
+				self.info("WARNING deadline callback failed")
+				print (traceback.format_exc())
+
+
+_scheduler = None
+_scheduler_lock = Lock()
+
+## \brief le scheduler partagé par toutes les data_sockets du process (démarré au premier appel)
+def get_deadline_scheduler():
+	global _scheduler
+	if _scheduler is None:
+		with _scheduler_lock:
+			if _scheduler is None:
+				scheduler = ApDeadlineScheduler()
+				scheduler.start()
+				_scheduler = scheduler
+	return _scheduler
@@ -20,6 +20,11 @@
 # 11, "sendAll : IO error")
 # 12, "sendAll : Memory error")
 # 13, "sendAll : WARNING unexpected error -> email to stephane.fischer@ubertone.fr")
+# 10, "sendBuffers : socket error [%d] %s"%(code, msg))
+# 12, "sendBuffers : Memory error")
+# 13, "sendBuffers : WARNING unexpected error -> email to stephane.fischer@ubertone.fr")
+# 14, "sendBuffers : return with no data sent")
+# 10, "sendNoWait : socket error [%d] %s"%(code, msg))
 # 20, "recvAll : negative buffer size")
 # 21, "recvAll : recv return no data (%d/%d): connexion broken by peer"%(numbyte,rest)) # lorsque le serveur coupe la liaison, recv retourne 0
 # 22, "recvAll : recv in more than "+str(limitation_reception_parts)+" parts (reste "+ str(rest) +"/" + str(_size) +")")
@@ -27,8 +32,15 @@
 # 24, "recvAll : IO error")
 # 25, "recvAll : Memory error")
 # 26, "recvAll : WARNING unexpected error -> email to stephane.fischer@ubertone.fr")
-# 30, "__recv_anyframe__ : driver error while reading the socket")
-# 31, "__recv_anyframe__ : taille de frame erronée (",len(data),"/",tab_size,")")
+# 20, "recvBuffer : negative buffer size")
+# 21, "recvInto : recv return no data (%d/%d): connexion broken by peer"%(offset,size))
+# 23, "recvInto : socket error [%d] %s"%(code, msg))
+# 25, "recvInto : Memory error" / "recvBuffer : Memory error")
+# 26, "recvInto : WARNING unexpected error -> email to stephane.fischer@ubertone.fr")
+# 21, "ApFrameReader::fill : recv return no data : connexion broken by peer")
+# 23, "ApFrameReader::fill : socket error [%d] %s"%(code, msg))
+# 30, "ApFrameReader::next_frame : driver error while reading the socket")
+# 31, "ApFrameReader::next_frame : taille de frame erronée (%d)"%(tab_size))
 # 118, "ap_data_socket::send_frame : sendAll fail, socket reconnect")
 # 119, "ap_data_socket::send_recv_frame : sendAll fail, socket reconnect")
 # 308, "ap_socket_event::wait : CONNEXION FAILURE")
@@ -36,6 +48,7 @@
 
 # liste actuelle des ap_socket_timeout :
 # 208, "ap_socket_event::wait : TIMEOUT"
+# 209, "async_data_socket::wait_connexion : TIMEOUT"
 
 # liste actuelle des ap_socket_exception :
 # 303, "data_socket_c: flag %d not found in recv_buffer"%(_flag))
@@ -48,6 +61,10 @@
 # 319, "data_socket_c::set_connexion_timeout : socket is not connected")
 # 320, "data_socket_c: flag %d twice !" % _flag)
 # 322, "data_socket_c::__pop_frame : recv_buffer empty")
+# 323, "checkTransportProfile : unknown transport profile or parameter %s"%(...))
+# 324, "data_socket_c::set_buffer_limits : unknown policy %s"%str(_policy))
+# 325, "data_socket_c::%s : socket is not connected"%_caller) (submit, send_recv_many)
+# 326, "data_socket_c::subscribe : unknown policy %s or max_pending %s < 1"%(...))
 # 401, "BUG WARNING data_socket_c::open : socket connected")
 
 from copy import deepcopy
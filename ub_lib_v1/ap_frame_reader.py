@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# -*- coding: UTF_8 -*-
+# @copyright  this code is the property of Ubertone.
+# You may use this code for your personal, informational, non-commercial purpose.
+# You may not distribute, transmit, display, reproduce, publish, license, create derivative works from, transfer or sell any information, software, products or services based on this code.
+# @author Stéphane Fischer
+
+## @package ap_frame_reader
+#\brief Décodage bufferisé des trames de la data_socket
+#
+# Une trame est composée de :
+# - flag (int) : type de la trame
+# - size (int) : taille du bloc de données
+# - data : le bloc de données
+# Les flags internes < 2 (keepalive renvoyé par le driver) ne sont composés
+# que du flag, ils sont ignorés. Le flag 0 signale une erreur du driver.
+#
+# Au lieu de faire un recv pour le flag, un pour la taille puis un pour les
+# données, on lit de gros blocs dans un buffer interne et on en extrait toutes
+# les trames complètes qu'il contient.
+#
+# Pour les traces de latence (cf. ap_trace), chaque lecture est datée : la
+# dernière trame extraite est associée (frame_ns) à la date de réception de son
+# premier octet et à celle de la lecture qui l'a complétée.
+
+import select
+from struct import Struct
+from time import monotonic_ns
+
+from ub_lib_v1.ap_exception import ap_socket_error
+from ub_lib_v1.ap_socket import rearmQuickack
+
+_int_struct = Struct('i')
+_header_struct = Struct('ii')
+
+# taille par défaut des blocs lus sur la socket
+FRAME_READER_CHUNK_SIZE = 65536
+
+
+class ApFrameReader:
+	## \brief Constructeur du décodeur de trames
+	# @param _socket (socket) : la socket où récupérer les données
+	# @param _chunk_size (int) : taille du buffer interne (taille max d'un recv)
+	# @param _quickack (bool) : ré-arme TCP_QUICKACK après chaque lecture (cf. ap_socket.transportQuickack)
+	def __init__(self, _socket, _chunk_size=FRAME_READER_CHUNK_SIZE, _quickack=False):
+		self.socket = _socket
+		self.quickack = _quickack
+		# poll n'a pas de limite sur le numéro de descripteur, contrairement à
+		# select (ValueError au-delà de 1024, cas d'un process gérant de nombreux instruments)
+		if hasattr(select, "poll"):
+			self.poller = select.poll()
+			self.poller.register(_socket, select.POLLIN)
+		else: # Windows : select n'est limité que par le nombre de sockets
+			self.poller = None
+		self.buffer = bytearray(_chunk_size)
+		self.view = memoryview(self.buffer)
+		self.start = 0 # début des données non décodées
+		self.end = 0 # fin des données reçues
+		# trame trop grande pour le buffer interne, reçue directement dans son
+		# propre buffer : [flag, size, data, nombre d'octets déjà reçus]
+		self.large_frame = None
+		# dates (monotonic_ns) de la dernière lecture et de la réception du
+		# premier octet de la trame en cours de décodage
+		self.fill_ns = 0
+		self.header_ns = 0
+		# (premier octet, trame complète) de la dernière trame extraite
+		self.frame_ns = (0, 0)
+
+	## \brief nombre d'octets reçus et pas encore décodés
+	def available(self):
+		return self.end - self.start
+
+	## \brief lit un bloc de données sur la socket (un seul appel système)
+	# bloquant si aucune donnée n'est disponible
+	# @return le nombre d'octets reçus
+	def fill(self):
+		if self.large_frame is not None:
+			view = memoryview(self.large_frame[2])[self.large_frame[3]:]
+		else:
+			if self.start == self.end:
+				self.start = self.end = 0
+			elif self.end == len(self.buffer):
+				# on ramène les données non décodées au début du buffer
+				rest = self.end - self.start
+				self.view[0:rest] = self.view[self.start:self.end]
+				self.start = 0
+				self.end = rest
+			view = self.view[self.end:]
+
+		try:
+			numbyte = self.socket.recv_into(view)
+		except OSError as serr:
+			raise ap_socket_error(23, "ApFrameReader::fill : socket error [%d] %s"%(serr.errno, serr.strerror))
+		if not numbyte:
+			raise ap_socket_error(21, "ApFrameReader::fill : recv return no data : connexion broken by peer") # lorsque le serveur coupe la liaison, recv retourne 0
+		self.fill_ns = monotonic_ns()
+		if self.start == self.end and self.large_frame is None:
+			self.header_ns = self.fill_ns # début d'une nouvelle trame
+		if self.quickack:
+			rearmQuickack(self.socket)
+		if self.large_frame is not None:
+			self.large_frame[3] += numbyte
+		else:
+			self.end += numbyte
+		return numbyte
+
+	## \brief attend que des données soient disponibles
+	# @param _timeout (float) : délai maximum d'attente en secondes (None : attente infinie)
+	# @return True si la socket a des données à lire
+	def wait(self, _timeout=None):
+		if self.socket.fileno() < 0:
+			raise ap_socket_error(23, "ApFrameReader::wait : socket closed")
+		try:
+			if self.poller is None:
+				return len(select.select([self.socket], [], [], _timeout)[0]) > 0
+			events = self.poller.poll(None if _timeout is None else max(0., _timeout)*1000.)
+		except (OSError, ValueError) as err: # ValueError : socket fermée par un autre thread
+			raise ap_socket_error(23, "ApFrameReader::wait : socket error %s"%str(err))
+		for fd, event in events:
+			if event & select.POLLNVAL:
+				raise ap_socket_error(23, "ApFrameReader::wait : socket closed")
+		# POLLHUP / POLLERR : le recv suivant remonte l'erreur
+		return len(events) > 0
+
+	## \brief extrait la prochaine trame complète du buffer interne, sans appel système
+	# @return (flag, size, data) ou None si aucune trame complète n'est disponible
+	def next_frame(self):
+		if self.large_frame is not None:
+			flag, tab_size, data, received = self.large_frame
+			if received < tab_size:
+				return None
+			self.large_frame = None
+			self.__frame_done()
+			return flag, tab_size, data
+
+		while self.end - self.start >= 4:
+			flag = _int_struct.unpack_from(self.buffer, self.start)[0]
+			if flag == 0:
+				raise ap_socket_error(30, "ApFrameReader::next_frame : driver error while reading the socket")
+			if flag < 2:
+				# keepalive renvoyé par le driver : uniquement le flag
+				self.start += 4
+				self.header_ns = self.fill_ns
+				continue
+
+			if self.end - self.start < 8:
+				return None
+			tab_size = _header_struct.unpack_from(self.buffer, self.start)[1]
+			if tab_size < 0:
+				raise ap_socket_error(31, "ApFrameReader::next_frame : taille de frame erronée (%d)"%(tab_size))
+
+			frame_end = self.start + 8 + tab_size
+			if frame_end <= self.end:
+				data = self.buffer[self.start+8:frame_end]
+				self.start = frame_end
+				self.__frame_done()
+				return flag, tab_size, data
+
+			if tab_size > len(self.buffer) - 8:
+				# la trame ne tient pas dans le buffer interne : la suite sera
+				# reçue directement dans son propre buffer (cf. fill)
+				self.start += 8
+				data = bytearray(tab_size)
+				rest = self.end - self.start
+				data[0:rest] = self.view[self.start:self.end]
+				self.start = self.end = 0
+				self.large_frame = [flag, tab_size, data, rest]
+			return None
+
+		return None
+
+	## \brief date la trame extraite
+	# les octets suivants, dans l'ordre du flux, ont été reçus par la dernière lecture
+	def __frame_done(self):
+		self.frame_ns = (self.header_ns, self.fill_ns)
+		self.header_ns = self.fill_ns
+
+	## \brief lecture bloquante de la prochaine trame
+	# @return (flag, size, data)
+	def read_frame(self):
+		frame = self.next_frame()
+		while frame is None:
+			self.fill()
+			frame = self.next_frame()
+		return frame
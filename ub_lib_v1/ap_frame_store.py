@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+# -*- coding: UTF_8 -*-
+# @copyright  this code is the property of Ubertone.
+# You may use this code for your personal, informational, non-commercial purpose.
+# You may not distribute, transmit, display, reproduce, publish, license, create derivative works from, transfer or sell any information, software, products or services based on this code.
+# @author Stéphane Fischer
+
+## @package ap_frame_store
+#\brief Buffer des trames reçues par la data_socket, indexé par flag
+#
+# Les trames (flag, size, data) sont rangées dans une file (deque) par flag :
+# l'ajout, l'extraction de la plus ancienne trame d'un flag et la suppression
+# de toutes les trames d'un flag se font en temps constant, quelle que soit la
+# taille du buffer.
+# L'ordre global d'arrivée est conservé dans une seconde file pour read_frame(None).
+# Les entrées de cette file correspondant à des trames déjà extraites par flag
+# ne sont pas supprimées tout de suite mais ignorées lors du parcours
+# (suppression paresseuse) ; la file est reconstruite lorsqu'elle contient trop
+# d'entrées périmées.
+#
+# Le buffer peut être borné (nombre de trames et octets, au total et par flag,
+# cf. set_limits). Lorsqu'une limite est atteinte :
+# - FRAME_STORE_DROP_OLDEST : les plus anciennes trames (du flag puis toutes
+#   confondues) sont supprimées
+# - FRAME_STORE_DROP_NEWEST : la nouvelle trame est rejetée
+# - FRAME_STORE_BLOCK : la nouvelle trame est refusée, c'est à l'appelant
+#   d'attendre que de la place se libère (la réception n'est plus lue : le
+#   driver est ralenti par le contrôle de flux TCP)
+# Les trames supprimées ou rejetées sont comptées (dropped_*).
+# Une trame est toujours acceptée si le buffer (ou la file de son flag) est vide.
+
+from collections import deque
+
+FRAME_STORE_DROP_OLDEST = "drop_oldest"
+FRAME_STORE_DROP_NEWEST = "drop_newest"
+FRAME_STORE_BLOCK = "block"
+FRAME_STORE_POLICIES = (FRAME_STORE_DROP_OLDEST, FRAME_STORE_DROP_NEWEST, FRAME_STORE_BLOCK)
+
+
+class ApFrameStore:
+	def __init__(self):
+		# flag -> deque de (numéro d'arrivée, trame)
+		self.by_flag = {}
+		# (numéro d'arrivée, flag) dans l'ordre d'arrivée, avec entrées périmées
+		self.order = deque()
+		self.seq = 0
+		self.count = 0
+		self.bytes = 0
+		self.bytes_by_flag = {}
+
+		# limites (None : pas de limite)
+		self.max_frames = None
+		self.max_bytes = None
+		self.max_frames_per_flag = None
+		self.max_bytes_per_flag = None
+		self.policy = FRAME_STORE_DROP_OLDEST
+
+		# trames supprimées ou rejetées à cause des limites
+		self.dropped_frames = 0
+		self.dropped_bytes = 0
+		self.dropped_by_flag = {}
+
+	def __len__(self):
+		return self.count
+
+	def __contains__(self, _flag):
+		return _flag in self.by_flag
+
+	## \brief parcourt les trames dans l'ordre d'arrivée (debug, statistiques)
+	def __iter__(self):
+		frames = sorted((entry for queue in self.by_flag.values() for entry in queue), key=lambda entry: entry[0])
+		return iter([frame for seq, frame in frames])
+
+	## \brief nombre de trames en attente pour un flag
+	def count_flag(self, _flag):
+		queue = self.by_flag.get(_flag)
+		return len(queue) if queue is not None else 0
+
+	## \brief liste des flags présents dans le buffer
+	def flags(self):
+		return list(self.by_flag)
+
+	## \brief défini les limites du buffer et la politique appliquée lorsqu'elles sont atteintes
+	# les limites ne sont appliquées qu'aux trames ajoutées ensuite
+	def set_limits(self, _max_frames=None, _max_bytes=None, _max_frames_per_flag=None, _max_bytes_per_flag=None, _policy=FRAME_STORE_DROP_OLDEST):
+		if _policy not in FRAME_STORE_POLICIES:
+			raise ValueError("unknown policy %s"%str(_policy))
+		self.max_frames = _max_frames
+		self.max_bytes = _max_bytes
+		self.max_frames_per_flag = _max_frames_per_flag
+		self.max_bytes_per_flag = _max_bytes_per_flag
+		self.policy = _policy
+
+	## \brief True si une limite est définie
+	def is_bounded(self):
+		return self.max_frames is not None or self.max_bytes is not None \
+			or self.max_frames_per_flag is not None or self.max_bytes_per_flag is not None
+
+	## \brief teste si une trame peut être ajoutée sans dépasser les limites
+	def accepts(self, _frame):
+		flag, size = _frame[0], _frame[1]
+		if self.count:
+			if self.max_frames is not None and self.count >= self.max_frames:
+				return False
+			if self.max_bytes is not None and self.bytes + size > self.max_bytes:
+				return False
+		queue = self.by_flag.get(flag)
+		if queue is not None:
+			if self.max_frames_per_flag is not None and len(queue) >= self.max_frames_per_flag:
+				return False
+			if self.max_bytes_per_flag is not None and self.bytes_by_flag[flag] + size > self.max_bytes_per_flag:
+				return False
+		return True
+
+	## \brief ajoute une trame en appliquant les limites
+	# @param _frame (flag, size, data)
+	# @param _force ajoute la trame sans tenir compte des limites (trame attendue par un demandeur)
+	# @return True si la trame a été ajoutée, False si elle est rejetée
+	#         (FRAME_STORE_DROP_NEWEST) ou refusée (FRAME_STORE_BLOCK)
+	def push(self, _frame, _force=False):
+		bounded = not _force and self.is_bounded()
+		if bounded and self.policy != FRAME_STORE_DROP_OLDEST and not self.accepts(_frame):
+			if self.policy == FRAME_STORE_DROP_NEWEST:
+				self.__count_dropped(_frame)
+			return False
+
+		self.seq += 1
+		flag = _frame[0]
+		queue = self.by_flag.get(flag)
+		if queue is None:
+			queue = self.by_flag[flag] = deque()
+			self.bytes_by_flag[flag] = 0
+		queue.append((self.seq, _frame))
+		self.order.append((self.seq, flag))
+		self.count += 1
+		self.bytes += _frame[1]
+		self.bytes_by_flag[flag] += _frame[1]
+
+		if bounded and self.policy == FRAME_STORE_DROP_OLDEST:
+			self.__evict(flag)
+		return True
+
+	## \brief extrait la plus ancienne trame
+	# @param _flag le flag de la trame, None pour la plus ancienne tous flags confondus
+	# @return la trame (flag, size, data) ou None si aucune trame ne correspond
+	def pop(self, _flag=None):
+		if _flag is None:
+			while self.order:
+				seq, flag = self.order.popleft()
+				queue = self.by_flag.get(flag)
+				# entrée valide seulement si la trame est toujours en tête de sa file
+				if queue is not None and queue[0][0] == seq:
+					return self.__pop_queue(flag, queue)
+			return None
+
+		queue = self.by_flag.get(_flag)
+		if queue is None:
+			return None
+		frame = self.__pop_queue(_flag, queue)
+		self.__compact()
+		return frame
+
+	## \brief supprime les trames d'un flag ou toutes les trames
+	# @return le nombre de trames supprimées
+	def clear(self, _flag=None):
+		if _flag is None:
+			size = self.count
+			self.by_flag = {}
+			self.bytes_by_flag = {}
+			self.order = deque()
+			self.count = 0
+			self.bytes = 0
+			return size
+
+		queue = self.by_flag.pop(_flag, None)
+		if queue is None:
+			return 0
+		self.count -= len(queue)
+		self.bytes -= self.bytes_by_flag.pop(_flag)
+		self.__compact()
+		return len(queue)
+
+	def __pop_queue(self, _flag, _queue):
+		frame = _queue.popleft()[1]
+		if not _queue:
+			del self.by_flag[_flag]
+			del self.bytes_by_flag[_flag]
+		else:
+			self.bytes_by_flag[_flag] -= frame[1]
+		self.count -= 1
+		self.bytes -= frame[1]
+		return frame
+
+	def __count_dropped(self, _frame):
+		self.dropped_frames += 1
+		self.dropped_bytes += _frame[1]
+		self.dropped_by_flag[_frame[0]] = self.dropped_by_flag.get(_frame[0], 0) + 1
+
+	## \brief supprime les plus anciennes trames jusqu'à respecter les limites
+	# (FRAME_STORE_DROP_OLDEST), la trame qui vient d'être ajoutée est conservée
+	def __evict(self, _flag):
+		queue = self.by_flag[_flag]
+		while len(queue) > 1 and ((self.max_frames_per_flag is not None and len(queue) > self.max_frames_per_flag) \
+				or (self.max_bytes_per_flag is not None and self.bytes_by_flag[_flag] > self.max_bytes_per_flag)):
+			self.__count_dropped(self.__pop_queue(_flag, queue))
+		while self.count > 1 and ((self.max_frames is not None and self.count > self.max_frames) \
+				or (self.max_bytes is not None and self.bytes > self.max_bytes)):
+			self.__count_dropped(self.pop())
+		self.__compact()
+
+	## \brief reconstruit la file d'ordre lorsqu'elle contient trop d'entrées périmées
+	# au plus une reconstruction (tri) pour count+64 extractions par flag
+	def __compact(self):
+		if not self.count:
+			self.order.clear()
+		elif len(self.order) > 2*self.count + 64:
+			self.order = deque(sorted((seq, flag) for flag, queue in self.by_flag.items() for seq, _ in queue))
@@ -0,0 +1,313 @@
+#!/usr/bin/env python
+# -*- coding: UTF_8 -*-
+# @copyright  this code is the property of Ubertone.
+# You may use this code for your personal, informational, non-commercial purpose.
+# You may not distribute, transmit, display, reproduce, publish, license, create derivative works from, transfer or sell any information, software, products or services based on this code.
+# @author Stéphane Fischer
+
+## @package ap_instrument_hub
+#\brief Réception des trames de plusieurs instruments par un seul thread
+#
+# Chaque ApDataSocket ouverte sans hub démarre son propre ApSocketRecvTh,
+# bloqué en permanence sur sa socket. Avec de nombreux instruments, cela fait
+# autant de threads en concurrence pour le GIL.
+# InstrumentHub gère toutes les connexions depuis un unique thread basé sur
+# selectors : connexion (non bloquante), handshake, lecture des trames avec
+# ApFrameReader puis dépôt dans les buffers de chaque ApDataSocket via
+# push_recv_buffer. L'API publique de ApDataSocket est inchangée :
+#
+#   hub = InstrumentHub()
+#   hub.start()
+#   socket = hub.add('192.168.88.1', 3490)
+#   socket.wait_connexion()
+#   socket.send_recv_frame(...)
+#   ...
+#   hub.stop()
+
+import errno
+import selectors
+import socket
+from collections import deque
+from threading import Thread, Lock
+from time import monotonic
+
+from ub_lib_v1.ap_data_socket import ApDataSocket
+from ub_lib_v1.ap_frame_reader import ApFrameReader
+from ub_lib_v1.ap_socket import applyTransportProfile, transportQuickack, reconnectDelay
+from ub_lib_v1.ub_class_template import UbClassTemplate, txt_regular_purple
+
+
+## \brief état de la connexion d'une ApDataSocket gérée par le hub
+class _hub_connection:
+	def __init__(self, _data_socket):
+		self.data_socket = _data_socket
+		self.sock = None
+		self.reader = None
+		self.connecting = False
+		self.next_attempt = 0. # date de la prochaine tentative de connexion (monotonic)
+		self.next_keepalive = 0. # date de la prochaine vérification du keepalive (monotonic)
+		self.connect_attempts = 0 # échecs de connexion consécutifs (cf. reconnectDelay)
+		self.print_connect_failed = 0
+		# trame refusée par un recv_buffer plein (politique FRAME_STORE_BLOCK) :
+		# la lecture de la socket est suspendue jusqu'à ce qu'elle soit acceptée
+		self.pending_frame = None
+
+
+class InstrumentHub(Thread, UbClassTemplate):
+	def __init__(self):
+		UbClassTemplate.__init__(self)
+		Thread.__init__(self)
+
+		self.flag_debug_mess=False
+		self.debug_marker_start=txt_regular_purple
+		self.daemon = True # force l'arrêt du thread en cas d'arret du programme
+		self.name = "InstrumentHub"
+
+		self.selector = selectors.DefaultSelector()
+		self.connections = []
+		# ApDataSocket dont l'ouverture a été demandée par un autre thread
+		self.pending = deque()
+		self.pending_lock = Lock()
+		self.running = False
+
+		# socket interne permettant de réveiller le select depuis un autre thread
+		self.wakeup_recv, self.wakeup_send = socket.socketpair()
+		self.wakeup_recv.setblocking(False)
+		self.wakeup_send.setblocking(False)
+		self.selector.register(self.wakeup_recv, selectors.EVENT_READ, None)
+
+#######################################################################
+# Fonctions publiques                                                 #
+#######################################################################
+
+	## \brief crée une ApDataSocket gérée par le hub
+	# les paramètres sont ceux du constructeur de ApDataSocket
+	def add(self, _host, _port, **_kwargs):
+		return ApDataSocket(_host, _port, _hub=self, **_kwargs)
+
+	def start(self):
+		self.running = True
+		Thread.start(self)
+
+	## \brief cloture toutes les sockets et arrete le thread
+	def stop(self):
+		for connection in list(self.connections) + list(self.pending):
+			if connection.data_socket.is_open:
+				try:
+					connection.data_socket.close()
+				except:
+					self.info("WARNING fail to close the socket %s:%s"%(connection.data_socket.host, connection.data_socket.port))
+		self.running = False
+		self.wakeup()
+		if self.is_alive():
+			self.join()
+
+	## \brief réveille le thread du hub (appelé par ApDataSocket.private_reset)
+	def wakeup(self):
+		try:
+			self.wakeup_send.send(b'\x00')
+		except OSError: # buffer plein : le hub sera réveillé de toute façon
+			pass
+
+	## \brief prend en charge la réception d'une ApDataSocket (appelé par ApDataSocket.open)
+	def register(self, _data_socket):
+		with self.pending_lock:
+			self.pending.append(_hub_connection(_data_socket))
+		self.wakeup()
+
+#######################################################################
+# Boucle du thread                                                    #
+#######################################################################
+
+	def run(self):
+		self.debug("run")
+		while self.running:
+			events = self.selector.select(self.__select_timeout())
+			for key, mask in events:
+				if key.data is None:
+					self.__drain_wakeup()
+				elif key.data.connecting:
+					self.__on_connected(key.data)
+				else:
+					self.__on_readable(key.data)
+			self.__check_connections()
+
+		for connection in self.connections:
+			self.__unregister(connection)
+		self.connections = []
+		self.selector.close()
+		self.wakeup_recv.close()
+		self.wakeup_send.close()
+		self.info("hub stopped")
+
+	def __select_timeout(self):
+		timeout = None
+		now = monotonic()
+		for connection in self.connections:
+			if connection.sock is None:
+				deadline = connection.next_attempt
+			elif not connection.connecting:
+				deadline = connection.next_keepalive
+			else:
+				continue
+			delay = max(0., deadline - now)
+			if timeout is None or delay < timeout:
+				timeout = delay
+		return timeout
+
+	def __drain_wakeup(self):
+		try:
+			while self.wakeup_recv.recv(4096):
+				pass
+		except (BlockingIOError, InterruptedError):
+			pass
+
+	def __unregister(self, _connection):
+		if _connection.sock is not None:
+			try:
+				self.selector.unregister(_connection.sock)
+			except (KeyError, ValueError):
+				pass
+			_connection.sock = None
+			_connection.reader = None
+			_connection.connecting = False
+			_connection.pending_frame = None
+
+	## \brief gère les nouvelles sockets, les tentatives de connexion et les resets
+	def __check_connections(self):
+		with self.pending_lock:
+			while self.pending:
+				connection = self.pending.popleft()
+				# une socket ré-ouverte avant que le hub ait traité sa fermeture
+				# garde sa connexion
+				if not any(known.data_socket is connection.data_socket for known in self.connections):
+					self.connections.append(connection)
+
+		now = monotonic()
+		for connection in list(self.connections):
+			data_socket = connection.data_socket
+			if connection.sock is not None and not connection.connecting \
+					and (data_socket.socket_id is not connection.sock or not data_socket.event_is_connected.is_set()):
+				# la socket a été coupée (close, erreur d'émission...)
+				self.__unregister(connection)
+				if data_socket.is_open:
+					self.info("try to reconnect to %s:%s"%(data_socket.host, data_socket.port))
+
+			elif connection.sock is not None and not connection.connecting:
+				if connection.pending_frame is not None:
+					self.__dispatch(connection)
+				if connection.sock is not None and now >= connection.next_keepalive:
+					try:
+						connection.next_keepalive = now + data_socket.private_keepalive()
+					except BaseException as exc:
+						self.__on_failure(connection, exc)
+
+			if connection.sock is None:
+				if not data_socket.is_open:
+					self.info("data_socket %s:%s has been closed"%(data_socket.host, data_socket.port))
+					self.connections.remove(connection)
+				elif now >= connection.next_attempt:
+					self.__connect(connection)
+
+	## \brief lance une connexion non bloquante
+	def __connect(self, _connection):
+		data_socket = _connection.data_socket
+		data_socket.event_is_connected.clear()
+		data_socket.event_is_reset.set()
+		sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		# réglages TCP (avant le connect pour la taille des buffers)
+		data_socket.transport_info = applyTransportProfile(sock, data_socket.transport_profile)
+		sock.setblocking(False)
+		connect_err = sock.connect_ex((data_socket.host, int(data_socket.port)))
+		if connect_err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+			sock.close()
+			self.__connect_failed(_connection, connect_err)
+			return
+		_connection.sock = sock
+		_connection.connecting = True
+		self.selector.register(sock, selectors.EVENT_WRITE, _connection)
+
+	def __connect_failed(self, _connection, _connect_err):
+		data_socket = _connection.data_socket
+		if _connect_err != _connection.print_connect_failed: # print lors du premier passage
+			self.info("connexion to %s:%s failed (with error %d), try undefinitely"%(data_socket.host, data_socket.port, _connect_err))
+			_connection.print_connect_failed = _connect_err
+		_connection.next_attempt = monotonic() + reconnectDelay(_connection.connect_attempts)
+		_connection.connect_attempts += 1
+
+	def __on_connected(self, _connection):
+		data_socket = _connection.data_socket
+		sock = _connection.sock
+		connect_err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+		self.__unregister(_connection)
+		if connect_err != 0:
+			sock.close()
+			self.__connect_failed(_connection, connect_err)
+			return
+
+		self.info("connected to the driver (%s:%s)"%(data_socket.host, data_socket.port))
+		_connection.print_connect_failed = 0
+		_connection.connect_attempts = 0
+		# en mode bloquant, les émissions des autres threads restent inchangées.
+		# Les lectures ne sont faites que lorsque le selector signale des données
+		sock.setblocking(True)
+
+		failure = None
+		data_socket.lock()
+		try:
+			if not data_socket.is_open: # fermée entre temps
+				sock.close()
+				return
+			data_socket.socket_id = sock
+			try:
+				data_socket.private_handshake()
+			except Exception as exc:
+				failure = exc
+		finally:
+			data_socket.unlock()
+		if failure is not None:
+			data_socket.private_recv_failure(failure)
+			return
+
+		_connection.sock = sock
+		_connection.reader = ApFrameReader(sock, _quickack=transportQuickack(data_socket.transport_profile))
+		_connection.next_keepalive = monotonic() + data_socket.timeout*data_socket.keepalive_ratio
+		self.selector.register(sock, selectors.EVENT_READ, _connection)
+
+	def __on_failure(self, _connection, _exception):
+		self.__unregister(_connection)
+		_connection.data_socket.private_recv_failure(_exception)
+		if _connection.data_socket.is_open:
+			self.info("try to reconnect")
+
+	def __on_readable(self, _connection):
+		try:
+			_connection.reader.fill()
+		except BaseException as exc:
+			self.__on_failure(_connection, exc)
+			return
+		self.__dispatch(_connection)
+
+	## \brief transmet à la data_socket les trames décodées
+	# si le recv_buffer est plein (politique FRAME_STORE_BLOCK), la lecture de la
+	# socket est suspendue (le driver est ralenti par le contrôle de flux TCP) :
+	# la trame est représentée lorsque la data_socket réveille le hub
+	def __dispatch(self, _connection):
+		data_socket = _connection.data_socket
+		try:
+			frame = _connection.pending_frame or _connection.reader.next_frame()
+			while frame is not None:
+				flag, tab_size, data = frame
+				self.debug("on recoit flag %d (size = %d)"%(flag, tab_size))
+				if not data_socket.push_recv_buffer(flag, tab_size, data, _block=False, _recv_ns=_connection.reader.frame_ns): # intègre le lock
+					if _connection.pending_frame is None:
+						self.debug("recv_buffer full, pause %s:%s"%(data_socket.host, data_socket.port))
+						_connection.pending_frame = frame
+						self.selector.unregister(_connection.sock)
+					return
+				if _connection.pending_frame is not None:
+					_connection.pending_frame = None
+					self.selector.register(_connection.sock, selectors.EVENT_READ, _connection)
+				frame = _connection.reader.next_frame()
+		except BaseException as exc:
+			self.__on_failure(_connection, exc)
@@ -11,16 +11,56 @@
 # Notes : au besoin, utiliser socket.setblocking(0) pour les rendre non bloquantes
 # ou utiliser settimeout() sur une socket bloquante
 
+import random
 import socket
 import traceback
+from struct import Struct
 #from os import strerror
 #from errno import EAGAIN
 
-from ub_lib_v1.ap_exception import ap_socket_error
+from ub_lib_v1.ap_exception import ap_socket_error, ap_socket_exception
 
 # nombre de tentative en cas d'envoi ou de réception de blocs incomplets
+# (uniquement pour recvAll, recvInto/recvBuffer n'ont pas de limite)
 limitation_reception_parts = 100
 
+# en-tête d'une trame : flag + taille des données
+_frame_header = Struct('ii')
+
+# profils de réglage des sockets TCP (cf. applyTransportProfile)
+# - nodelay : désactive l'algorithme de Nagle (TCP_NODELAY)
+# - quickack : acquittement immédiat (TCP_QUICKACK, Linux). Cette option n'est pas
+#   permanente, le noyau repasse de lui-même en acquittement retardé : elle est donc
+#   ré-armée par la boucle de réception après chaque lecture (cf. rearmQuickack)
+# - rcvbuf / sndbuf : taille des buffers noyau en octets (SO_RCVBUF / SO_SNDBUF)
+# - keepidle / keepintvl / keepcnt : keepalive TCP (SO_KEEPALIVE, TCP_KEEPIDLE/TCP_KEEPINTVL/TCP_KEEPCNT)
+TRANSPORT_PROFILES = {
+	# réglages par défaut de l'OS
+	"default" : {},
+	# petites trames de commande / réponse
+	"low_latency" : {"nodelay": True, "quickack": True, "keepidle": 10, "keepintvl": 5, "keepcnt": 3},
+	# gros blocs de données (IQ)
+	"bulk" : {"nodelay": False, "rcvbuf": 4*1024*1024, "sndbuf": 1024*1024, "keepidle": 10, "keepintvl": 5, "keepcnt": 3},
+}
+
+# option socket correspondant à chaque paramètre d'un profil : (level, nom de l'option)
+_transport_options = {
+	"nodelay" : (socket.IPPROTO_TCP, "TCP_NODELAY"),
+	"quickack" : (socket.IPPROTO_TCP, "TCP_QUICKACK"),
+	"rcvbuf" : (socket.SOL_SOCKET, "SO_RCVBUF"),
+	"sndbuf" : (socket.SOL_SOCKET, "SO_SNDBUF"),
+	"keepidle" : (socket.IPPROTO_TCP, "TCP_KEEPIDLE" if hasattr(socket, "TCP_KEEPIDLE") else "TCP_KEEPALIVE"), # TCP_KEEPALIVE sous macOS
+	"keepintvl" : (socket.IPPROTO_TCP, "TCP_KEEPINTVL"),
+	"keepcnt" : (socket.IPPROTO_TCP, "TCP_KEEPCNT"),
+}
+
+# nombre maximum de buffers passés à un appel de sendmsg (IOV_MAX vaut au moins 1024 sous Linux)
+limitation_send_buffers = 1024
+
+# délais entre deux tentatives de connexion au driver (cf. reconnectDelay)
+RECONNECT_FIRST_DELAY = 0.1
+RECONNECT_MAX_DELAY = 30. # le temps de déconnexion par défaut du driver est de 20 secondes
+
 
 # TODO on pourrait simplement utiliser le sendall de python
 def sendAll(_socket, _data):
@@ -36,8 +76,9 @@ def sendAll(_socket, _data):
 			if total==0:
 				print ("sendAll : return with no data sent TODO should raise an exception ?")
 			print ("sendAll : some data have not been send (", total, "/", len(_data), ")")
+			view = memoryview(_data)
 			while (total<len(_data)):
-				n = _socket.send(_data[total:len(_data)-1])
+				n = _socket.send(view[total:])
 				total += n
 
 	except OSError as serr:
@@ -68,6 +109,105 @@ def sendAll(_socket, _data):
 	return total
 
 
+def sendBuffers(_socket, _buffers):
+	"""
+	@brief Envoie une liste de blocs de données par TCP/IP sans les concaténer
+	@param _buffers liste d'objets bytes-like (bytes, bytearray, memoryview, array ...)
+	@return le nombre total d'octets envoyés
+
+	utilise sendmsg (scatter/gather) lorsqu'il est disponible, sinon envoie les blocs
+	un par un. Les envois partiels sont repris à l'octet près.
+	"""
+	views = [memoryview(buf).cast('B') for buf in _buffers]
+	views = [view for view in views if len(view)]
+	total = 0
+	try:
+		if not hasattr(_socket, "sendmsg"): # Windows
+			for view in views:
+				_socket.sendall(view)
+				total += len(view)
+			return total
+
+		i = 0
+		while i < len(views):
+			n = _socket.sendmsg(views[i:i+limitation_send_buffers])
+			if n == 0:
+				raise ap_socket_error(14, "sendBuffers : return with no data sent")
+			total += n
+			# on passe les blocs envoyés, le dernier peut l'être partiellement
+			while i < len(views) and n >= len(views[i]):
+				n -= len(views[i])
+				i += 1
+			if n:
+				views[i] = views[i][n:]
+
+	except OSError as serr:
+		raise ap_socket_error(10, "sendBuffers : socket error [%d] %s"%(serr.errno, serr.strerror))
+	except MemoryError as inst:
+		print ("sendBuffers : MemoryError", type(inst), inst)
+		raise ap_socket_error(12, "sendBuffers : Memory error")
+	except ap_socket_error : # on laisse passer
+		raise
+	except: # on gère ici toutes les autres erreurs
+		print ("sendBuffers : WARNING unexpected error -> email to stephane.fischer@ubertone.fr")
+		print (traceback.format_exc())
+		raise ap_socket_error(13, "sendBuffers : WARNING unexpected error -> email to stephane.fischer@ubertone.fr")
+	return total
+
+
+def sendFrame(_socket, _flag, _message=b''):
+	"""
+	@brief Envoie une trame (flag, taille, données) sans copier les données
+	@param _flag (int) : le flag de la trame
+	@param _message : les données (bytes-like, une chaine str est encodée en UTF-8, None équivaut à une trame vide)
+	@return le nombre total d'octets envoyés
+	"""
+	if _message is None:
+		_message = b''
+	elif isinstance(_message, str):
+		_message = _message.encode('UTF8')
+	message = memoryview(_message).cast('B')
+	return sendBuffers(_socket, [_frame_header.pack(_flag, len(message)), message])
+
+
+def sendFrames(_socket, _frames):
+	"""
+	@brief Envoie plusieurs trames en un seul appel à sendBuffers (un seul sendmsg si possible)
+	@param _frames : liste de (flag, données), cf. sendFrame
+	@return le nombre total d'octets envoyés
+	"""
+	buffers = []
+	for flag, message in _frames:
+		if message is None:
+			message = b''
+		elif isinstance(message, str):
+			message = message.encode('UTF8')
+		message = memoryview(message).cast('B')
+		buffers.append(_frame_header.pack(flag, len(message)))
+		if len(message):
+			buffers.append(message)
+	return sendBuffers(_socket, buffers)
+
+
+def sendNoWait(_socket, _data):
+	"""
+	@brief Envoie un petit bloc de données (keepalive) sans attendre si le buffer d'émission est plein
+	@param _data : quelques octets
+	@return True si le bloc a été envoyé, False si le buffer d'émission est plein (rien n'est envoyé)
+
+	un bloc commencé est toujours terminé (par sendAll) pour ne pas corrompre le flux
+	"""
+	try:
+		n = _socket.send(_data, getattr(socket, "MSG_DONTWAIT", 0)) # pas de MSG_DONTWAIT sous Windows
+	except (BlockingIOError, InterruptedError):
+		return False
+	except OSError as serr:
+		raise ap_socket_error(10, "sendNoWait : socket error [%d] %s"%(serr.errno, serr.strerror))
+	if n < len(_data):
+		sendAll(_socket, memoryview(_data)[n:])
+	return True
+
+
 def recvAll(_socket, _size):
 	"""
 	@brief Permet de recevoir une quantité prédéterminée de données sur une socket TCP/IP
@@ -125,3 +265,162 @@ def recvAll(_socket, _size):
 		raise ap_socket_error(26, "recvAll : WARNING unexpected error -> email to stephane.fischer@ubertone.fr")
 	return alldata
 
+
+
+def recvInto(_socket, _buffer):
+	"""
+	@brief Remplit intégralement un buffer pré-alloué avec les données reçues sur une socket TCP/IP
+	@param _socket (socket) : la socket où récupérer les données
+	@param _buffer (bytearray ou memoryview inscriptible) : le buffer à remplir
+	@return le nombre d'octets reçus (égal à la taille du buffer)
+
+	Contrairement à recvAll, les données sont écrites directement dans le buffer
+	par recv_into (pas de concaténation) et il n'y a pas de limite sur le nombre
+	de morceaux reçus.
+	"""
+	view = memoryview(_buffer).cast('B')
+	size = len(view)
+	offset = 0
+	try:
+		while offset < size:
+			numbyte = _socket.recv_into(view[offset:], size - offset)
+			if not numbyte:
+				raise ap_socket_error(21, "recvInto : recv return no data (%d/%d): connexion broken by peer"%(offset,size)) # lorsque le serveur coupe la liaison, recv retourne 0
+			offset += numbyte
+
+	except OSError as serr:
+		raise ap_socket_error(23, "recvInto : socket error [%d] %s"%(serr.errno, serr.strerror))
+	except MemoryError as inst:
+		print ("recvInto MemoryError (not socket.error)", type(inst), inst)
+		raise ap_socket_error(25, "recvInto : Memory error")
+	except ap_socket_error : # on laisse passer
+		raise
+	except: # on gère ici toutes les autres erreurs
+		print ("recvInto : WARNING unexpected error -> email to stephane.fischer@ubertone.fr")
+		print (traceback.format_exc())
+		raise ap_socket_error(26, "recvInto : WARNING unexpected error -> email to stephane.fischer@ubertone.fr")
+	return offset
+
+
+def recvBuffer(_socket, _size):
+	"""
+	@brief Reçoit une quantité prédéterminée de données dans un unique bytearray pré-alloué
+	@param _socket (socket) : la socket où récupérer les données
+	@param _size (int) la taille des données à recevoir
+	@return alldata (bytearray) : les données reçues, transmissibles sans copie
+
+	variante zero-copy de recvAll
+	"""
+	if _size < 0:
+		raise ap_socket_error(20, "recvBuffer : negative buffer size")
+	try:
+		alldata = bytearray(_size)
+	except MemoryError:
+		raise ap_socket_error(25, "recvBuffer : Memory error")
+	recvInto(_socket, alldata)
+	return alldata
+
+
+def reconnectDelay(_attempt):
+	"""
+	@brief Délai avant une nouvelle tentative de connexion au driver
+	@param _attempt (int) : nombre de tentatives ayant déjà échoué depuis la dernière connexion
+	@return le délai en secondes
+
+	la première tentative après un échec est immédiate (coupure ponctuelle), puis le
+	délai double à partir de RECONNECT_FIRST_DELAY jusqu'à RECONNECT_MAX_DELAY. Il est
+	tiré entre la moitié et la totalité de cette valeur (jitter) pour que les clients
+	d'un même driver ne se reconnectent pas tous au même instant
+	"""
+	if _attempt <= 0:
+		return 0.
+	delay = min(RECONNECT_FIRST_DELAY*2**(_attempt-1), RECONNECT_MAX_DELAY)
+	return delay*random.uniform(0.5, 1.)
+
+
+def checkTransportProfile(_profile):
+	"""
+	@brief Vérifie un profil de réglage de socket (nom connu ou dictionnaire de paramètres connus)
+	@param _profile : cf. applyTransportProfile
+	"""
+	if _profile is None:
+		return
+	if isinstance(_profile, dict):
+		unknown = [param for param in _profile if param not in _transport_options]
+	elif _profile not in TRANSPORT_PROFILES:
+		unknown = [_profile]
+	else:
+		unknown = []
+	if unknown:
+		raise ap_socket_exception(323, "checkTransportProfile : unknown transport profile or parameter %s"%(", ".join([str(param) for param in unknown])))
+
+
+def applyTransportProfile(_socket, _profile=None):
+	"""
+	@brief Applique un profil de réglage à une socket TCP
+	@param _socket (socket) : la socket, de préférence avant le connect (pour rcvbuf)
+	@param _profile : nom d'un profil de TRANSPORT_PROFILES, dictionnaire de paramètres (profil
+	                  personnalisé) ou None (réglages de l'OS)
+	@return dictionnaire des valeurs effectives, relues sur la socket (pour diagnostic)
+
+	les options non disponibles sur la plateforme sont ignorées (et absentes du retour)
+	"""
+	if _profile is None:
+		_profile = {}
+	elif not isinstance(_profile, dict):
+		_profile = TRANSPORT_PROFILES[_profile]
+
+	if "keepidle" in _profile or "keepintvl" in _profile or "keepcnt" in _profile:
+		_socket.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+
+	for param, value in _profile.items():
+		level, option_name = _transport_options[param]
+		option = getattr(socket, option_name, None)
+		if option is None:
+			continue
+		try:
+			_socket.setsockopt(level, option, int(value))
+		except OSError as serr:
+			print ("applyTransportProfile : fail to set %s=%s [%s] %s"%(option_name, value, serr.errno, serr.strerror))
+
+	effective = {"keepalive": _socket.getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE)}
+	for param, (level, option_name) in _transport_options.items():
+		option = getattr(socket, option_name, None)
+		if option is None:
+			continue
+		if param == "quickack":
+			# la valeur relue n'a pas de sens (non permanente) : on indique si le
+			# ré-armement est demandé
+			effective[param] = int(bool(_profile.get(param, False)))
+			continue
+		try:
+			effective[param] = _socket.getsockopt(level, option)
+		except OSError:
+			pass
+	return effective
+
+
+def transportQuickack(_profile):
+	"""
+	@brief Indique si un profil de réglage demande l'acquittement immédiat
+	@param _profile : cf. applyTransportProfile
+	@return True si TCP_QUICKACK doit être ré-armé après chaque lecture (cf. rearmQuickack)
+	"""
+	if _profile is None or getattr(socket, "TCP_QUICKACK", None) is None:
+		return False
+	if not isinstance(_profile, dict):
+		_profile = TRANSPORT_PROFILES[_profile]
+	return bool(_profile.get("quickack", False))
+
+
+def rearmQuickack(_socket):
+	"""
+	@brief Ré-arme TCP_QUICKACK sur une socket (à appeler après chaque lecture)
+
+	le noyau Linux quitte de lui-même le mode d'acquittement immédiat, l'option
+	doit donc être repositionnée régulièrement pour rester effective
+	"""
+	try:
+		_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_QUICKACK, 1)
+	except OSError:
+		pass
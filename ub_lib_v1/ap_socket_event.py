@@ -1,6 +1,9 @@
 #!/usr/bin/env python
 # -*- coding: UTF_8 -*-
+from concurrent.futures import InvalidStateError
 from threading import Event
+from time import monotonic_ns
+from ub_lib_v1.ap_deadline_scheduler import get_deadline_scheduler, deadline_ns, remaining
 from ub_lib_v1.ap_exception import ap_socket_error, ap_socket_timeout
 from ub_lib_v1.ub_class_template import UbClassTemplate, txt_regular_blue
 
@@ -21,18 +24,51 @@ from ub_lib_v1.ub_class_template import UbClassTemplate, txt_regular_blue
 # seul la fonction wait() est à utiliser
 
 class ap_socket_event (UbClassTemplate):
-	def __init__(self, _socket):
+	## \brief Constructeur
+	# @param _socket la data_socket
+	# @param _flag le flag attendu (clé dans le wait_buffer de la data_socket)
+	def __init__(self, _socket, _flag=None):
 		UbClassTemplate.__init__(self)
-		self.flag_debug_mess=True
+		self.flag_debug_mess=False
 		self.debug_marker_start=txt_regular_blue
 
 		self.sock_event = Event()
 		self.socket = _socket
+		self.flag = _flag
+		# mode pipeline (cf. ApDataSocket) : réponse remise à l'évenement, attente
+		# liée à une requête émise, abandon sur timeout
+		self.frame = None
+		self.answer_expected = False
+		self.abandoned = False
+		# requête soumise par submit / send_recv_many : Future terminé avec la
+		# trame, et échéance de timeout partagée par les requêtes du lot (batch)
+		self.future = None
+		self.deadline = None
+		self.batch = None
+		# reprise de session (cf. ApDataSocket) : requête émise (flag, message),
+		# renvoyée à la reconnexion si elle est conservée (held) lors d'une coupure
+		self.request = None
+		self.held = False
+		# trace de latence (cf. ap_trace), None si les traces sont désactivées
+		self.trace = None
 
-# TODO ? mémoriser le flag associé ?
 	def set(self):
 		return self.sock_event.set()
 
+	## \brief termine le Future de la requête avec la trame reçue ou une exception
+	# appelé hors lock de la data_socket (le Future exécute les callbacks de l'utilisateur)
+	def complete(self, _exception=None):
+		try:
+			if _exception is None:
+				self.future.set_result(self.frame)
+			else:
+				self.future.set_exception(_exception)
+		except InvalidStateError: # déjà terminé (réception et timeout simultanés)
+			return
+		# pas d'échéance : lot terminé avant sa programmation, ou délai infini
+		if self.deadline is not None and all(sock_event.future.done() for sock_event in self.batch):
+			get_deadline_scheduler().cancel(self.deadline)
+
 	def clear(self):
 		return self.sock_event.clear()
 
@@ -47,9 +83,21 @@ class ap_socket_event (UbClassTemplate):
 		return self.sock_event.isSet()
 
 	def wait(self, _timeout=None):
-		self.sock_event.wait(_timeout)
-		# théoriquement wait retourne False en cas de timeout, mais ça n'a pas l'air
-		# d'être le cas
+		if _timeout is None:
+			self.sock_event.wait()
+		else:
+			# échéance sur l'horloge monotone : un réveil anticipé relance l'attente
+			# du temps restant
+			deadline = deadline_ns(_timeout)
+			while not self.sock_event.wait(remaining(deadline)) and monotonic_ns() < deadline:
+				pass
+
+		if not self.sock_event.is_set():
+			# si le flag attendu par l'évennement est bien arrivé, le thread de
+			# réception le supprime de la liste. Par contre en cas de timeout (y
+			# compris pendant une coupure, requête conservée pour la reprise de
+			# session), on supprime l'event de la liste
+			self.socket.del_event(self)
 
 		# On utilise le mécanisme de remonter d'exception
 		self.socket._catch_exception_from_socket_thread()
@@ -59,10 +107,6 @@ class ap_socket_event (UbClassTemplate):
 			raise ap_socket_error (309, "ap_socket_event::wait : CONNEXION FAILURE")
 
 		if not self.isSet():
-			# si le flag attendu par l'évennement est bien arrivé, le thread de
-			# réception le supprime de la liste. Par contre en cas de timeout, 
-			# on supprime l'event de la liste
-			self.socket.del_event(self)
 			self.debug("socket_timeout")
 			raise ap_socket_timeout (208, "ap_socket_event::wait : TIMEOUT")
 
@@ -7,20 +7,17 @@
 
 import socket
 from threading import Thread
-from struct import unpack, pack, calcsize
 from time import sleep
 #from os import strerror
-import traceback
 import gc
 
-from ub_lib_v1.ap_socket import sendAll, recvAll
-from ub_lib_v1.ap_exception import ap_socket_error
+from ub_lib_v1.ap_frame_reader import ApFrameReader
+from ub_lib_v1.ap_socket import applyTransportProfile, transportQuickack, reconnectDelay
 from ub_lib_v1.ub_class_template import UbClassTemplate, txt_regular_purple
 
 CMD_TCP_TIMEOUT_SOCKET = 10007
 ANS_TCP_TIMEOUT_SOCKET = 20007
 
-
 class ApSocketRecvTh(Thread, UbClassTemplate):
 	def __init__(self, _data_socket, _host, _port):
 		UbClassTemplate.__init__(self)
@@ -35,37 +32,27 @@ class ApSocketRecvTh(Thread, UbClassTemplate):
 		self.debug("initialized")
 
 	## \brief Récupération d'une trame de donnée \n
-	# @param _socket (socket) : la socket pour récupérer les données
-	# @param _timeout (float) : le timeout qui est de 10.0
+	# les trames déjà présentes dans le buffer du décodeur sont retournées sans
+	# appel système. En attendant une trame, le keepalive n'est envoyé que si la
+	# liaison est restée inactive (cf. ApDataSocket.private_keepalive)
+	# @param _reader (ApFrameReader) : le décodeur associé à la socket
 	# @return flag (int) : l'entier permettant de savoir de quel type est la commande
 	# @return tab_size (int) : la taille des données
-	# @return data (struct) : les données
-	def __recv_anyframe__(self, _socket):
-		sendAll(_socket,pack('i', 1)) # flag keepalive
-
-		# lecture du flag
-		flag = unpack('i', recvAll( _socket, calcsize('i')))[0] 
-		while flag < 2 and flag !=0:
-			flag = unpack('i', recvAll( _socket, calcsize('i')))[0] 
-		if flag == 0:
-			raise ap_socket_error(30, "__recv_anyframe__ : driver error while reading the socket")
-		
-		# lecture de la taille du bloc de données
-		tab_size = unpack('i', recvAll( _socket, calcsize('i')))[0] 
-		
-		# lecture du bloc de données
-		data = recvAll( _socket,tab_size)
-		if len(data)!=tab_size:
-			raise ap_socket_error(31, "__recv_anyframe__ : taille de frame erronée (%d/%d)"%(len(data),tab_size))
-
-		return flag, tab_size, data
+	# @return data (bytearray) : les données, reçues sans copie intermédiaire
+	def __recv_anyframe__(self, _reader):
+		frame = _reader.next_frame()
+		while frame is None:
+			if _reader.wait(self.data_socket.private_keepalive()):
+				_reader.fill()
+				frame = _reader.next_frame()
+		return frame
 
 
 	def run(self):
 		""" @brief Boucle du thread """
 		self.debug("run")
 		print_connect_failed = 0 # pour le print connexion failed
-		sleep_before_reconnect = 1
+		connect_attempts = 0 # échecs de connexion consécutifs (cf. reconnectDelay)
 		while(self.data_socket.is_open): 
 			self.data_socket.event_is_connected.clear()
 			self.data_socket.event_is_reset.set()
@@ -78,6 +65,8 @@ class ApSocketRecvTh(Thread, UbClassTemplate):
 				try:
 					self.debug("create socket")
 					self.data_socket.socket_id = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+					# réglages TCP (avant le connect pour la taille des buffers)
+					self.data_socket.transport_info = applyTransportProfile(self.data_socket.socket_id, self.data_socket.transport_profile)
 					# TODO attention à surveiller : il arrive, après déconnexion, que la socket semble se
 					# reconnecté alors que ce n'est pas le cas !!!
 					self.debug("try to connect")
@@ -86,27 +75,23 @@ class ApSocketRecvTh(Thread, UbClassTemplate):
 					connect_err = self.data_socket.socket_id.connect_ex((self.HOST, self.PORT))
 					if connect_err != 0:
 						self.debug("connexion failed")
+						self.data_socket.socket_id.close()
 						# connexion failed
 						if connect_err != print_connect_failed: # print lors du premier passage
 							self.info("connexion to %s:%d failed (with error %d), try undefinitely"%(self.HOST, self.PORT, connect_err))
 							print_connect_failed = connect_err
 
-						sleep_before_reconnect *=2 #on augmente progressivement le délai
-						if sleep_before_reconnect > 30: # le temps de déconnexion par défaut du driver est de 20 secondes
-							sleep_before_reconnect = 30
-						sleep (sleep_before_reconnect) # on attends un peu avant d'essayer de se reconnecter
+						sleep (reconnectDelay(connect_attempts)) # on attends un peu avant d'essayer de se reconnecter
+						connect_attempts += 1 # on augmente progressivement le délai
 						continue
 					self.info("connected to the driver (%s:%d)"%(self.HOST,self.PORT))
 					print_connect_failed = 0
+					connect_attempts = 0
 
 					self.data_socket.socket_id.settimeout(None) # on force le mode bloquant (bien que ce soit a priori le mode par défaut)
 
-					# at startup, reset the timeout on server side : TODO ? intégrer dans le protocole ?
-					sendAll(self.data_socket.socket_id,pack('i', CMD_TCP_TIMEOUT_SOCKET)+pack('i', 4)+pack("i",int(self.data_socket.timeout+2)))
-					# le retour est récupéré plus loin dans la boucle de réception.
-
-					self.data_socket.event_is_connected.set()
-					self.data_socket.event_is_reset.clear()
+					# at startup, reset the timeout on server side
+					self.data_socket.private_handshake()
 				
 				finally:
 					self.data_socket.unlock()
@@ -114,6 +99,7 @@ class ApSocketRecvTh(Thread, UbClassTemplate):
 				##################################
 				# Boucle de réception des trames #
 				##################################
+				reader = ApFrameReader(self.data_socket.socket_id, _quickack=transportQuickack(self.data_socket.transport_profile))
 				while(1):
 					# ici on n'a pas besoin de mettre un critère d'interruption de la boucle 
 					# car on va principalement être en attente bloquante dans __recv_anyframe__
@@ -124,53 +110,23 @@ class ApSocketRecvTh(Thread, UbClassTemplate):
 #						raise SystemExit
 
 					# on attend une requête attendant une réponse
-					flag, tab_size, data = self.__recv_anyframe__(self.data_socket.socket_id) 
+					flag, tab_size, data = self.__recv_anyframe__(reader) 
 									# on met en bloquant avec attente infinie ? que se passe
 									# t'il dans ce cas si on veut killer le thread ?
 					self.debug("on recoit flag %d (size = %d)"%(flag, tab_size))
 					# ATTENTION, le retour ANS_TCP_TIMEOUT_SOCKET de la commande faite plus 
 					#    haut n'est pas traitée, mais ce n'est pas indispensable, mieux vaut
 					#    garder un code simple
-					self.data_socket.push_recv_buffer(flag, tab_size, data) # intègre le lock
+					self.data_socket.push_recv_buffer(flag, tab_size, data, _recv_ns=reader.frame_ns) # intègre le lock
 					
 			##########################
 			# gestion des exceptions #
 			##########################
 			# On ne remonte aucune exception par "raise" car on est dans un thread (il n'y a personne au dessus pour la rattraper)
 			# On utilise donc le mécanisme de transfert via self.data_socket.system_exception
-			except OSError as serr:
-				self.data_socket.system_exception = ap_socket_error(serr.errno, serr.strerror)
-				self.info ("%d : %s"%(serr.errno, serr.strerror))
-
-			except ap_socket_error as sexcept:
-				if sexcept.code == 21 :
-					self.info("socket closed by driver (probably due to inactivity)")
-					self.data_socket.system_exception = None # pas d'exception, c'est une situation normale
-					self.data_socket.is_open = False # on force la cloture de la data_socket (pour ne pas garder la main sur le driver)
-				else:
-					self.info("ap_socket_error \"%s\"-> reset"%sexcept.message)
-					# on transmet l'erreur à la prochaine fonction externe qui tente un acces à la socket :
-					self.data_socket.system_exception = sexcept
-
-			except: # jamais vu pour l'instant
-				self.data_socket.system_exception = ap_socket_error(132, "socket_recv_th : unexpected exception while receiving frame")
-				self.info("WARNING unexpected exception while receiving frame")
-				print (traceback.format_exc())
-
-			# si on n'arrive là c'est qu'il y a eu une exception pour nous faire sortir de la boucle while(1)
-			try:
-				self.data_socket.lock()
-				try:
-					self.data_socket.private_reset() # inclu un event_is_connected.clear()
-					# si il y a eu une exception et que la data_socket n'est pas active, on force la déconnexion (pour ne pas garder la main sur le driver)
-					if self.data_socket.system_exception and not self.data_socket._is_active() :
-						self.info("closing because of exception while socket is inactive")
-						self.data_socket.is_open = False
-				finally:
-					self.data_socket.unlock()
-			except:
-				self.info("WARNING unexpected exception")
-				print (traceback.format_exc())
+			except BaseException as exc:
+				# si on n'arrive là c'est qu'il y a eu une exception pour nous faire sortir de la boucle while(1)
+				self.data_socket.private_recv_failure(exc)
 
 			if self.data_socket.is_open:
 				self.info("try to reconnect")
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# -*- coding: UTF_8 -*-
+# @copyright  this code is the property of Ubertone.
+# You may use this code for your personal, informational, non-commercial purpose.
+# You may not distribute, transmit, display, reproduce, publish, license, create derivative works from, transfer or sell any information, software, products or services based on this code.
+# @author Stéphane Fischer
+
+## @package ap_stats_exporter
+#\brief Export périodique des compteurs des data_sockets (ApDataSocket.stats)
+#
+# Un thread relève régulièrement les compteurs d'une ou plusieurs data_sockets
+# et les écrit dans un fichier, remplacé de manière atomique (fichier
+# temporaire puis os.replace) :
+# - EXPORT_PROMETHEUS : format texte de Prometheus (à lire par le textfile
+#   collector de node_exporter), une série par data_socket (label socket) et
+#   par flag (label flag)
+# - EXPORT_JSON : la liste des dictionnaires retournés par stats(), complétés
+#   des débits (throughput) depuis l'export précédent
+#
+# stats() retourne des compteurs cumulés et la date du relevé : chaque lecteur
+# (cet exporter, un autre thread de supervision ...) calcule ses débits à
+# partir de son propre relevé précédent (stats_throughput). Prometheus calcule
+# les débits lui-même (rate()), ils ne sont pas exportés.
+#
+#   exporter = ApStatsExporter([socket], "/var/lib/node_exporter/ub_data_socket.prom")
+#   exporter.start()
+#   ...
+#   exporter.stop()
+
+import json
+import os
+from threading import Event, Thread
+import traceback
+
+from ub_lib_v1.ub_class_template import UbClassTemplate, txt_regular_purple
+
+EXPORT_PROMETHEUS = "prometheus"
+EXPORT_JSON = "json"
+EXPORT_FORMATS = (EXPORT_PROMETHEUS, EXPORT_JSON)
+
+# (nom, type, description) des métriques Prometheus
+_prometheus_metrics = (
+	("ub_data_socket_connected", "gauge", "1 if the data socket is connected to the driver"),
+	("ub_data_socket_recv_frames_total", "counter", "frames received"),
+	("ub_data_socket_recv_bytes_total", "counter", "payload bytes received"),
+	("ub_data_socket_send_frames_total", "counter", "frames sent"),
+	("ub_data_socket_send_bytes_total", "counter", "payload bytes sent"),
+	("ub_data_socket_lost_frames_total", "counter", "unexpected frames lost (selective mode)"),
+	("ub_data_socket_dropped_frames_total", "counter", "frames dropped by the recv_buffer limits"),
+	("ub_data_socket_recv_buffer_frames", "gauge", "frames waiting in recv_buffer"),
+	("ub_data_socket_recv_buffer_bytes", "gauge", "bytes waiting in recv_buffer"),
+	("ub_data_socket_wait_buffer_events", "gauge", "events waiting for a frame"),
+	("ub_data_socket_reconnects_total", "counter", "reconnections to the driver"),
+	("ub_data_socket_lock_contended_total", "counter", "waits on the data socket lock"),
+	("ub_data_socket_lock_wait_seconds_total", "counter", "time spent waiting on the data socket lock"),
+)
+
+
+## \brief mise en forme Prometheus (format texte) des compteurs de plusieurs data_sockets
+# @param _stats liste des dictionnaires retournés par ApDataSocket.stats()
+def stats_to_prometheus(_stats):
+	samples = dict((name, []) for name, kind, help in _prometheus_metrics)
+	for stats in _stats:
+		label = 'socket="%s:%s"'%(stats["host"], stats["port"])
+		samples["ub_data_socket_connected"].append((label, int(stats["connected"])))
+		for direction in ("recv", "send"):
+			for flag, counter in sorted(stats[direction]["by_flag"].items()):
+				flag_label = '%s,flag="%d"'%(label, flag)
+				samples["ub_data_socket_%s_frames_total"%direction].append((flag_label, counter["frames"]))
+				samples["ub_data_socket_%s_bytes_total"%direction].append((flag_label, counter["bytes"]))
+		for flag, counter in sorted(stats["lost"]["by_flag"].items()):
+			samples["ub_data_socket_lost_frames_total"].append(('%s,flag="%d"'%(label, flag), counter["frames"]))
+		for flag, frames in sorted(stats["dropped"]["by_flag"].items()):
+			samples["ub_data_socket_dropped_frames_total"].append(('%s,flag="%d"'%(label, flag), frames))
+		samples["ub_data_socket_recv_buffer_frames"].append((label, stats["recv_buffer"]["frames"]))
+		samples["ub_data_socket_recv_buffer_bytes"].append((label, stats["recv_buffer"]["bytes"]))
+		samples["ub_data_socket_wait_buffer_events"].append((label, stats["wait_buffer"]))
+		samples["ub_data_socket_reconnects_total"].append((label, stats["reconnect_count"]))
+		samples["ub_data_socket_lock_contended_total"].append((label, stats["lock"]["contended"]))
+		samples["ub_data_socket_lock_wait_seconds_total"].append((label, stats["lock"]["wait_s"]))
+
+	lines = []
+	for name, kind, help in _prometheus_metrics:
+		lines.append("# HELP %s %s"%(name, help))
+		lines.append("# TYPE %s %s"%(name, kind))
+		for label, value in samples[name]:
+			lines.append("%s{%s} %s"%(name, label, repr(value)))
+	return "\n".join(lines) + "\n"
+
+
+## \brief débits entre deux relevés d'une même data_socket
+# @param _previous relevé précédent (ApDataSocket.stats()), None : aucun
+# @param _current relevé courant
+# @return dictionnaire interval_s, recv/send_bytes_per_s, recv/send_frames_per_s,
+#         None sans relevé précédent
+def stats_throughput(_previous, _current):
+	if _previous is None:
+		return None
+	interval = max(_current["time_s"] - _previous["time_s"], 1e-9)
+	throughput = {"interval_s": interval}
+	for direction in ("recv", "send"):
+		for unit in ("bytes", "frames"):
+			throughput["%s_%s_per_s"%(direction, unit)] = (_current[direction][unit] - _previous[direction][unit])/interval
+	return throughput
+
+
+## \brief mise en forme JSON des compteurs de plusieurs data_sockets
+def stats_to_json(_stats):
+	# les clés des dictionnaires by_flag (flags) deviennent des chaines
+	return json.dumps(_stats, indent=1, sort_keys=True)
+
+
+class ApStatsExporter(Thread, UbClassTemplate):
+	## \brief Constructeur
+	# @param _sockets liste des ApDataSocket à exporter
+	# @param _path fichier écrit à chaque période
+	# @param _period période d'export (s)
+	# @param _format EXPORT_PROMETHEUS ou EXPORT_JSON
+	def __init__(self, _sockets, _path, _period=10., _format=EXPORT_PROMETHEUS):
+		UbClassTemplate.__init__(self)
+		Thread.__init__(self)
+		if _format not in EXPORT_FORMATS:
+			raise ValueError("unknown export format %s"%str(_format))
+		self.flag_debug_mess=False
+		self.debug_marker_start=txt_regular_purple
+		self.daemon = True
+		self.name = "ApStatsExporter"
+
+		self.sockets = list(_sockets)
+		self.path = _path
+		self.period = _period
+		self.format = _format
+		self.stopped = Event()
+		# relevés de l'export précédent (débits), un par data_socket
+		self.previous = [None]*len(self.sockets)
+
+	## \brief relève les compteurs et écrit le fichier
+	def export(self):
+		stats = [socket.stats() for socket in self.sockets]
+		if self.format == EXPORT_PROMETHEUS:
+			text = stats_to_prometheus(stats)
+		else:
+			exported = [dict(current, throughput=stats_throughput(previous, current)) for previous, current in zip(self.previous, stats)]
+			text = stats_to_json(exported)
+		self.previous = stats
+		tmp_path = self.path + ".tmp"
+		with open(tmp_path, "w") as tmp_file:
+			tmp_file.write(text)
+		os.replace(tmp_path, self.path) # le lecteur ne voit jamais un fichier incomplet
+
+	def stop(self):
+		self.stopped.set()
+		if self.is_alive():
+			self.join()
+
+	def run(self):
+		while not self.stopped.wait(self.period):
+			try:
+				self.export()
+			except Exception:
+				self.info("WARNING fail to export stats to %s"%self.path)
+				print (traceback.format_exc())
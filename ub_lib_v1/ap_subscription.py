@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: UTF_8 -*-
+# @copyright  this code is the property of Ubertone.
+# You may use this code for your personal, informational, non-commercial purpose.
+# You may not distribute, transmit, display, reproduce, publish, license, create derivative works from, transfer or sell any information, software, products or services based on this code.
+# @author Stéphane Fischer
+
+## @package ap_subscription
+#\brief Abonnement d'un callback aux trames d'un flag (cf. ApDataSocket.subscribe)
+#
+# Avec un executor, la file de concurrent.futures n'est pas bornée : si les
+# callbacks sont plus lents que le débit des trames, les trames s'y accumulent
+# sans limite. Chaque abonnement borne donc le nombre de trames soumises à
+# l'executor et pas encore traitées (max_pending, un BoundedSemaphore libéré à
+# la fin de chaque callback). Lorsque la limite est atteinte :
+# - FRAME_STORE_DROP_NEWEST : la nouvelle trame n'est pas remise à ce callback
+# - FRAME_STORE_BLOCK : la réception attend qu'un callback se termine (la
+#   socket n'est plus lue : le driver est ralenti par le contrôle de flux TCP)
+# Les trames rejetées sont comptées (dropped_*), comme dans ApFrameStore.
+# Sans executor, le callback est appelé directement par la réception : il n'y
+# a pas de file, donc pas de limite.
+
+from threading import BoundedSemaphore
+
+from ub_lib_v1.ap_frame_store import FRAME_STORE_DROP_NEWEST, FRAME_STORE_BLOCK
+
+# nombre maximum par défaut de trames en attente dans l'executor, par abonnement
+SUBSCRIPTION_MAX_PENDING = 256
+SUBSCRIPTION_POLICIES = (FRAME_STORE_DROP_NEWEST, FRAME_STORE_BLOCK)
+
+
+class ApSubscription:
+	## \brief Constructeur
+	# @param _callback fonction appelée avec (flag, size, data) pour chaque trame
+	# @param _executor concurrent.futures.Executor exécutant le callback (None : appel direct)
+	# @param _max_pending nombre maximum de trames soumises à l'executor et pas encore traitées
+	# @param _policy FRAME_STORE_DROP_NEWEST ou FRAME_STORE_BLOCK
+	# @param _wakeup fonction appelée quand une place se libère alors que la réception
+	#        attendait (InstrumentHub.wakeup), None si la réception attend sur le sémaphore
+	def __init__(self, _callback, _executor=None, _max_pending=SUBSCRIPTION_MAX_PENDING, _policy=FRAME_STORE_DROP_NEWEST, _wakeup=None):
+		self.callback = _callback
+		self.executor = _executor
+		self.max_pending = _max_pending
+		self.policy = _policy
+		self.wakeup = _wakeup
+		self.slots = BoundedSemaphore(_max_pending) if _executor is not None else None
+		self.blocked = False # la réception attend une place
+
+		# trames rejetées à cause de max_pending
+		self.dropped_frames = 0
+		self.dropped_bytes = 0
+
+	## \brief réserve une place pour une trame, sans attendre
+	# @return True si la trame peut être soumise
+	def reserve(self):
+		return self.slots is None or self.slots.acquire(False)
+
+	## \brief attend une place pour une trame (politique FRAME_STORE_BLOCK)
+	# @return True si la place est réservée, False à l'expiration de _timeout
+	def wait(self, _timeout):
+		self.blocked = True
+		if not self.slots.acquire(True, _timeout):
+			return False
+		self.blocked = False
+		return True
+
+	## \brief compte une trame rejetée
+	def drop(self, _size):
+		self.dropped_frames += 1
+		self.dropped_bytes += _size
+
+	## \brief libère une place réservée (fin du callback ou trame non soumise)
+	def release(self, _future=None):
+		if self.slots is None:
+			return
+		self.slots.release()
+		if self.blocked:
+			self.blocked = False
+			if self.wakeup is not None:
+				self.wakeup()
+
+	## \brief remet une trame au callback (la place doit avoir été réservée)
+	def dispatch(self, _flag, _size, _data):
+		if self.executor is None:
+			self.callback(_flag, _size, _data)
+			return
+		try:
+			future = self.executor.submit(self.callback, _flag, _size, _data)
+		except:
+			self.release()
+			raise
+		future.add_done_callback(self.release)
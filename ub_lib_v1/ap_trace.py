@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: UTF_8 -*-
+# @copyright  this code is the property of Ubertone.
+# You may use this code for your personal, informational, non-commercial purpose.
+# You may not distribute, transmit, display, reproduce, publish, license, create derivative works from, transfer or sell any information, software, products or services based on this code.
+# @author Stéphane Fischer
+
+## @package ap_trace
+#\brief Traces de latence des requêtes de la data_socket (cf. ApDataSocket.enable_trace)
+#
+# Chaque requête (send_recv_frame, recv_frame) tracée reçoit un emplacement d'un
+# buffer circulaire préalloué, où sont notées les dates (time.monotonic_ns) :
+# - TRACE_SEND : émission de la commande (enregistrement de l'évenement pour recv_frame)
+# - TRACE_HEADER : réception du premier octet de la trame de réponse
+# - TRACE_COMPLETE : réception complète de la trame
+# - TRACE_DISPATCH : remise de la trame à l'évenement (push_recv_buffer)
+# - TRACE_WAKE : réveil du thread demandeur
+# Les écarts entre ces dates séparent le temps de traitement du driver et du
+# réseau, le transfert de la réponse, le thread de réception et l'attente du
+# lock, et le réveil du demandeur.
+# Les traces s'exportent au format JSON de Chrome / Perfetto (chrome://tracing,
+# ui.perfetto.dev).
+#
+#   socket.enable_trace()
+#   ...
+#   socket.trace.export_chrome_trace("trace.json")
+
+import itertools
+import json
+import os
+from threading import get_ident
+
+# champs d'un emplacement
+TRACE_SEQ = 0 # numéro de la requête (0 : emplacement libre)
+TRACE_CALLER = 1 # "send_recv_frame" ou "recv_frame"
+TRACE_FLAG_SEND = 2
+TRACE_FLAG_RECV = 3
+TRACE_THREAD = 4 # identifiant du thread demandeur
+TRACE_SEND = 5
+TRACE_HEADER = 6
+TRACE_COMPLETE = 7
+TRACE_DISPATCH = 8
+TRACE_WAKE = 9
+_TRACE_FIELDS = 10
+
+# étapes exportées : (nom, date de début, date de fin)
+_trace_phases = (
+	("driver+network", TRACE_SEND, TRACE_HEADER),
+	("answer transfer", TRACE_HEADER, TRACE_COMPLETE),
+	("receive thread", TRACE_COMPLETE, TRACE_DISPATCH),
+	("consumer wake-up", TRACE_DISPATCH, TRACE_WAKE),
+)
+
+
+## \brief note une date, sauf si l'emplacement a été réutilisé entre temps
+# @param _trace (emplacement, numéro) retourné par ApTraceBuffer.begin
+def trace_mark(_trace, _field, _date_ns):
+	slot, seq = _trace
+	if slot[TRACE_SEQ] == seq:
+		slot[_field] = _date_ns
+
+
+class ApTraceBuffer:
+	## \brief Constructeur
+	# @param _capacity nombre de requêtes conservées (les plus anciennes sont écrasées)
+	def __init__(self, _capacity=4096):
+		self.capacity = _capacity
+		self.slots = [[0]*_TRACE_FIELDS for _ in range(_capacity)]
+		self.counter = itertools.count(1) # next() est atomique (GIL) : pas de lock
+
+	## \brief réserve un emplacement pour une requête
+	# @param _send_ns date d'émission (0 : notée ensuite par trace_mark)
+	# @return (emplacement, numéro), à passer à trace_mark
+	def begin(self, _caller, _flag_send, _flag_recv, _send_ns=0):
+		seq = next(self.counter)
+		slot = self.slots[seq % self.capacity]
+		slot[TRACE_SEQ] = 0 # invalide pendant la réinitialisation
+		slot[TRACE_CALLER] = _caller
+		slot[TRACE_FLAG_SEND] = _flag_send
+		slot[TRACE_FLAG_RECV] = _flag_recv
+		slot[TRACE_THREAD] = get_ident()
+		slot[TRACE_SEND] = _send_ns
+		slot[TRACE_HEADER] = slot[TRACE_COMPLETE] = slot[TRACE_DISPATCH] = slot[TRACE_WAKE] = 0
+		slot[TRACE_SEQ] = seq
+		return slot, seq
+
+	## \brief les requêtes tracées, de la plus ancienne à la plus récente
+	# @return liste de copies des emplacements
+	def records(self):
+		return sorted((list(slot) for slot in self.slots if slot[TRACE_SEQ]), key=lambda slot: slot[TRACE_SEQ])
+
+	## \brief les traces au format Chrome / Perfetto (dictionnaire à sérialiser en JSON)
+	# une étape n'est exportée que si ses deux dates sont connues (timeout ...)
+	def to_chrome_trace(self):
+		pid = os.getpid()
+		events = []
+		for slot in self.records():
+			args = {"seq": slot[TRACE_SEQ], "flag_send": slot[TRACE_FLAG_SEND], "flag_recv": slot[TRACE_FLAG_RECV]}
+			end = slot[TRACE_WAKE] or slot[TRACE_DISPATCH]
+			if slot[TRACE_SEND] and end:
+				name = "%s %s>%s"%(slot[TRACE_CALLER], slot[TRACE_FLAG_SEND], slot[TRACE_FLAG_RECV])
+				events.append({"name": name, "cat": "request", "ph": "X", "pid": pid, "tid": slot[TRACE_THREAD],
+				               "ts": slot[TRACE_SEND]/1000., "dur": (end - slot[TRACE_SEND])/1000., "args": args})
+			for name, start, stop in _trace_phases:
+				if slot[start] and slot[stop]:
+					events.append({"name": name, "cat": "phase", "ph": "X", "pid": pid, "tid": slot[TRACE_THREAD],
+					               "ts": slot[start]/1000., "dur": (slot[stop] - slot[start])/1000., "args": args})
+		return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+	## \brief écrit les traces dans un fichier JSON (chrome://tracing, ui.perfetto.dev)
+	def export_chrome_trace(self, _path):
+		with open(_path, "w") as trace_file:
+			json.dump(self.to_chrome_trace(), trace_file)
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: UTF_8 -*-
+# @copyright  this code is the property of Ubertone.
+# You may use this code for your personal, informational, non-commercial purpose.
+# You may not distribute, transmit, display, reproduce, publish, license, create derivative works from, transfer or sell any information, software, products or services based on this code.
+# @author Stéphane Fischer
+
+## @package ap_waiter_registry
+#\brief Liste des évenements en attente d'un flag (wait_buffer de la data_socket)
+#
+# Les évenements sont indexés par flag. Pour chaque flag, un dictionnaire
+# conserve l'ordre d'enregistrement (le plus ancien est réveillé en premier) et
+# permet de retrouver un évenement sans parcours : l'enregistrement, le réveil
+# et la suppression (timeout) se font en temps constant.
+# Chaque évenement connait son flag (attribut flag).
+
+from ub_lib_v1.ap_exception import ap_socket_exception
+
+
+class ApWaiterRegistry:
+	## \brief Constructeur
+	# @param _unique (bool) : refuse un second évenement sur un flag déjà attendu (erreur 320)
+	def __init__(self, _unique=True):
+		self.unique = _unique
+		# flag -> {évenement: None} dans l'ordre d'enregistrement
+		self.by_flag = {}
+		self.count = 0
+
+	def __len__(self):
+		return self.count
+
+	def __contains__(self, _flag):
+		return _flag in self.by_flag
+
+	## \brief parcourt les évenements (flag, évenement) par flag puis par ancienneté
+	def __iter__(self):
+		return iter([(flag, event) for flag, events in self.by_flag.items() for event in events])
+
+	## \brief nombre d'évenements en attente d'un flag
+	def count_flag(self, _flag):
+		events = self.by_flag.get(_flag)
+		return len(events) if events is not None else 0
+
+	## \brief enregistre un évenement en attente de _event.flag
+	def add(self, _event):
+		events = self.by_flag.get(_event.flag)
+		if events is None:
+			events = self.by_flag[_event.flag] = {}
+		elif self.unique:
+			raise ap_socket_exception(320, "data_socket_c: flag %d twice !" % _event.flag)
+		events[_event] = None
+		self.count += 1
+
+	## \brief le plus ancien évenement en attente d'un flag, sans le retirer
+	# @return l'évenement ou None si le flag n'est pas attendu
+	def first(self, _flag):
+		events = self.by_flag.get(_flag)
+		return next(iter(events)) if events is not None else None
+
+	## \brief retire le plus ancien évenement en attente d'un flag
+	# @return l'évenement ou None si le flag n'est pas attendu
+	def pop(self, _flag):
+		events = self.by_flag.get(_flag)
+		if events is None:
+			return None
+		event = next(iter(events))
+		del events[event]
+		if not events:
+			del self.by_flag[_flag]
+		self.count -= 1
+		return event
+
+	## \brief retire un évenement (timeout)
+	# @return True si l'évenement était enregistré
+	def remove(self, _event):
+		events = self.by_flag.get(_event.flag)
+		if events is None or _event not in events:
+			return False
+		del events[_event]
+		if not events:
+			del self.by_flag[_event.flag]
+		self.count -= 1
+		return True
+
+	## \brief retire tous les évenements
+	# @return la liste des évenements retirés
+	def clear(self):
+		events = [event for flag, event in self]
+		self.by_flag = {}
+		self.count = 0
+		return events
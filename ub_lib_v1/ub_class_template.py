@@ -6,12 +6,21 @@
 # You may not distribute, transmit, display, reproduce, publish, license, create derivative works from, transfer or sell any information, software, products or services based on this code.
 # @author Jean Luc Bielmann, Stéphane Fischer
 
-import inspect
-import re
+# Les messages (debug, info ...) sont transmis à un backend (emit) :
+# - UbQueueLogBackend (défaut) : buffer circulaire vidé par un thread dédié,
+#   l'appelant n'attend jamais l'écriture
+# - UbStreamLogBackend : écriture synchrone (print + flush)
+# cf. set_log_backend. Un message d'un niveau inférieur à log_level, ou un debug
+# désactivé (flag_debug_mess), n'est ni mis en forme ni transmis.
+
+import atexit
+import os
 import sys
 
+from collections import deque
 from datetime import datetime
-from time import strftime, time
+from threading import Lock, Thread
+from time import sleep, strftime, time
 
 txt_regular_black ='\033[30m'
 txt_regular_red= '\033[31m'
@@ -23,6 +32,110 @@ txt_regular_cyan ='\033[36m'
 txt_regular_white ='\033[37m'
 txt_regular_reset = "\033[0m"
 
+# niveaux des messages (mêmes valeurs que le module logging)
+LOG_DEBUG = 10
+LOG_INFO = 20
+LOG_FATAL = 50
+LOG_OFF = 100
+
+
+## \brief mise en forme d'un message : (date, niveau, classe, méthode, appelant, message, début et fin de marqueur)
+def format_log_record(_record):
+	date, level, classname, method, parent, message, marker_start, marker_end = _record
+	d = datetime.fromtimestamp(date)
+	tic = strftime("%y/%m/%d %H:%M:%S.", d.timetuple()) + ("%06d" % d.microsecond)
+	if parent is None:
+		return "[%s] %s%s::%s:%s %s"% (tic, marker_start, classname, method, marker_end, message)
+	return "[%s] %s%s::%s:%s %s\n<< %s"% (tic, marker_start, classname, method, marker_end, message, parent)
+
+
+## \brief écriture synchrone des messages (print puis flush à chaque message)
+class UbStreamLogBackend:
+	def __init__(self, _stream=None):
+		self.stream = _stream # None : sys.stdout au moment de l'écriture
+
+	def emit(self, _record):
+		stream = self.stream or sys.stdout
+		stream.write(format_log_record(_record) + "\n")
+		stream.flush()
+
+	def flush(self):
+		pass
+
+
+## \brief écriture différée des messages par un thread dédié
+# emit ne fait qu'ajouter le message à un buffer circulaire (deque bornée, sans
+# lock ni attente) : la mise en forme de la date et l'écriture sont faites par
+# le thread, par lots, toutes les _period secondes. Si le buffer est plein, les
+# plus anciens messages sont perdus (comptés dans dropped)
+class UbQueueLogBackend(Thread):
+	def __init__(self, _stream=None, _capacity=65536, _period=0.05):
+		Thread.__init__(self)
+		self.daemon = True
+		self.name = "UbQueueLogBackend"
+		self.stream = _stream # None : sys.stdout au moment de l'écriture
+		self.capacity = _capacity
+		self.period = _period
+		self.ring = deque(maxlen=_capacity)
+		self.dropped = 0
+		self.write_lock = Lock()
+		self.start()
+		atexit.register(self.flush)
+
+	def emit(self, _record):
+		if len(self.ring) == self.capacity:
+			self.dropped += 1
+		self.ring.append(_record)
+
+	## \brief écrit les messages en attente (appelé par le thread et à la fin du programme)
+	def flush(self):
+		with self.write_lock:
+			lines = []
+			try:
+				while True:
+					lines.append(format_log_record(self.ring.popleft()) + "\n")
+			except IndexError:
+				pass
+			if lines:
+				stream = self.stream or sys.stdout
+				stream.write("".join(lines))
+				stream.flush()
+
+	def run(self):
+		while True:
+			sleep(self.period)
+			try:
+				self.flush()
+			except Exception: # stdout fermé ...
+				pass
+
+
+# code de l'appelant -> "fichier/fonction" (cf. log_caller)
+_caller_names = {}
+
+_default_backend = None
+_default_backend_lock = Lock()
+
+## \brief backend utilisé par UbClassTemplate (par défaut un UbQueueLogBackend, démarré au premier message)
+def get_log_backend():
+	global _default_backend
+	if UbClassTemplate.log_backend is not None:
+		return UbClassTemplate.log_backend
+	if _default_backend is None:
+		with _default_backend_lock:
+			if _default_backend is None:
+				_default_backend = UbQueueLogBackend()
+	return _default_backend
+
+## \brief change le backend des messages (ex. UbStreamLogBackend() pour une écriture synchrone)
+# les messages en attente dans le backend précédent sont écrits
+def set_log_backend(_backend):
+	previous = UbClassTemplate.log_backend or _default_backend
+	UbClassTemplate.log_backend = _backend
+	if previous is not None:
+		previous.flush()
+
+
 class UbClassTemplate:
 
 	debug_marker_start = txt_regular_reset
@@ -31,6 +144,13 @@ class UbClassTemplate:
 	global_debug_active = True
 	global_debug_force = False
 
+	# les messages de niveau inférieur ne sont pas traités (LOG_OFF : aucun message)
+	log_level = LOG_DEBUG
+	# True : ajoute l'appelant de la méthode (fichier/fonction) à chaque message
+	log_caller = False
+	# objet avec les méthodes emit(record) et flush(), None : get_log_backend()
+	log_backend = None
+
 	def __init__(self):
 		self.time_start = None
 		self.flag_debug_mess = False
@@ -46,21 +166,25 @@ class UbClassTemplate:
 		pass
 
 	def log (self, pattern_string, *string_args):
-		self.__print_log(pattern_string, string_args)
+		if UbClassTemplate.log_level <= LOG_INFO:
+			self.__print_log(LOG_INFO, pattern_string, string_args)
 
 	# \brief For internal messages which are not warnings or errors !
 	def debug (self, pattern_string, *string_args):
 		# on optimise avec le test pour éviter de traiter les chaines pour rien si le debug est desactivé
-		if UbClassTemplate.global_debug_active and ( UbClassTemplate.global_debug_force or self.flag_debug_mess ):
-			self.__print_log(pattern_string, string_args)
+		if UbClassTemplate.global_debug_active and ( UbClassTemplate.global_debug_force or self.flag_debug_mess ) \
+				and UbClassTemplate.log_level <= LOG_DEBUG:
+			self.__print_log(LOG_DEBUG, pattern_string, string_args)
 
 	# \brief Please always use this function for internal warnings and errors !
 	def info (self, pattern_string, *string_args):
-		self.__print_log(pattern_string, string_args)
+		if UbClassTemplate.log_level <= LOG_INFO:
+			self.__print_log(LOG_INFO, pattern_string, string_args)
 
 	def fatal (self, pattern_string, *string_args):
 		# TODO san : inform the watchdog
-		self.__print_log(pattern_string, string_args)
+		if UbClassTemplate.log_level <= LOG_FATAL:
+			self.__print_log(LOG_FATAL, pattern_string, string_args)
 		# TODO une fois que l'on a informé le watchdog, réactiver l'exit
 		# exit(-1)
 
@@ -72,22 +196,26 @@ class UbClassTemplate:
 		if delta >= _threshold:
 			self.log("%s - Total time: %.02fs" % (_message,delta))
 
-	def __print_log(self, pattern_string, string_args):
+	def __print_log(self, level, pattern_string, string_args):
 		# TODO on pourrait rajouter ici l'info sur le thread : thread.get_ident()
 		# TODO on pourrait ajouter un arg pour traceback
-		d = datetime.now()
-		tic = strftime("%y/%m/%d %H:%M:%S.", d.timetuple()) + ("%06d" % d.microsecond)
-		classname = self.__class__.__name__
-		stack = inspect.stack()
-		method = stack[2][3]
-		parent = ""
-		if len(stack)>3:
-			parent = re.sub(r'.py', r'', re.sub(r'.*/', r'', stack[3][1])) + "/" + stack[3][3]
+		# seule la frame de la méthode appelante est lue (inspect.stack() parcourt
+		# toute la pile et lit les fichiers sources), son appelant uniquement si log_caller
+		frame = sys._getframe(2)
+		method = frame.f_code.co_name
+		parent = None
+		if UbClassTemplate.log_caller:
+			parent = ""
+			if frame.f_back is not None:
+				code = frame.f_back.f_code
+				parent = _caller_names.get(code)
+				if parent is None:
+					parent = _caller_names[code] = os.path.splitext(os.path.basename(code.co_filename))[0] + "/" + code.co_name
 
 		output_message = self.__build_output_message( pattern_string, string_args )
 
-		print ("[%s] %s%s::%s:%s %s\n<< %s"% (tic, self.debug_marker_start, classname, method, self.debug_marker_end, output_message, parent) )
-		sys.stdout.flush()
+		# la date est mise en forme et le message écrit par le backend
+		get_log_backend().emit((time(), level, self.__class__.__name__, method, parent, output_message, self.debug_marker_start, self.debug_marker_end))
 
 	def __build_output_message(self, pattern_string, string_args):
 
@@ -7,13 +7,33 @@
 # code repris de Stream_analyse_v2.1 et apf02_handler_extract
 
 import array
+import sys
 from math import sqrt, floor
 
-from struct import unpack, calcsize, error as struct_error
+from struct import Struct, pack, unpack, calcsize, error as struct_error
 from datetime import datetime
+from threading import Lock
 
 from ub_lib_v1.ap_exception import ap_protocol_error
 
+try:
+	import numpy as np
+except ImportError: # NumPy est optionnel : PROFILE_DECODER_AUTO utilise alors PROFILE_DECODER_STDLIB
+	np = None
+
+# décodage des tableaux d'un profil (cf. data_profile_t), résultats identiques au bit près
+PROFILE_DECODER_PYTHON = "python" # boucle sur les cellules, champs array.array('f')
+PROFILE_DECODER_STDLIB = "stdlib" # memoryview sur le chunk, extraction en bloc, champs array.array('f')
+PROFILE_DECODER_NUMPY = "numpy" # vectorisé, champs numpy.ndarray float32 (NumPy requis)
+PROFILE_DECODER_AUTO = "auto" # PROFILE_DECODER_NUMPY si NumPy est installé, sinon PROFILE_DECODER_STDLIB
+PROFILE_DECODERS = (PROFILE_DECODER_PYTHON, PROFILE_DECODER_STDLIB, PROFILE_DECODER_NUMPY, PROFILE_DECODER_AUTO)
+
+# tableaux float32 décodés pour chaque cellule d'un profil
+PROFILE_FIELDS = ("velocity", "variance", "amplitude", "snr", "sat", "ny_jp", "sigma")
+
+# entête des chunks de profil : ref, size_data, size_raw, sec, n_sec
+_chunk_header = Struct('iIIii')
+
 
 def __unpackInt__ (self, _data):
 	""" @brief extract an integer from binary
@@ -28,8 +48,236 @@ def __unpackInt__ (self, _data):
 			raise ap_protocol_error (122, "unexpected chunk content")
 
 
+## \brief vérifie le décodeur demandé
+# @return le décodeur utilisé (PROFILE_DECODER_AUTO est remplacé)
+def resolve_profile_decoder(_decoder):
+	if _decoder not in PROFILE_DECODERS:
+		raise ValueError("unknown profile decoder %s"%str(_decoder))
+	if _decoder == PROFILE_DECODER_AUTO:
+		return PROFILE_DECODER_NUMPY if np is not None else PROFILE_DECODER_STDLIB
+	if _decoder == PROFILE_DECODER_NUMPY and np is None:
+		raise ImportError("NumPy is required by the %s profile decoder"%_decoder)
+	return _decoder
+
+
+## \brief lit et vérifie l'entête d'un chunk de profil
+# @return (ref_config, num_config, size_data, size_raw, sec, n_sec)
+def parse_chunk_header(_data):
+	ref, size_data, size_raw, sec, n_sec = _chunk_header.unpack_from(_data)
+	if size_data == 0 and size_raw ==0:
+		raise ap_protocol_error (120, "empty chunk")
+	# ref_config : la référence des settings (numéro unique)
+	# num_config : le numéro de la configuration utilisée (1 à 5)
+	num_config = ref&0x000000FF
+	if num_config < 1 or num_config > 16: #TODO utiliser const pour le max
+		raise ap_protocol_error (121, "unexpected number of configurations (%d)"%num_config)
+		# TODO ? raise IndexError ("configuration not available (%d / %d)"%(_config_meas_id, len(self.settings.config)))
+		# ou laisser à l'appelant : oui, plutot ça.
+	return (ref&0xFFFFFF00)>>8, num_config, size_data, size_raw, sec, n_sec
+
+## \brief remplace par NaN les variances négatives (NumPy, sur place)
+def _numpy_fix_variance(_variance):
+	# En effet il arrive que la variance soit négative avec l'option de filtrage des écho fixe
+	_variance[_variance < 0.] = np.nan
+	return _variance
+
+## \brief variance d'un profil (NumPy), les variances négatives sont remplacées par NaN
+# @param _offset position du tableau de variance dans le chunk
+# @param _n_cells nombre de cellules
+def _numpy_variance(_data, _offset, _n_cells):
+	return _numpy_fix_variance(np.frombuffer(_data, np.float32, _n_cells, _offset).copy())
+
+## \brief amplitude d'un profil (NumPy) à partir de la variance
+def _numpy_amplitude(_variance):
+	# la variance ne contient plus de valeur négative : sqrt retourne le même
+	# résultat (arrondi en float32) que math.sqrt
+	return np.sqrt(_variance)
+
+## \brief snr d'un profil (NumPy) à partir du facteur qualité (int32)
+def _numpy_snr(_quality):
+	# calcul en double comme math, puis arrondi en float32 comme array('f')
+	return ((_quality & 0xFF).astype(np.float64)*20.0/255.0 - 10.0).astype(np.float32)
+
+## \brief champ de 8 bits du facteur qualité (NumPy) : sat (8), ny_jp (16), sigma (24)
+def _numpy_quality_field(_quality, _shift):
+	return ((_quality >> _shift) & 0xFF).astype(np.float32)
+
+## \brief décodage vectorisé (NumPy) des tableaux d'un profil
+# @param _data chunk reçu (bytes, bytearray ou memoryview)
+# @param _offset position du tableau de vitesse dans le chunk
+# @param _tab_size taille en octets de chacun des trois tableaux (vitesse, variance, facteur qualité)
+# @return (velocity, variance, amplitude, snr, sat, ny_jp, sigma) en numpy.ndarray float32
+def decode_data_numpy(_data, _offset, _tab_size):
+	n_cells = _tab_size//4
+	velocity = np.frombuffer(_data, np.float32, n_cells, _offset).copy()
+	variance = _numpy_variance(_data, _offset+_tab_size, n_cells)
+	quality = np.frombuffer(_data, np.int32, n_cells, _offset+2*_tab_size)
+	return velocity, variance, _numpy_amplitude(variance), _numpy_snr(quality), \
+		_numpy_quality_field(quality, 8), _numpy_quality_field(quality, 16), _numpy_quality_field(quality, 24)
+
+## \brief données Doppler brutes (NumPy) vues sans copie dans le chunk
+# les échantillons sont entrelacés : pour chaque échantillon, I et Q de chaque volume
+# @param _offset position des données brutes dans le chunk
+# @return numpy.ndarray int16 de forme (n_ech, n_vol, 2) : [..., 0] = I, [..., 1] = Q
+# (en lecture seule si le chunk est de type bytes)
+def iq_view_numpy(_data, _offset, _n_ech, _n_vol):
+	count = _n_ech*_n_vol*2
+	if len(_data) - _offset < 2*count:
+		raise ap_protocol_error (123, "unexpected raw data size (%d bytes for n_ech=%d, n_vol=%d)"%(len(_data) - _offset, _n_ech, _n_vol))
+	return np.frombuffer(_data, np.int16, count, _offset).reshape(_n_ech, _n_vol, 2)
+
+
+## \brief positions des cellules (volumes, puis sous-volumes de chaque volume)
+# calculées en double puis arrondies en float32, comme avec array('f')
+# @return numpy.ndarray float32 si NumPy est installé, sinon array.array('f')
+def _compute_positions(_origin, _interval_vol, _n_vol, _interval_subvol, _n_subvol, _scale=1.):
+	if np is not None:
+		positions = _origin + _interval_vol*np.arange(_n_vol, dtype=np.float64)[:, None] \
+			+ _interval_subvol*np.arange(_n_subvol, dtype=np.float64)[None, :]
+		return (positions*_scale).astype(np.float32).ravel()
+	return array.array('f', [(_origin + _interval_vol*i + _interval_subvol*j)*_scale for i in range(_n_vol) for j in range(_n_subvol)])
+
+# positions des cellules partagées par les profils :
+# (ref des settings, n° de configuration) -> (paramètres du calcul, positions)
+# une seule entrée par configuration : des settings différents sous la même ref
+# ou une autre célérité remplacent l'entrée. Le nombre de configurations
+# conservées est borné (les plus anciennes sont oubliées)
+_position_cache = {}
+_position_cache_lock = Lock()
+POSITION_CACHE_SIZE = 64
+
+## \brief positions (m) des cellules d'une configuration, calculées une seule fois
+# le tableau retourné est partagé par tous les profils de la configuration : il
+# est en lecture seule (numpy.ndarray non modifiable, ou memoryview sans NumPy)
+# @param _ref référence des settings (data_profile_t.ref)
+# @param _config_id numéro de la configuration (data_profile_t.num_config)
+# @param _settings dictionnaire retourné par ub_settings.read_settings
+# @param _sound_speed célérité réelle (m/s), si elle diffère de celle des settings
+# (les distances des settings correspondent à des durées calculées avec sound_speed)
+def cell_positions(_ref, _config_id, _settings, _sound_speed=None):
+	config = _settings['config%d'%_config_id]
+	# l'entrée n'est valide que pour les mêmes settings et la même célérité
+	params = (config['r_vol1'], config['r_dvol'], config['n_vol'], config['r_dsubvol'], config['n_subvol'],
+		_settings['sound_speed'], _sound_speed)
+	key = (_ref, _config_id)
+	entry = _position_cache.get(key)
+	if entry is not None and entry[0] == params:
+		return entry[1]
+
+	r_dsubvol = config['r_dsubvol']
+	if r_dsubvol is None and config['n_subvol'] == 1:
+		r_dsubvol = 0.
+	if config['r_vol1'] is None or config['r_dvol'] is None or r_dsubvol is None:
+		raise ValueError("cell positions are not defined in the settings of config %d"%_config_id)
+	scale = 1.
+	if _sound_speed is not None and _settings['sound_speed']:
+		scale = _sound_speed/_settings['sound_speed']
+	positions = _compute_positions(config['r_vol1'], config['r_dvol'], config['n_vol'], r_dsubvol, config['n_subvol'], scale)
+	if np is not None:
+		positions.setflags(write=False)
+	else:
+		positions = memoryview(positions).toreadonly()
+	with _position_cache_lock:
+		entry = _position_cache.get(key)
+		# un seul tableau est conservé si deux threads le calculent en même temps
+		if entry is not None and entry[0] == params:
+			return entry[1]
+		_position_cache.pop(key, None)
+		while len(_position_cache) >= POSITION_CACHE_SIZE:
+			del _position_cache[next(iter(_position_cache))]
+		_position_cache[key] = (params, positions)
+	return positions
+
+## \brief oublie les positions calculées (ex. après l'envoi de nouveaux settings)
+def clear_position_cache():
+	with _position_cache_lock:
+		_position_cache.clear()
+
+
+# position de chaque champ de 8 bits dans les octets d'un facteur qualité (int32 natif)
+# et de l'octet portant le bit de signe d'un float32 natif
+if sys.byteorder == "little":
+	_quality_byte = {0: 0, 8: 1, 16: 2, 24: 3}
+	_sign_byte = 3
+else:
+	_quality_byte = {0: 3, 8: 2, 16: 1, 24: 0}
+	_sign_byte = 0
+# float32 (octets natifs) de chaque valeur possible d'un octet du facteur qualité :
+# snr pour l'octet de poids faible, la valeur de l'octet pour sat, ny_jp et sigma
+_snr_bytes = [pack('f', (float(i)*20.0/255.0) -10.0) for i in range(256)]
+_byte_value_bytes = [pack('f', float(i)) for i in range(256)]
+# 1 pour les octets dont le bit de signe est levé
+_sign_table = bytes(i >> 7 for i in range(256))
+
+## \brief tableau float32 lu dans le chunk (stdlib, une seule copie)
+# @param _view memoryview sur les octets du tableau
+def _stdlib_float_array(_view):
+	values = array.array('f')
+	values.frombytes(_view)
+	return values
+
+## \brief variance d'un profil (stdlib), les variances négatives sont remplacées par NaN
+def _stdlib_variance(_view):
+	variance = _stdlib_float_array(_view)
+	# En effet il arrive que la variance soit négative avec l'option de filtrage des écho fixe
+	# seules les cellules dont le bit de signe est levé sont parcourues (-0. et -NaN sont conservés)
+	signs = _view[_sign_byte::4].tobytes().translate(_sign_table)
+	i = signs.find(1)
+	while i >= 0:
+		if variance[i] < 0.:
+			variance[i] = float('NaN')
+		i = signs.find(1, i+1)
+	return variance
+
+## \brief amplitude d'un profil (stdlib) à partir de la variance
+def _stdlib_amplitude(_variance):
+	return array.array('f', map(sqrt, _variance))
+
+## \brief snr d'un profil (stdlib) à partir des octets du facteur qualité
+# @param _view memoryview sur les octets du tableau de facteurs qualité
+def _stdlib_snr(_view):
+	return _stdlib_byte_table_array(_view[_quality_byte[0]::4], _snr_bytes)
+
+## \brief champ de 8 bits du facteur qualité (stdlib) : sat (8), ny_jp (16), sigma (24)
+# le champ est un octet du facteur qualité : extrait par une vue avec un pas de 4 octets
+def _stdlib_quality_field(_view, _shift):
+	return _stdlib_byte_table_array(_view[_quality_byte[_shift]::4], _byte_value_bytes)
+
+## \brief tableau float32 des valeurs tabulées de chaque octet d'une vue
+# @param _table float32 (octets natifs) de chacune des 256 valeurs
+def _stdlib_byte_table_array(_view, _table):
+	values = array.array('f')
+	values.frombytes(b''.join([_table[byte] for byte in _view.tobytes()]))
+	return values
+
+## \brief décodage des tableaux d'un profil avec la bibliothèque standard
+# mêmes paramètres que decode_data_numpy
+# @return (velocity, variance, amplitude, snr, sat, ny_jp, sigma) en array.array('f')
+def decode_data_stdlib(_data, _offset, _tab_size):
+	view = memoryview(_data)
+	quality = view[_offset+2*_tab_size:_offset+3*_tab_size]
+	variance = _stdlib_variance(view[_offset+_tab_size:_offset+2*_tab_size])
+	return _stdlib_float_array(view[_offset:_offset+_tab_size]), variance, _stdlib_amplitude(variance), _stdlib_snr(quality), \
+		_stdlib_quality_field(quality, 8), _stdlib_quality_field(quality, 16), _stdlib_quality_field(quality, 24)
+
+## \brief données Doppler brutes (stdlib) : listes des array('f') I et Q de chaque volume
+# comme data_profile_t.set_doppler_from_binary, sans copie intermédiaire
+def doppler_stdlib(_data, _offset, _n_ech, _n_vol):
+	view = memoryview(_data)[_offset:]
+	IQ = view[:len(view)//2*2].cast('h')
+	step = 2*_n_vol
+	return [array.array('f', IQ[2*i::step]) for i in range(_n_vol)], [array.array('f', IQ[2*i+1::step]) for i in range(_n_vol)]
+
+
 class data_profile_t:
-	def __init__(self, _config, _ref=0):
+	## \brief Constructeur
+	# @param _config dictionnaire de la configuration (n_vol, n_subvol, n_ech)
+	# @param _decoder un des PROFILE_DECODERS
+	# @param _settings dictionnaire des settings (ub_settings.read_settings) : position
+	# devient le tableau partagé de cell_positions
+	def __init__(self, _config, _ref=0, _decoder=PROFILE_DECODER_STDLIB, _settings=None):
+		self.decoder = resolve_profile_decoder(_decoder)
+		self.settings = _settings
 		self.t = 0.
 		self.ref = _ref
 		
@@ -47,13 +295,13 @@ class data_profile_t:
 
 		self.I = list()
 		self.Q = list()
+		# décodeur NumPy : données brutes (n_ech, n_vol, 2) int16 vues dans le chunk (cf. iq_view_numpy)
+		self.iq = None
 
-	# Not used
+	# Not used (cf. cell_positions)
 	def set_position_data(self, _origin=0., _interval_vol=0., _n_vol=0, _interval_subvol=0., _n_subvol=1):
 		self.n_vol_total = _n_vol*_n_subvol
-		for i in range(_n_vol):
-			for j in range(_n_subvol) :
-				self.position.append(_origin + _interval_vol*i + _interval_subvol*j)
+		self.position = _compute_positions(_origin, _interval_vol, _n_vol, _interval_subvol, _n_subvol)
 	
 	# données sous forme de donnée brute (binaire = 'string') ou array.
 	def set_data_from_binary(self, velocity=[], amplitude=[], facteur_qualite=[]):
@@ -81,6 +329,22 @@ class data_profile_t:
 		for i in range(self.n_vol_total) :
 			self.I.append(array.array('f',IQ[(2*i)::(2*self.n_vol_total)]))
 			self.Q.append(array.array('f',IQ[(2*i)+1::(2*self.n_vol_total)]))
+
+	## \brief données Doppler brutes sans copie (décodeur NumPy)
+	# I et Q deviennent des vues int16 de forme (n_vol, n_ech) sur le chunk :
+	# I[volume][échantillon] comme avec set_doppler_from_binary
+	def set_doppler_view(self, _data, _offset, n_ech=0, n_vol=0):
+		self.n_ech = n_ech
+		if self.n_vol_total == 0:
+			self.n_vol_total = n_vol
+		self.iq = iq_view_numpy(_data, _offset, self.n_ech, self.n_vol_total)
+		self.I = self.iq[:, :, 0].T
+		self.Q = self.iq[:, :, 1].T
+
+	## \brief données Doppler brutes converties en flottants (copie), décodeur NumPy
+	# @return numpy.ndarray de forme (n_ech, n_vol, 2)
+	def iq_float(self, _dtype=None):
+		return self.iq.astype(_dtype or np.float32)
 	
 	# \brief Utilise une frame pour récupérer un profil voulu (pour fichier binaires en v2)
 	# @param _flag (int) : l'entier permettant de savoir de quel type est la commande
@@ -88,27 +352,27 @@ class data_profile_t:
 	# @param _data : le bloc de données binaire
 	def interpret_chunk (self, data) : 
 #		print "reading profile for version UDT002"
-		head_size = calcsize('iIIii')
-		ref, size_data, size_raw, sec, n_sec =  unpack('iIIii', data[0:head_size])
+		self.ref, self.num_config, size_data, size_raw, sec, n_sec = parse_chunk_header(data)
 		#print "sec = %d ; n_sec=%d"%(sec, n_sec)
-
-		if size_data == 0 and size_raw ==0:
-			raise ap_protocol_error (120, "empty chunk")
-		# ref_config : la référence des settings (numéro unique)
-		self.ref = (ref&0xFFFFFF00)>>8
-		# num_config : le numéro de la configuration utilisée (1 à 5)
-		self.num_config = ref&0x000000FF
-		if self.num_config < 1 or self.num_config > 16: #TODO utiliser const pour le max
-			raise ap_protocol_error (121, "unexpected number of configurations (%d)"%self.num_config)
-			# TODO ? raise IndexError ("configuration not available (%d / %d)"%(_config_meas_id, len(self.settings.config)))
-			# ou laisser à l'appelant : oui, plutot ça.
 		self.t = sec+n_sec*1e-9
+		if self.settings is not None:
+			self.position = cell_positions(self.ref, self.num_config, self.settings)
 		
-		if size_data:
+		offset = _chunk_header.size
+		if size_data and self.decoder == PROFILE_DECODER_NUMPY:
+			tab_size = int(size_data/3)
+			self.velocity, self.variance, self.amplitude, self.snr, self.sat, self.ny_jp, self.sigma = \
+				decode_data_numpy(data, offset, tab_size)
+			offset+= 3*tab_size
+		elif size_data and self.decoder == PROFILE_DECODER_STDLIB:
+			tab_size = int(size_data/3)
+			self.velocity, self.variance, self.amplitude, self.snr, self.sat, self.ny_jp, self.sigma = \
+				decode_data_stdlib(data, offset, tab_size)
+			offset+= 3*tab_size
+		elif size_data:
 			#print ("size_data = %d"%size_data)
 			# floating + integer arrays
 			tab_size = int(size_data/3)
-			offset = head_size
 			velocity_tmp = array.array('f', data[offset : offset+tab_size])
 			offset+= tab_size
 			variance_tmp = array.array('f', data[offset : offset+tab_size])
@@ -121,6 +385,219 @@ class data_profile_t:
 
 		if size_raw and self.n_ech :
 				print ("read doppler data (n_ech = %d)"%(self.n_ech))
-				self.set_doppler_from_binary(data[offset:], self.n_ech, self.n_vol_total)
+				if self.decoder == PROFILE_DECODER_NUMPY:
+					self.set_doppler_view(data, offset, self.n_ech, self.n_vol_total)
+				elif self.decoder == PROFILE_DECODER_STDLIB:
+					self.I, self.Q = doppler_stdlib(data, offset, self.n_ech, self.n_vol_total)
+				else:
+					self.set_doppler_from_binary(data[offset:], self.n_ech, self.n_vol_total)
 		
 
+
+
+## \brief profils d'une même configuration décodés en tableaux 2-D (NumPy requis)
+# chaque champ de PROFILE_FIELDS est un numpy.ndarray float32 de forme
+# (n_profiles, n_cells), identique ligne par ligne au décodeur NumPy de
+# data_profile_t. Les dates sont des entiers int64 en nanosecondes (t_ns).
+# Les données Doppler brutes des chunks ne sont pas conservées.
+#
+#   batch = ProfileBatch(config, chunks)
+#   batch.append(chunk) # la capacité double lorsqu'elle est atteinte
+#   batch.amplitude.mean(axis=0)
+#
+# Les attributs (velocity, ..., t_ns) sont des vues sur les profils décodés :
+# elles sont remplacées après chaque ajout (append, extend), ne pas les conserver
+# pendant un ajout.
+class ProfileBatch:
+	## \brief Constructeur
+	# @param _config dictionnaire de la configuration (n_vol, n_subvol)
+	# @param _chunks chunks de profil décodés à la création (une seule allocation par champ)
+	# @param _capacity nombre de profils préalloués
+	def __init__(self, _config, _chunks=(), _capacity=0):
+		if np is None:
+			raise ImportError("NumPy is required by ProfileBatch")
+		self.n_cells = _config['n_vol']*_config['n_subvol']
+		self.size = 0
+		self.capacity = 0
+		self.buffers = {}
+		self.reserve(max(_capacity, len(_chunks)))
+		self.extend(_chunks)
+
+	def __len__(self):
+		return self.size
+
+	## \brief préalloue la place de _capacity profils
+	def reserve(self, _capacity):
+		if _capacity <= self.capacity and self.buffers:
+			return
+		capacity = max(_capacity, self.capacity)
+		buffers = dict((field, np.empty((capacity, self.n_cells), np.float32)) for field in PROFILE_FIELDS)
+		buffers["t_ns"] = np.empty(capacity, np.int64)
+		buffers["ref"] = np.empty(capacity, np.int32)
+		buffers["num_config"] = np.empty(capacity, np.int32)
+		for name, buffer in self.buffers.items():
+			buffers[name][:self.size] = buffer[:self.size]
+		self.buffers = buffers
+		self.capacity = capacity
+		self.__update_views()
+
+	def __update_views(self):
+		for name, buffer in self.buffers.items():
+			setattr(self, name, buffer[:self.size])
+
+	## \brief ajoute un profil
+	def append(self, _chunk):
+		self.extend((_chunk,))
+
+	## \brief ajoute des profils, la capacité est au moins doublée si elle est dépassée
+	def extend(self, _chunks):
+		size = self.size + len(_chunks)
+		if size > self.capacity:
+			self.reserve(max(size, 2*self.capacity))
+		if not _chunks:
+			return
+
+		buffers = self.buffers
+		tab_size = 4*self.n_cells
+		quality = np.empty((len(_chunks), self.n_cells), np.int32)
+		offset = _chunk_header.size
+		for row, chunk in enumerate(_chunks, self.size):
+			ref, num_config, size_data, size_raw, sec, n_sec = parse_chunk_header(chunk)
+			if size_data != 3*tab_size:
+				raise ap_protocol_error (124, "unexpected profile size (%d bytes for %d cells)"%(size_data, self.n_cells))
+			buffers["ref"][row] = ref
+			buffers["num_config"][row] = num_config
+			buffers["t_ns"][row] = sec*1000000000 + n_sec
+			buffers["velocity"][row] = np.frombuffer(chunk, np.float32, self.n_cells, offset)
+			buffers["variance"][row] = np.frombuffer(chunk, np.float32, self.n_cells, offset+tab_size)
+			quality[row-self.size] = np.frombuffer(chunk, np.int32, self.n_cells, offset+2*tab_size)
+
+		# champs calculés en une passe sur tous les nouveaux profils
+		rows = slice(self.size, size)
+		variance = _numpy_fix_variance(buffers["variance"][rows])
+		np.sqrt(variance, out=buffers["amplitude"][rows])
+		buffers["snr"][rows] = _numpy_snr(quality)
+		buffers["sat"][rows] = _numpy_quality_field(quality, 8)
+		buffers["ny_jp"][rows] = _numpy_quality_field(quality, 16)
+		buffers["sigma"][rows] = _numpy_quality_field(quality, 24)
+		self.size = size
+		self.__update_views()
+
+	## \brief vide le batch (la capacité est conservée)
+	def clear(self):
+		self.size = 0
+		self.__update_views()
+
+
+## \brief tableau n° _index (0 : vitesse, 1 : variance, 2 : facteur qualité) d'un LazyProfile
+# décodeur NumPy : numpy.ndarray (float32 ou int32) vu dans le chunk, sinon memoryview sur ses octets
+def _lazy_array(_profile, _index, _dtype=None):
+	start = _chunk_header.size + _index*_profile.tab_size
+	if _profile.decoder == PROFILE_DECODER_NUMPY:
+		return np.frombuffer(_profile.data, _dtype or np.float32, _profile.tab_size//4, start)
+	return memoryview(_profile.data)[start:start+_profile.tab_size]
+
+# les décodeurs Python et stdlib donnent les mêmes valeurs : le décodage à la
+# demande utilise les fonctions stdlib pour les deux
+def _lazy_velocity(_profile):
+	if _profile.decoder == PROFILE_DECODER_NUMPY:
+		return _lazy_array(_profile, 0)
+	return _stdlib_float_array(_lazy_array(_profile, 0))
+
+def _lazy_variance(_profile):
+	if _profile.decoder == PROFILE_DECODER_NUMPY:
+		return _numpy_fix_variance(_lazy_array(_profile, 1).copy())
+	return _stdlib_variance(_lazy_array(_profile, 1))
+
+def _lazy_amplitude(_profile):
+	if _profile.decoder == PROFILE_DECODER_NUMPY:
+		return _numpy_amplitude(_profile.variance)
+	return _stdlib_amplitude(_profile.variance)
+
+def _lazy_snr(_profile):
+	if _profile.decoder == PROFILE_DECODER_NUMPY:
+		return _numpy_snr(_lazy_array(_profile, 2, np.int32))
+	return _stdlib_snr(_lazy_array(_profile, 2))
+
+def _lazy_quality_field(_profile, _shift):
+	if _profile.decoder == PROFILE_DECODER_NUMPY:
+		return _numpy_quality_field(_lazy_array(_profile, 2, np.int32), _shift)
+	return _stdlib_quality_field(_lazy_array(_profile, 2), _shift)
+
+## \brief données Doppler brutes d'un LazyProfile : (iq, I, Q)
+# décodeur NumPy : comme data_profile_t.set_doppler_view (iq (n_ech, n_vol, 2) int16, I et Q vues)
+# sinon : comme data_profile_t.set_doppler_from_binary (iq None, I et Q listes de array('f'))
+def _lazy_doppler(_profile):
+	if not (_profile.size_raw and _profile.n_ech):
+		return None, [], []
+	offset = _chunk_header.size + 3*_profile.tab_size
+	if _profile.decoder == PROFILE_DECODER_NUMPY:
+		iq = iq_view_numpy(_profile.data, offset, _profile.n_ech, _profile.n_vol_total)
+		return iq, iq[:, :, 0].T, iq[:, :, 1].T
+	I, Q = doppler_stdlib(_profile.data, offset, _profile.n_ech, _profile.n_vol_total)
+	return None, I, Q
+
+def _lazy_iq(_profile):
+	_profile.iq, _profile.I, _profile.Q = _lazy_doppler(_profile)
+	return _profile.iq
+
+def _lazy_I(_profile):
+	_lazy_iq(_profile)
+	return _profile.I
+
+def _lazy_Q(_profile):
+	_lazy_iq(_profile)
+	return _profile.Q
+
+# champs décodés au premier accès
+_lazy_fields = {
+	"velocity": _lazy_velocity,
+	"variance": _lazy_variance,
+	"amplitude": _lazy_amplitude,
+	"snr": _lazy_snr,
+	"sat": lambda _profile: _lazy_quality_field(_profile, 8),
+	"ny_jp": lambda _profile: _lazy_quality_field(_profile, 16),
+	"sigma": lambda _profile: _lazy_quality_field(_profile, 24),
+	"iq": _lazy_iq,
+	"I": _lazy_I,
+	"Q": _lazy_Q,
+}
+
+
+## \brief profil décodé à la demande
+# seul l'entête du chunk est lu à la création ; le chunk est conservé et chaque
+# champ (velocity, variance, amplitude, snr, sat, ny_jp, sigma, iq, I, Q) est
+# décodé lors de son premier accès, puis gardé. Les valeurs sont celles de
+# data_profile_t.interpret_chunk avec le même décodeur. Avec le décodeur NumPy,
+# velocity est une vue sur le chunk.
+# position est le tableau partagé de cell_positions (None sans _settings).
+#
+#   profile = LazyProfile(config, data)
+#   profile.amplitude # seuls variance et amplitude sont décodés
+class LazyProfile:
+	__slots__ = ("decoder", "data", "ref", "num_config", "t", "size_data", "size_raw", "tab_size", "n_vol_total", "n_ech", "position") \
+		+ tuple(_lazy_fields)
+
+	## \brief Constructeur
+	# @param _config dictionnaire de la configuration (n_vol, n_subvol, n_ech)
+	# @param _data chunk de profil (conservé, ne pas le modifier ensuite)
+	# @param _decoder un des PROFILE_DECODERS
+	# @param _settings dictionnaire des settings (ub_settings.read_settings), cf. cell_positions
+	def __init__(self, _config, _data, _decoder=PROFILE_DECODER_STDLIB, _settings=None):
+		self.decoder = resolve_profile_decoder(_decoder)
+		self.data = _data
+		self.ref, self.num_config, self.size_data, self.size_raw, sec, n_sec = parse_chunk_header(_data)
+		self.t = sec+n_sec*1e-9
+		self.tab_size = int(self.size_data/3)
+		self.n_vol_total = _config['n_vol']*_config['n_subvol']
+		self.n_ech = _config['n_ech']
+		self.position = cell_positions(self.ref, self.num_config, _settings) if _settings is not None else None
+
+	# appelé uniquement si le champ n'a pas encore été décodé (emplacement vide)
+	def __getattr__(self, _name):
+		decode = _lazy_fields.get(_name)
+		if decode is None:
+			raise AttributeError("'%s' object has no attribute '%s'"%(self.__class__.__name__, _name))
+		value = decode(self)
+		setattr(self, _name, value)
+		return value
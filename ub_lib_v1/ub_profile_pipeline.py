@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+# -*- coding: UTF_8 -*-
+# @copyright  this code is the property of Ubertone.
+# You may use this code for your personal, informational, non-commercial purpose.
+# You may not distribute, transmit, display, reproduce, publish, license, create derivative works from, transfer or sell any information, software, products or services based on this code.
+# @author Stéphane Fischer
+
+## @package ub_profile_pipeline
+#\brief Décodage et traitement des profils dans un pool de processus
+#
+# Avec les données Doppler brutes (size_raw > 0), le décodage et le traitement
+# des IQ occupent tout un coeur, partagé (GIL) avec le thread de réception.
+# ProfilePipeline confie les chunks à un pool de processus :
+# - chaque chunk est copié dans un emplacement libre d'un anneau de mémoire
+#   partagée (multiprocessing.shared_memory) : seuls le numéro de séquence,
+#   l'emplacement et la taille sont transmis au processus (pas de pickle du chunk)
+# - le processus construit un LazyProfile sur l'emplacement, sans copie, et
+#   retourne le résultat de la fonction de traitement (_process)
+# - les résultats sont rendus dans l'ordre de soumission
+#
+#   pipeline = ProfilePipeline(config, spectrum, _workers=4)
+#   pipeline.submit(data) # bloquant si tous les emplacements sont occupés
+#   result = pipeline.get()
+#   ...
+#   pipeline.stop()
+#
+# Les processus sont démarrés par forkserver (spawn sous Windows), jamais par
+# fork : le processus appelant a d'autres threads (réception, InstrumentHub,
+# scheduler ...) dont les locks seraient copiés dans un état quelconque.
+# La fonction de traitement doit donc être définie au niveau d'un module
+# importable (pickle).
+# Son résultat est sérialisé avant la libération de l'emplacement : il peut
+# contenir des vues sur le chunk (ex. profile.iq), elles sont copiées.
+
+import multiprocessing
+from multiprocessing import shared_memory
+from collections import deque
+from functools import partial
+from threading import Condition
+
+from ub_lib_v1.ub_class_template import UbClassTemplate, txt_regular_purple
+from ub_lib_v1.ub_profile import LazyProfile, PROFILE_FIELDS, PROFILE_DECODER_AUTO, resolve_profile_decoder
+
+# démarrage des processus du pool (cf. entête)
+if "forkserver" in multiprocessing.get_all_start_methods():
+	_pool_context = multiprocessing.get_context("forkserver")
+else:
+	_pool_context = multiprocessing.get_context("spawn")
+
+## \brief traitement par défaut : les tableaux décodés du profil
+# @return (ref, num_config, t, dictionnaire champ -> tableau)
+def profile_fields(_profile):
+	return _profile.ref, _profile.num_config, _profile.t, dict((field, getattr(_profile, field)) for field in PROFILE_FIELDS)
+
+## \brief taille maximale (octets) d'un chunk de profil de la configuration
+# @param _config dictionnaire de la configuration (n_vol, n_subvol, n_ech)
+def profile_chunk_size(_config):
+	n_cells = _config['n_vol']*_config['n_subvol']
+	# entête, vitesse, variance et facteur qualité, puis I et Q (int16) de chaque échantillon
+	return 20 + 3*4*n_cells + 2*2*n_cells*_config['n_ech']
+
+
+# état d'un processus du pool (cf. _worker_init)
+_worker = None
+
+class _worker_state:
+	def __init__(self, _shm_name, _slot_size, _config, _decoder, _process):
+		self.shm = shared_memory.SharedMemory(name=_shm_name)
+		self.slot_size = _slot_size
+		self.config = _config
+		self.decoder = _decoder
+		self.process = _process
+
+def _worker_init(_shm_name, _slot_size, _config, _decoder, _process):
+	global _worker
+	_worker = _worker_state(_shm_name, _slot_size, _config, _decoder, _process)
+
+## \brief décode et traite le chunk d'un emplacement (dans un processus du pool)
+def _worker_run(_slot, _size):
+	start = _slot*_worker.slot_size
+	return _worker.process(LazyProfile(_worker.config, _worker.shm.buf[start:start+_size], _worker.decoder))
+
+
+class ProfilePipeline(UbClassTemplate):
+	## \brief Constructeur
+	# @param _config dictionnaire de la configuration (n_vol, n_subvol, n_ech) des chunks
+	# @param _process fonction appelée dans les processus avec le LazyProfile du chunk
+	# @param _workers nombre de processus (0 : traitement dans le thread appelant submit)
+	# @param _slots nombre d'emplacements de l'anneau (chunks en cours de traitement)
+	# @param _slot_size taille d'un emplacement (par défaut la taille maximale d'un chunk de la configuration)
+	# @param _decoder décodeur des LazyProfile (cf. PROFILE_DECODERS)
+	def __init__(self, _config, _process=profile_fields, _workers=None, _slots=None, _slot_size=None, _decoder=PROFILE_DECODER_AUTO):
+		UbClassTemplate.__init__(self)
+		self.flag_debug_mess=False
+		self.debug_marker_start=txt_regular_purple
+
+		self.config = _config
+		self.process = _process
+		self.decoder = resolve_profile_decoder(_decoder)
+		self.workers = multiprocessing.cpu_count() if _workers is None else _workers
+		self.slot_count = _slots or max(4, 4*self.workers)
+		self.slot_size = _slot_size or profile_chunk_size(_config)
+
+		self.condition = Condition()
+		self.free_slots = deque(range(self.slot_count))
+		self.results = {} # numéro de séquence -> (succès, résultat ou exception)
+		self.next_seq = 0 # prochain chunk soumis
+		self.next_result = 0 # prochain résultat rendu
+
+		self.shm = None
+		self.pool = None
+		if self.workers:
+			self.shm = shared_memory.SharedMemory(create=True, size=self.slot_count*self.slot_size)
+			try:
+				self.pool = _pool_context.Pool(self.workers, _worker_init,
+					(self.shm.name, self.slot_size, self.config, self.decoder, self.process))
+			except:
+				self.shm.close()
+				self.shm.unlink()
+				raise
+
+	def __len__(self):
+		with self.condition:
+			return self.next_seq - self.next_result
+
+	## \brief confie un chunk au pool
+	# attend qu'un emplacement soit libre
+	def submit(self, _data):
+		size = len(_data)
+		if size > self.slot_size:
+			raise ValueError("chunk of %d bytes larger than a pipeline slot (%d bytes)"%(size, self.slot_size))
+
+		if not self.workers:
+			try:
+				result = (True, self.process(LazyProfile(self.config, _data, self.decoder)))
+			except Exception as exc:
+				result = (False, exc)
+			with self.condition:
+				self.results[self.next_seq] = result
+				self.next_seq += 1
+				self.condition.notify_all()
+			return
+		if self.pool is None:
+			raise ValueError("pipeline stopped")
+
+		with self.condition:
+			while not self.free_slots:
+				self.condition.wait()
+			slot = self.free_slots.popleft()
+			seq = self.next_seq
+			self.next_seq += 1
+		start = slot*self.slot_size
+		self.shm.buf[start:start+size] = _data
+		self.pool.apply_async(_worker_run, (slot, size),
+			callback=partial(self.__done, seq, slot, True), error_callback=partial(self.__done, seq, slot, False))
+
+	# appelé par le thread de résultats du pool
+	def __done(self, _seq, _slot, _success, _result):
+		with self.condition:
+			self.results[_seq] = (_success, _result)
+			self.free_slots.append(_slot)
+			self.condition.notify_all()
+
+	## \brief résultat suivant, dans l'ordre de soumission
+	# l'exception levée par le traitement du chunk est relancée
+	# @param _timeout attente maximale (s), None : attente sans limite
+	# @return le résultat, None si aucun résultat n'est disponible dans le délai
+	def get(self, _timeout=None):
+		with self.condition:
+			if not self.condition.wait_for(lambda: self.next_result in self.results, _timeout):
+				return None
+			success, result = self.results.pop(self.next_result)
+			self.next_result += 1
+		if not success:
+			raise result
+		return result
+
+	## \brief résultats disponibles immédiatement, dans l'ordre de soumission
+	# les résultats sont retirés un par un : après une exception (relancée) ou
+	# une itération interrompue, les suivants restent disponibles
+	def ready(self):
+		while True:
+			with self.condition:
+				if self.next_result not in self.results:
+					return
+				success, result = self.results.pop(self.next_result)
+				self.next_result += 1
+			if not success:
+				raise result
+			yield result
+
+	## \brief arrête les processus et libère la mémoire partagée
+	# les chunks soumis sont traités avant l'arrêt, leurs résultats restent disponibles
+	def stop(self):
+		if self.pool is None:
+			return
+		try:
+			self.pool.close()
+			self.pool.join()
+		finally:
+			# la mémoire partagée est libérée même si l'arrêt du pool échoue
+			self.pool = None
+			try:
+				self.shm.close()
+			finally:
+				self.shm.unlink()
+				self.shm = None
+		self.debug("pipeline stopped")
@@ -26,6 +26,10 @@ def read_settings (_path):
 		config['n_profile'] = config_xml.get_data("int","n_profile")
 		config['n_vol'] = config_xml.get_data("int","n_vol")
 		config['n_subvol'] = config_xml.get_data("int","n_subvol")
+		# positions des cellules (m), cf. ub_profile.cell_positions
+		config['r_vol1'] = config_xml.get_data("float","r_vol1")
+		config['r_dvol'] = config_xml.get_data("float","r_dvol")
+		config['r_dsubvol'] = config_xml.get_data("float","r_dsubvol") if config_xml.get_nb_elem("r_dsubvol") else None
 
 		settings['config%d'%(i+1)] = config
 